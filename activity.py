@@ -0,0 +1,143 @@
+"""Write-behind tracking of session (refresh token) activity.
+
+Access tokens carry the id of the refresh-token session they were issued
+for (`sid`). `get_current_user` calls `tracker.touch(sid, ip)` on every
+authenticated request. That only updates an in-memory dict, where repeated
+hits on one session coalesce into one entry holding the latest time and IP.
+
+`ActivityTracker` (started from `main.lifespan`) writes the buffer to
+`refresh_tokens.last_used_at` / `ip_address`:
+
+- every ACTIVITY_FLUSH_INTERVAL seconds, which bounds staleness;
+- sooner if ACTIVITY_MAX_PENDING sessions are waiting;
+- once more on shutdown.
+
+On Postgres a flush is one `UPDATE ... FROM (VALUES ...)` per 5000 sessions. On SQLite,
+which has no column list for VALUES aliases, it is one executemany on the
+single writer. `pending(sid)` lets readers such as `/sessions` show activity
+that is not flushed yet.
+"""
+import asyncio
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import Integer, bindparam, column, func, update, values
+
+from db import AsyncSessionLocal
+from models import IPAddress, RefreshToken, UTCDateTime
+
+logger = logging.getLogger(__name__)
+
+ACTIVITY_FLUSH_INTERVAL = float(os.environ.get("ACTIVITY_FLUSH_INTERVAL", "30"))
+ACTIVITY_MAX_PENDING = int(os.environ.get("ACTIVITY_MAX_PENDING", "5000"))
+_VALUES_CHUNK = 5000
+
+
+class ActivityTracker:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        flush_interval: float = ACTIVITY_FLUSH_INTERVAL,
+        max_pending: int = ACTIVITY_MAX_PENDING,
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # session id -> (last used, ip)
+        self._pending: dict[int, tuple[datetime, Optional[str]]] = {}
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def touch(self, session_id: int, ip: Optional[str] = None, when: Optional[datetime] = None) -> None:
+        """Record activity; no I/O."""
+        previous = self._pending.get(session_id)
+        self._pending[session_id] = (when or datetime.now(timezone.utc), ip or (previous[1] if previous else None))
+        if len(self._pending) >= self.max_pending and self._wake is not None:
+            self._wake.set()
+
+    def pending(self, session_id: int) -> Optional[tuple[datetime, Optional[str]]]:
+        """Unflushed (last used, ip) for a session, if any."""
+        return self._pending.get(session_id)
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="session-activity")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        # final flush so nothing buffered is lost on a clean shutdown
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Session activity flush failed")
+
+    async def flush(self) -> int:
+        """Write buffered activity; returns the number of sessions updated."""
+        if not self._pending:
+            return 0
+        batch, self._pending = self._pending, {}
+        rows = [(sid, ts, ip) for sid, (ts, ip) in batch.items()]
+        started = time.perf_counter()
+        try:
+            async with self.session_factory() as db:
+                if db.bind.dialect.name == "postgresql":
+                    # stay well below the 32767 bind parameter limit
+                    for i in range(0, len(rows), _VALUES_CHUNK):
+                        await db.execute(_update_from_values(rows[i:i + _VALUES_CHUNK]))
+                else:
+                    table = RefreshToken.__table__
+                    await db.execute(
+                        update(table)
+                        .where(table.c.id == bindparam("sid"))
+                        .values(
+                            last_used_at=bindparam("ts", type_=UTCDateTime()),
+                            ip_address=func.coalesce(bindparam("ip", type_=IPAddress()), table.c.ip_address),
+                        ),
+                        [{"sid": sid, "ts": ts, "ip": ip} for sid, ts, ip in rows],
+                    )
+                await db.commit()
+        except BaseException:
+            # put the batch back unless newer activity arrived meanwhile
+            for sid, entry in batch.items():
+                self._pending.setdefault(sid, entry)
+            raise
+        logger.debug("Flushed activity of %d sessions in %.1f ms", len(rows), (time.perf_counter() - started) * 1000)
+        return len(rows)
+
+
+def _update_from_values(rows: list[tuple]):
+    v = values(
+        column("sid", Integer), column("ts", UTCDateTime()), column("ip", IPAddress()), name="activity"
+    ).data(rows)
+    table = RefreshToken.__table__
+    return (
+        update(table)
+        .where(table.c.id == v.c.sid)
+        .values(last_used_at=v.c.ts, ip_address=func.coalesce(v.c.ip, table.c.ip_address))
+    )
+
+
+tracker = ActivityTracker()
@@ -7,7 +7,7 @@ from logging.config import fileConfig
 # (must be done before importing project modules)
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from sqlalchemy import pool
+from sqlalchemy import inspect, pool
 from sqlalchemy.engine import Connection
 from sqlalchemy.ext.asyncio import create_async_engine
 
@@ -40,7 +40,18 @@ def run_migrations_offline():
 
 
 def do_run_migrations(connection: Connection):
-    context.configure(connection=connection, target_metadata=target_metadata)
+    is_sqlite = connection.dialect.name == "sqlite"
+    # SQLite cannot ALTER constraints in place: batch mode recreates tables
+    context.configure(connection=connection, target_metadata=target_metadata, render_as_batch=is_sqlite)
+    if is_sqlite and not inspect(connection).get_table_names():
+        # The historical revisions assume a pre-existing Postgres schema, so a
+        # fresh SQLite database is built from the models and stamped at head;
+        # later revisions then apply on top of it as usual.
+        with context.begin_transaction():
+            target_metadata.create_all(connection)
+            context.get_context().stamp(context.script, "heads")
+        connection.commit()
+        return
     with context.begin_transaction():
         context.run_migrations()
 
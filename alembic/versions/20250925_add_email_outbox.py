@@ -0,0 +1,44 @@
+"""add email_outbox table
+
+Revision ID: email_outbox_20250925
+Revises: add_email_verification_20250924
+Create Date: 2025-09-25 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'email_outbox_20250925'
+down_revision = 'add_email_verification_20250924'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'email_outbox',
+        sa.Column('id', sa.Integer, primary_key=True, nullable=False),
+        sa.Column('to_email', sa.String(), nullable=False),
+        sa.Column('kind', sa.String(), nullable=False),
+        sa.Column('payload', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True, server_default=sa.func.now()),
+        sa.Column('available_at', sa.DateTime(timezone=True), nullable=False, server_default=sa.func.now()),
+        sa.Column('claimed_until', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('attempts', sa.Integer, nullable=False, server_default='0'),
+        sa.Column('last_error', sa.Text, nullable=True),
+        sa.Column('sent_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('failed_at', sa.DateTime(timezone=True), nullable=True),
+    )
+    # Partial index: the dispatcher only looks at undelivered rows
+    op.create_index(
+        'ix_email_outbox_pending',
+        'email_outbox',
+        ['available_at', 'id'],
+        postgresql_where=sa.text('sent_at IS NULL AND failed_at IS NULL'),
+        sqlite_where=sa.text('sent_at IS NULL AND failed_at IS NULL'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_email_outbox_pending', table_name='email_outbox')
+    op.drop_table('email_outbox')
@@ -0,0 +1,48 @@
+"""add todo change sequence and tombstones for delta sync
+
+Revision ID: todo_change_seq_20250926
+Revises: email_outbox_20250925
+Create Date: 2025-09-26 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'todo_change_seq_20250926'
+down_revision = 'email_outbox_20250925'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('users', sa.Column('todo_seq', sa.BigInteger(), nullable=False, server_default='0'))
+    op.add_column('todos', sa.Column('change_seq', sa.BigInteger(), nullable=False, server_default='0'))
+    # Existing rows get distinct per-owner numbers so the first sync can be paged
+    op.execute(
+        """
+        UPDATE todos SET change_seq = s.rn
+        FROM (SELECT id, row_number() OVER (PARTITION BY owner_id ORDER BY id) AS rn FROM todos) AS s
+        WHERE s.id = todos.id
+        """
+    )
+    op.create_index('ix_todos_owner_change_seq', 'todos', ['owner_id', 'change_seq'])
+    op.execute(
+        "UPDATE users SET todo_seq = COALESCE((SELECT max(change_seq) FROM todos WHERE todos.owner_id = users.id), 0)"
+    )
+    op.create_table(
+        'todo_tombstones',
+        sa.Column('id', sa.Integer, primary_key=True, nullable=False),
+        sa.Column('todo_id', sa.Integer, nullable=False),
+        sa.Column('owner_id', sa.Integer, sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('change_seq', sa.BigInteger(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True, server_default=sa.func.now()),
+    )
+    op.create_index('ix_todo_tombstones_owner_change_seq', 'todo_tombstones', ['owner_id', 'change_seq'])
+
+
+def downgrade():
+    op.drop_index('ix_todo_tombstones_owner_change_seq', table_name='todo_tombstones')
+    op.drop_table('todo_tombstones')
+    op.drop_index('ix_todos_owner_change_seq', table_name='todos')
+    op.drop_column('todos', 'change_seq')
+    op.drop_column('users', 'todo_seq')
@@ -0,0 +1,58 @@
+"""add todos.position for manual ordering
+
+Revision ID: todo_position_20250927
+Revises: todo_change_seq_20250926
+Create Date: 2025-09-27 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'todo_position_20250927'
+down_revision = 'todo_change_seq_20250926'
+branch_labels = None
+depends_on = None
+
+# Same alphabet as positions.DIGITS; copied so the migration does not depend on app code
+_DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+
+
+def _spread_keys(count):
+    width = 1
+    while 36 ** width < (count + 1) * 2:
+        width += 1
+    step = 36 ** width // (count + 1)
+    keys = []
+    for i in range(1, count + 1):
+        n = i * step
+        if n % 36 == 0:
+            n += 1
+        digits = []
+        for _ in range(width):
+            n, d = divmod(n, 36)
+            digits.append(_DIGITS[d])
+        keys.append("".join(reversed(digits)))
+    return keys
+
+
+def upgrade():
+    op.add_column('todos', sa.Column('position', sa.String(), nullable=True))
+    # Existing lists keep their creation order
+    conn = op.get_bind()
+    rows = conn.execute(sa.text('SELECT id, owner_id FROM todos ORDER BY owner_id, created_at, id')).fetchall()
+    by_owner = {}
+    for todo_id, owner_id in rows:
+        by_owner.setdefault(owner_id, []).append(todo_id)
+    updates = []
+    for ids in by_owner.values():
+        updates.extend({'id': todo_id, 'position': key} for todo_id, key in zip(ids, _spread_keys(len(ids))))
+    if updates:
+        conn.execute(sa.text('UPDATE todos SET position = :position WHERE id = :id'), updates)
+    with op.batch_alter_table('todos') as batch:
+        batch.alter_column('position', existing_type=sa.String(), nullable=False)
+    op.create_index('ix_todos_owner_position', 'todos', ['owner_id', 'position', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_todos_owner_position', table_name='todos')
+    op.drop_column('todos', 'position')
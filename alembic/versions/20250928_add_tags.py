@@ -0,0 +1,37 @@
+"""add tags and todo_tags
+
+Revision ID: tags_20250928
+Revises: todo_position_20250927
+Create Date: 2025-09-28 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'tags_20250928'
+down_revision = 'todo_position_20250927'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'tags',
+        sa.Column('id', sa.Integer(), primary_key=True),
+        sa.Column('owner_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('todo_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.UniqueConstraint('owner_id', 'name', name='uq_tags_owner_name'),
+    )
+    op.create_table(
+        'todo_tags',
+        sa.Column('tag_id', sa.Integer(), sa.ForeignKey('tags.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('todo_id', sa.Integer(), sa.ForeignKey('todos.id', ondelete='CASCADE'), primary_key=True),
+    )
+    op.create_index('ix_todo_tags_todo_id', 'todo_tags', ['todo_id'])
+
+
+def downgrade():
+    op.drop_index('ix_todo_tags_todo_id', table_name='todo_tags')
+    op.drop_table('todo_tags')
+    op.drop_table('tags')
@@ -0,0 +1,32 @@
+"""add todos.due_at / remind_at
+
+Revision ID: todo_reminders_20250929
+Revises: tags_20250928
+Create Date: 2025-09-29 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'todo_reminders_20250929'
+down_revision = 'tags_20250928'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('todos', sa.Column('due_at', sa.DateTime(timezone=True), nullable=True))
+    op.add_column('todos', sa.Column('remind_at', sa.DateTime(timezone=True), nullable=True))
+    op.create_index(
+        'ix_todos_pending_reminders',
+        'todos',
+        ['remind_at', 'id'],
+        postgresql_where=sa.text('remind_at IS NOT NULL AND is_done = false'),
+        sqlite_where=sa.text('remind_at IS NOT NULL AND is_done = 0'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_todos_pending_reminders', table_name='todos')
+    op.drop_column('todos', 'remind_at')
+    op.drop_column('todos', 'due_at')
@@ -0,0 +1,61 @@
+"""add audit_events (partitioned by month on Postgres)
+
+Revision ID: audit_events_20250930
+Revises: todo_reminders_20250929
+Create Date: 2025-09-30 00:00:00.000000
+"""
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'audit_events_20250930'
+down_revision = 'todo_reminders_20250929'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+    if is_postgres:
+        id_column = sa.Column('id', sa.BigInteger(), sa.Identity(), nullable=False)
+    else:
+        id_column = sa.Column('id', sa.Integer(), nullable=False)
+    columns = [
+        id_column,
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('actor_id', sa.Integer(), nullable=True),
+        sa.Column('action', sa.String(), nullable=False),
+        sa.Column('target_type', sa.String(), nullable=False),
+        sa.Column('target_id', sa.Integer(), nullable=True),
+        sa.Column('data', sa.JSON(), nullable=True),
+        sa.Column('ip_address', sa.String(), nullable=True),
+    ]
+    if is_postgres:
+        # the partition key must be part of the primary key
+        op.create_table(
+            'audit_events', *columns,
+            sa.PrimaryKeyConstraint('id', 'created_at'),
+            postgresql_partition_by='RANGE (created_at)',
+        )
+        # partitions for the current and the next month; later ones are
+        # created by audit.AuditLog on first use
+        start = datetime.now(timezone.utc).replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        for _ in range(2):
+            end = start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+            op.execute(
+                f"CREATE TABLE IF NOT EXISTS audit_events_{start:%Y_%m} PARTITION OF audit_events "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+            )
+            start = end
+    else:
+        op.create_table('audit_events', *columns, sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_audit_events_created_id', 'audit_events', ['created_at', 'id'])
+    op.create_index('ix_audit_events_actor', 'audit_events', ['actor_id', 'created_at', 'id'])
+    op.create_index('ix_audit_events_target', 'audit_events', ['target_type', 'target_id', 'created_at', 'id'])
+
+
+def downgrade():
+    # dropping the parent drops every partition and index
+    op.drop_table('audit_events')
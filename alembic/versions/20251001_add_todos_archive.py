@@ -0,0 +1,56 @@
+"""add todos_archive (partitioned by completion month on Postgres)
+
+Revision ID: todos_archive_20251001
+Revises: audit_events_20250930
+Create Date: 2025-10-01 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'todos_archive_20251001'
+down_revision = 'audit_events_20250930'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+    columns = [
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('title', sa.String(), nullable=False),
+        sa.Column('description', sa.Text(), nullable=True),
+        sa.Column('owner_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('is_done', sa.Boolean(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('updated_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('completed_at', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('completed_by', sa.Integer(), nullable=True),
+        sa.Column('position', sa.String(), nullable=False),
+        sa.Column('due_at', sa.DateTime(timezone=True), nullable=True),
+        sa.Column('tags', sa.JSON(), nullable=False),
+        sa.Column('archived_at', sa.DateTime(timezone=True), nullable=False),
+    ]
+    if is_postgres:
+        # the partition key must be part of the primary key; partitions are
+        # created by archive.Archiver for each completion month it moves
+        op.create_table(
+            'todos_archive', *columns,
+            sa.PrimaryKeyConstraint('id', 'completed_at'),
+            postgresql_partition_by='RANGE (completed_at)',
+        )
+    else:
+        op.create_table('todos_archive', *columns, sa.PrimaryKeyConstraint('id'))
+    op.create_index('ix_todos_archive_owner_completed', 'todos_archive', ['owner_id', 'completed_at', 'id'])
+    op.create_index(
+        'ix_todos_done_completed_at',
+        'todos',
+        ['completed_at'],
+        postgresql_where=sa.text('is_done = true'),
+        sqlite_where=sa.text('is_done = 1'),
+    )
+
+
+def downgrade():
+    op.drop_index('ix_todos_done_completed_at', table_name='todos')
+    op.drop_table('todos_archive')
@@ -0,0 +1,127 @@
+"""opt-in: partition refresh_tokens by issued_at month (Postgres)
+
+Runs only on Postgres with REFRESH_TOKENS_PARTITIONED=1 (true/yes) in the
+environment; otherwise it is a no-op and the table stays as it is.
+
+The partitioned table cannot have a unique index on token_hash or id alone:
+the primary key becomes (id, issued_at), token_hash is unique together with
+issued_at, and the self-referencing fk_refresh_replaced_by is dropped.
+Refresh tokens carry their issue month ("YYYYMM." prefix, see
+auth.generate_raw_refresh_token), so hash lookups still hit one partition.
+The table is copied in one transaction; plan a maintenance window for large
+tables.
+
+Revision ID: refresh_tokens_partitioned_20251002
+Revises: todos_archive_20251001
+Create Date: 2025-10-02 00:00:00.000000
+"""
+import os
+from datetime import datetime, timezone
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'refresh_tokens_partitioned_20251002'
+down_revision = 'todos_archive_20251001'
+branch_labels = None
+depends_on = None
+
+_COLUMNS = (
+    'id, user_id, token_hash, issued_at, expires_at, last_used_at, revoked, '
+    'device_id, device_type, user_agent, ip_address, replaced_by_id'
+)
+_INDEXES = (
+    ('ix_refresh_tokens_user_id', 'user_id'),
+    ('ix_refresh_tokens_device_type', 'device_type'),
+    ('ix_refresh_tokens_expires_at', 'expires_at'),
+)
+
+
+def _enabled(conn):
+    flag = os.environ.get('REFRESH_TOKENS_PARTITIONED', '').lower() in ('1', 'true', 'yes')
+    return flag and conn.dialect.name == 'postgresql'
+
+
+def _is_partitioned(conn):
+    return conn.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'refresh_tokens'"
+    )).first() is not None
+
+
+def _month(value):
+    return value.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def _next_month(start):
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+
+def upgrade():
+    conn = op.get_bind()
+    if not _enabled(conn) or _is_partitioned(conn):
+        return
+    sequence = conn.execute(sa.text("SELECT pg_get_serial_sequence('refresh_tokens', 'id')")).scalar()
+    op.execute(
+        'CREATE TABLE refresh_tokens_partitioned '
+        '(LIKE refresh_tokens INCLUDING DEFAULTS INCLUDING CONSTRAINTS) '
+        'PARTITION BY RANGE (issued_at)'
+    )
+    op.execute('ALTER TABLE refresh_tokens_partitioned ALTER COLUMN issued_at SET NOT NULL')
+    # one partition per month from the oldest token up to two months ahead
+    oldest = conn.execute(sa.text('SELECT min(coalesce(issued_at, now())) FROM refresh_tokens')).scalar()
+    if oldest is not None and oldest.tzinfo is None:
+        oldest = oldest.replace(tzinfo=timezone.utc)
+    now = datetime.now(timezone.utc)
+    start, end = _month(oldest or now), _next_month(_next_month(_month(now)))
+    while start <= end:
+        op.execute(
+            f"CREATE TABLE refresh_tokens_{start:%Y_%m} PARTITION OF refresh_tokens_partitioned "
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{_next_month(start).isoformat()}')"
+        )
+        start = _next_month(start)
+    op.execute(
+        f'INSERT INTO refresh_tokens_partitioned ({_COLUMNS}) '
+        f'SELECT {_COLUMNS.replace("issued_at", "coalesce(issued_at, now())")} FROM refresh_tokens'
+    )
+    if sequence:
+        op.execute(f'ALTER SEQUENCE {sequence} OWNED BY refresh_tokens_partitioned.id')
+    op.execute('DROP TABLE refresh_tokens')
+    op.execute('ALTER TABLE refresh_tokens_partitioned RENAME TO refresh_tokens')
+    op.execute('ALTER TABLE refresh_tokens ADD CONSTRAINT refresh_tokens_pkey PRIMARY KEY (id, issued_at)')
+    op.execute(
+        'ALTER TABLE refresh_tokens ADD CONSTRAINT uq_refresh_tokens_token_hash_issued_at '
+        'UNIQUE (token_hash, issued_at)'
+    )
+    op.execute(
+        'ALTER TABLE refresh_tokens ADD CONSTRAINT fk_refresh_tokens_user_id_users '
+        'FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE'
+    )
+    for name, column in _INDEXES:
+        op.create_index(name, 'refresh_tokens', [column])
+
+
+def downgrade():
+    conn = op.get_bind()
+    if conn.dialect.name != 'postgresql' or not _is_partitioned(conn):
+        return
+    sequence = conn.execute(sa.text("SELECT pg_get_serial_sequence('refresh_tokens', 'id')")).scalar()
+    op.execute('CREATE TABLE refresh_tokens_plain (LIKE refresh_tokens INCLUDING DEFAULTS INCLUDING CONSTRAINTS)')
+    op.execute(f'INSERT INTO refresh_tokens_plain ({_COLUMNS}) SELECT {_COLUMNS} FROM refresh_tokens')
+    if sequence:
+        op.execute(f'ALTER SEQUENCE {sequence} OWNED BY refresh_tokens_plain.id')
+    op.execute('DROP TABLE refresh_tokens')
+    op.execute('ALTER TABLE refresh_tokens_plain RENAME TO refresh_tokens')
+    op.execute('ALTER TABLE refresh_tokens ADD CONSTRAINT refresh_tokens_pkey PRIMARY KEY (id)')
+    op.create_index('ix_refresh_tokens_id', 'refresh_tokens', ['id'])
+    op.create_index('ix_refresh_tokens_token_hash', 'refresh_tokens', ['token_hash'], unique=True)
+    op.execute(
+        'ALTER TABLE refresh_tokens ADD CONSTRAINT fk_refresh_tokens_user_id_users '
+        'FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE'
+    )
+    op.create_foreign_key(
+        'fk_refresh_replaced_by', 'refresh_tokens', 'refresh_tokens', ['replaced_by_id'], ['id'], ondelete='SET NULL'
+    )
+    for name, column in _INDEXES:
+        op.create_index(name, 'refresh_tokens', [column])
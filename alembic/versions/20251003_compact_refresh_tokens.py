@@ -0,0 +1,206 @@
+"""compact refresh_tokens: binary token hash, user agent dictionary, inet ip
+
+- token_hash: 64-char hex text -> 32 raw bytes (bytea / BLOB);
+- user_agent: repeated text -> user_agent_id referencing the new
+  `user_agents` dictionary (unique on a 16-byte digest of the string);
+- ip_address: text -> INET on Postgres, 4/16 packed bytes elsewhere
+  (values that are not an address become NULL).
+
+On Postgres the conversion runs online. New columns are added next to the
+old ones, and existing rows are backfilled in autocommit batches of
+REFRESH_TOKENS_BACKFILL_BATCH rows, so the running (old) application keeps
+working. The unique index on the new hash is built CONCURRENTLY, except on
+the partitioned layout (20251002), where Postgres does not allow that. The
+final swap takes a short ACCESS EXCLUSIVE lock: it converts the rows written
+since the backfill, drops the old columns and renames the new ones. Deploy
+the new application right after it. SQLite databases are converted in the
+migration transaction.
+
+Revision ID: compact_refresh_tokens_20251003
+Revises: refresh_tokens_partitioned_20251002
+Create Date: 2025-10-03 00:00:00.000000
+"""
+import hashlib
+import ipaddress
+import os
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+# revision identifiers, used by Alembic.
+revision = 'compact_refresh_tokens_20251003'
+down_revision = 'refresh_tokens_partitioned_20251002'
+branch_labels = None
+depends_on = None
+
+_BATCH = int(os.environ.get('REFRESH_TOKENS_BACKFILL_BATCH', '5000'))
+
+
+def _ua_digest(value):
+    # same as crud.user_agent_digest
+    return hashlib.blake2b(value.encode(), digest_size=16).digest()
+
+
+def _ip(value, is_postgres):
+    try:
+        addr = ipaddress.ip_address(value.strip())
+    except (AttributeError, ValueError):
+        return None
+    return str(addr) if is_postgres else addr.packed
+
+
+def _is_partitioned(conn):
+    return conn.execute(sa.text(
+        "SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid "
+        "WHERE c.relname = 'refresh_tokens'"
+    )).first() is not None
+
+
+def _backfill(conn, is_postgres):
+    """Convert rows whose token_digest is still NULL, _BATCH rows at a time."""
+    last_id = 0
+    while True:
+        rows = conn.execute(
+            sa.text(
+                'SELECT id, token_hash, user_agent, ip_address FROM refresh_tokens '
+                'WHERE token_digest IS NULL AND id > :last ORDER BY id LIMIT :n'
+            ),
+            {'last': last_id, 'n': _BATCH},
+        ).all()
+        if not rows:
+            return
+        agents = {_ua_digest(ua): ua for _, _, ua, _ in rows if ua}
+        ua_ids = {}
+        if agents:
+            conn.execute(
+                sa.text('INSERT INTO user_agents (digest, value) VALUES (:d, :v) ON CONFLICT (digest) DO NOTHING'),
+                [{'d': d, 'v': v} for d, v in agents.items()],
+            )
+            ua_ids = dict(
+                conn.execute(
+                    sa.text('SELECT digest, id FROM user_agents WHERE digest IN :ds').bindparams(
+                        sa.bindparam('ds', expanding=True)
+                    ),
+                    {'ds': list(agents)},
+                ).all()
+            )
+            ua_ids = {bytes(d): i for d, i in ua_ids.items()}
+        conn.execute(
+            sa.text('UPDATE refresh_tokens SET token_digest = :h, user_agent_id = :u, ip = :ip WHERE id = :id'),
+            [
+                {
+                    'id': id_,
+                    'h': bytes.fromhex(token_hash),
+                    'u': ua_ids.get(_ua_digest(ua)) if ua else None,
+                    'ip': _ip(ip, is_postgres),
+                }
+                for id_, token_hash, ua, ip in rows
+            ],
+        )
+        last_id = rows[-1][0]
+
+
+def upgrade():
+    conn = op.get_bind()
+    is_postgres = conn.dialect.name == 'postgresql'
+    partitioned = is_postgres and _is_partitioned(conn)
+    op.create_table(
+        'user_agents',
+        sa.Column('id', sa.Integer(), primary_key=True, nullable=False),
+        sa.Column('digest', sa.LargeBinary(16), nullable=False),
+        sa.Column('value', sa.Text(), nullable=False),
+        sa.UniqueConstraint('digest', name='uq_user_agents_digest'),
+    )
+    op.add_column('refresh_tokens', sa.Column('token_digest', sa.LargeBinary(32), nullable=True))
+    op.add_column('refresh_tokens', sa.Column('user_agent_id', sa.Integer(), nullable=True))
+    ip_type = postgresql.INET() if is_postgres else sa.LargeBinary(16)
+    op.add_column('refresh_tokens', sa.Column('ip', ip_type, nullable=True))
+
+    if not is_postgres:
+        _backfill(conn, is_postgres)
+        with op.batch_alter_table('refresh_tokens') as batch:
+            batch.drop_index('ix_refresh_tokens_token_hash')
+            batch.drop_column('token_hash')
+            batch.drop_column('user_agent')
+            batch.drop_column('ip_address')
+            batch.alter_column('token_digest', new_column_name='token_hash', nullable=False)
+            batch.alter_column('ip', new_column_name='ip_address')
+            batch.create_foreign_key('fk_refresh_tokens_user_agent_id', 'user_agents', ['user_agent_id'], ['id'])
+        op.create_index('ix_refresh_tokens_token_hash', 'refresh_tokens', ['token_hash'], unique=True)
+        return
+
+    op.create_foreign_key('fk_refresh_tokens_user_agent_id', 'refresh_tokens', 'user_agents', ['user_agent_id'], ['id'])
+
+    with op.get_context().autocommit_block():
+        _backfill(conn, is_postgres)
+        if not partitioned:
+            op.execute(
+                'CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS ix_refresh_tokens_token_digest '
+                'ON refresh_tokens (token_digest)'
+            )
+    # swap: rows written by the old application since the backfill, then the columns
+    op.execute('LOCK TABLE refresh_tokens IN ACCESS EXCLUSIVE MODE')
+    _backfill(conn, is_postgres)
+    op.drop_column('refresh_tokens', 'token_hash')
+    op.drop_column('refresh_tokens', 'user_agent')
+    op.drop_column('refresh_tokens', 'ip_address')
+    op.alter_column('refresh_tokens', 'token_digest', new_column_name='token_hash', nullable=False)
+    op.alter_column('refresh_tokens', 'ip', new_column_name='ip_address')
+    if partitioned:
+        op.execute(
+            'ALTER TABLE refresh_tokens ADD CONSTRAINT uq_refresh_tokens_token_hash_issued_at '
+            'UNIQUE (token_hash, issued_at)'
+        )
+    else:
+        op.execute('ALTER INDEX ix_refresh_tokens_token_digest RENAME TO ix_refresh_tokens_token_hash')
+
+
+def downgrade():
+    conn = op.get_bind()
+    is_postgres = conn.dialect.name == 'postgresql'
+    partitioned = is_postgres and _is_partitioned(conn)
+    op.add_column('refresh_tokens', sa.Column('token_hex', sa.String(length=255), nullable=True))
+    op.add_column('refresh_tokens', sa.Column('user_agent_text', sa.Text(), nullable=True))
+    op.add_column('refresh_tokens', sa.Column('ip_text', sa.String(length=100), nullable=True))
+    agents = dict(conn.execute(sa.text('SELECT id, value FROM user_agents')).all())
+    rows = conn.execute(sa.text('SELECT id, token_hash, user_agent_id, ip_address FROM refresh_tokens')).all()
+    if rows:
+        conn.execute(
+            sa.text('UPDATE refresh_tokens SET token_hex = :h, user_agent_text = :u, ip_text = :ip WHERE id = :id'),
+            [
+                {
+                    'id': id_,
+                    'h': bytes(token_hash).hex(),
+                    'u': agents.get(ua_id),
+                    'ip': None if ip is None else str(ip) if is_postgres else str(ipaddress.ip_address(bytes(ip))),
+                }
+                for id_, token_hash, ua_id, ip in rows
+            ],
+        )
+    if not is_postgres:
+        with op.batch_alter_table('refresh_tokens') as batch:
+            batch.drop_index('ix_refresh_tokens_token_hash')
+            batch.drop_column('token_hash')
+            batch.drop_column('user_agent_id')
+            batch.drop_column('ip_address')
+            batch.alter_column('token_hex', new_column_name='token_hash', nullable=False)
+            batch.alter_column('user_agent_text', new_column_name='user_agent')
+            batch.alter_column('ip_text', new_column_name='ip_address')
+        op.create_index('ix_refresh_tokens_token_hash', 'refresh_tokens', ['token_hash'], unique=True)
+    else:
+        op.drop_constraint('fk_refresh_tokens_user_agent_id', 'refresh_tokens', type_='foreignkey')
+        op.drop_column('refresh_tokens', 'token_hash')
+        op.drop_column('refresh_tokens', 'user_agent_id')
+        op.drop_column('refresh_tokens', 'ip_address')
+        op.alter_column('refresh_tokens', 'token_hex', new_column_name='token_hash', nullable=False)
+        op.alter_column('refresh_tokens', 'user_agent_text', new_column_name='user_agent')
+        op.alter_column('refresh_tokens', 'ip_text', new_column_name='ip_address')
+        if partitioned:
+            op.execute(
+                'ALTER TABLE refresh_tokens ADD CONSTRAINT uq_refresh_tokens_token_hash_issued_at '
+                'UNIQUE (token_hash, issued_at)'
+            )
+        else:
+            op.create_index('ix_refresh_tokens_token_hash', 'refresh_tokens', ['token_hash'], unique=True)
+    op.drop_table('user_agents')
@@ -0,0 +1,42 @@
+"""add subtasks: todos.parent_id, materialized path and progress counters
+
+Revision ID: subtasks_20251004
+Revises: compact_refresh_tokens_20251003
+Create Date: 2025-10-04 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'subtasks_20251004'
+down_revision = 'compact_refresh_tokens_20251003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+    op.add_column('todos', sa.Column('parent_id', sa.Integer(), nullable=True))
+    op.add_column('todos', sa.Column('path', sa.String(), nullable=False, server_default='/'))
+    op.add_column('todos', sa.Column('subtasks_total', sa.Integer(), nullable=False, server_default='0'))
+    op.add_column('todos', sa.Column('subtasks_done', sa.Integer(), nullable=False, server_default='0'))
+    if is_postgres:
+        # SQLite cannot add a constraint to an existing table; fresh SQLite
+        # databases get it from the models
+        op.create_foreign_key(
+            'fk_todos_parent_id_todos', 'todos', 'todos', ['parent_id'], ['id'], ondelete='CASCADE'
+        )
+    op.create_index('ix_todos_parent_id', 'todos', ['parent_id'])
+    op.add_column('todos_archive', sa.Column('parent_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+    op.drop_column('todos_archive', 'parent_id')
+    op.drop_index('ix_todos_parent_id', table_name='todos')
+    if is_postgres:
+        op.drop_constraint('fk_todos_parent_id_todos', 'todos', type_='foreignkey')
+    op.drop_column('todos', 'subtasks_done')
+    op.drop_column('todos', 'subtasks_total')
+    op.drop_column('todos', 'path')
+    op.drop_column('todos', 'parent_id')
@@ -0,0 +1,60 @@
+"""add shared lists: todo_lists, list_members and todos.list_id
+
+Revision ID: shared_lists_20251005
+Revises: subtasks_20251004
+Create Date: 2025-10-05 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'shared_lists_20251005'
+down_revision = 'subtasks_20251004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+    op.create_table(
+        'todo_lists',
+        sa.Column('id', sa.Integer(), primary_key=True, nullable=False),
+        sa.Column('owner_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), nullable=False),
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('created_at', sa.DateTime(timezone=True), nullable=True),
+    )
+    op.create_index('ix_todo_lists_owner_id', 'todo_lists', ['owner_id'])
+    # primary key (user_id, list_id): the lists shared with a user are one index range
+    op.create_table(
+        'list_members',
+        sa.Column('user_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('list_id', sa.Integer(), sa.ForeignKey('todo_lists.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('role', sa.String(), nullable=False),
+    )
+    op.create_index('ix_list_members_list_id', 'list_members', ['list_id'])
+    op.add_column('todos', sa.Column('list_id', sa.Integer(), nullable=True))
+    if is_postgres:
+        # SQLite cannot add a constraint to an existing table; fresh SQLite
+        # databases get it from the models
+        op.create_foreign_key(
+            'fk_todos_list_id_todo_lists', 'todos', 'todo_lists', ['list_id'], ['id'], ondelete='SET NULL'
+        )
+    op.create_index('ix_todos_list_id', 'todos', ['list_id'])
+    op.add_column('todos_archive', sa.Column('list_id', sa.Integer(), nullable=True))
+
+
+def downgrade():
+    is_postgres = op.get_bind().dialect.name == 'postgresql'
+    op.drop_column('todos_archive', 'list_id')
+    op.drop_index('ix_todos_list_id', table_name='todos')
+    if is_postgres:
+        op.drop_constraint('fk_todos_list_id_todo_lists', 'todos', type_='foreignkey')
+        op.drop_column('todos', 'list_id')
+    else:
+        # the column may carry the models' FK, which SQLite cannot drop in place
+        with op.batch_alter_table('todos') as batch:
+            batch.drop_column('list_id')
+    op.drop_index('ix_list_members_list_id', table_name='list_members')
+    op.drop_table('list_members')
+    op.drop_index('ix_todo_lists_owner_id', table_name='todo_lists')
+    op.drop_table('todo_lists')
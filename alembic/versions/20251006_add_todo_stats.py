@@ -0,0 +1,38 @@
+"""add todo stats rollups: todo_stats and todo_stats_daily
+
+The rollups start empty; run scripts/backfill_todo_stats.py after deploying
+the application that maintains them.
+
+Revision ID: todo_stats_20251006
+Revises: shared_lists_20251005
+Create Date: 2025-10-06 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'todo_stats_20251006'
+down_revision = 'shared_lists_20251005'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'todo_stats',
+        sa.Column('owner_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('open_count', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('done_count', sa.Integer(), nullable=False, server_default='0'),
+    )
+    op.create_table(
+        'todo_stats_daily',
+        sa.Column('owner_id', sa.Integer(), sa.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
+        sa.Column('day', sa.Date(), primary_key=True),
+        sa.Column('created', sa.Integer(), nullable=False, server_default='0'),
+        sa.Column('completed', sa.Integer(), nullable=False, server_default='0'),
+    )
+
+
+def downgrade():
+    op.drop_table('todo_stats_daily')
+    op.drop_table('todo_stats')
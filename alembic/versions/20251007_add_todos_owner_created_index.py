@@ -0,0 +1,21 @@
+"""add index on todos (owner_id, created_at, id) for the default GET /todos sort
+
+Revision ID: query_guardrails_20251007
+Revises: todo_stats_20251006
+Create Date: 2025-10-07 00:00:00.000000
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'query_guardrails_20251007'
+down_revision = 'todo_stats_20251006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_todos_owner_created', 'todos', ['owner_id', 'created_at', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_todos_owner_created', table_name='todos')
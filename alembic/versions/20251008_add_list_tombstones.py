@@ -0,0 +1,24 @@
+"""add todo_tombstones.list_id: delta sync of shared lists for their members
+
+Revision ID: list_sync_20251008
+Revises: query_guardrails_20251007
+Create Date: 2025-10-08 00:00:00.000000
+"""
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision = 'list_sync_20251008'
+down_revision = 'query_guardrails_20251007'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('todo_tombstones', sa.Column('list_id', sa.Integer(), nullable=True))
+    op.create_index('ix_todo_tombstones_list_change_seq', 'todo_tombstones', ['list_id', 'change_seq'])
+
+
+def downgrade():
+    op.drop_index('ix_todo_tombstones_list_change_seq', table_name='todo_tombstones')
+    op.drop_column('todo_tombstones', 'list_id')
@@ -0,0 +1,26 @@
+"""index todos on (owner_id, id) so GET /todos?sort_by=id is index-backed
+
+ix_todos_owner_id covered only owner_id; on Postgres an id-ordered page of
+a large owner had to sort all of the owner's rows.
+
+Revision ID: owner_id_sort_20251009
+Revises: list_sync_20251008
+Create Date: 2025-10-09 00:00:00.000000
+"""
+from alembic import op
+
+# revision identifiers, used by Alembic.
+revision = 'owner_id_sort_20251009'
+down_revision = 'list_sync_20251008'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.drop_index('ix_todos_owner_id', table_name='todos')
+    op.create_index('ix_todos_owner_id', 'todos', ['owner_id', 'id'])
+
+
+def downgrade():
+    op.drop_index('ix_todos_owner_id', table_name='todos')
+    op.create_index('ix_todos_owner_id', 'todos', ['owner_id'])
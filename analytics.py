@@ -0,0 +1,221 @@
+"""Fleet-wide todo analytics for admins (`GET /admin/analytics`, scripts/todo_analytics.py).
+
+Computes, over live and archived todos:
+
+- the distribution of time to completion (`completed_at - created_at`):
+  count, mean, percentiles and a histogram over fixed buckets;
+- the share of live todos that changed owner at least once: a live todo
+  with a tombstone (todo_sync.py) was reassigned, since deleting it would
+  have removed it;
+- the busiest owners: top-k by number of todos, with their done counts.
+
+The columns are streamed with a server-side cursor in ANALYTICS_CHUNK_SIZE
+rows and folded into NumPy accumulators whose size depends on the largest
+ids, not on the number of rows scanned:
+
+- durations go into a histogram with ANALYTICS_PERCENTILE_BINS log-spaced
+  bins (1 s to 10 years); percentiles are read from it, accurate to about a
+  percent;
+- per-owner counts are `np.bincount` arrays indexed by user id;
+- todo ids are bitmaps, one bit per id.
+
+A result is cached for ANALYTICS_CACHE_TTL seconds, and concurrent requests
+wait for the one computation in progress. NumPy (2.0 or later, for
+`np.bitwise_count`) is optional for the rest of the application; without it
+`compute` raises RuntimeError.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import func, select
+
+from models import Todo, TodoArchive, TodoTombstone
+
+try:
+    import numpy as np
+except ImportError:  # optional
+    np = None
+
+ANALYTICS_CHUNK_SIZE = int(os.environ.get("ANALYTICS_CHUNK_SIZE", "50000"))
+ANALYTICS_CACHE_TTL = float(os.environ.get("ANALYTICS_CACHE_TTL", "300"))
+ANALYTICS_PERCENTILE_BINS = int(os.environ.get("ANALYTICS_PERCENTILE_BINS", "4096"))
+ANALYTICS_MAX_TOP = int(os.environ.get("ANALYTICS_MAX_TOP", "100"))
+
+PERCENTILES = (50, 75, 90, 95, 99)
+_MINUTE, _HOUR, _DAY = 60, 3600, 86400
+# upper bounds of the reported histogram buckets, seconds; the last one is open
+HISTOGRAM_BUCKETS = (
+    _MINUTE, 5 * _MINUTE, 15 * _MINUTE, _HOUR, 4 * _HOUR, _DAY, 3 * _DAY, 7 * _DAY,
+    14 * _DAY, 30 * _DAY, 90 * _DAY, 365 * _DAY,
+)
+_MAX_SECONDS = 10 * 365 * _DAY
+
+
+def _duration_seconds(dialect: str, model):
+    """SQL expression: completed_at - created_at in seconds (NULL for open todos)."""
+    if dialect == "postgresql":
+        return func.extract("epoch", model.completed_at - model.created_at)
+    return (func.julianday(model.completed_at) - func.julianday(model.created_at)) * 86400.0
+
+
+def _grown(array, size: int):
+    """`array` zero-padded to at least `size` (doubling, to grow rarely)."""
+    if size <= array.size:
+        return array
+    return np.concatenate([array, np.zeros(max(size, 2 * array.size) - array.size, dtype=array.dtype)])
+
+
+class _IdSet:
+    """Set of non-negative ids as a bitmap: one bit per id up to the largest."""
+
+    def __init__(self):
+        self.bits = np.zeros(0, dtype=np.uint8)
+
+    def add(self, ids) -> None:
+        if ids.size == 0:
+            return
+        self.bits = _grown(self.bits, int(ids.max()) // 8 + 1)
+        np.bitwise_or.at(self.bits, ids >> 3, np.left_shift(1, ids & 7).astype(np.uint8))
+
+    def __len__(self) -> int:
+        return int(np.bitwise_count(self.bits).sum())
+
+    def common(self, other: "_IdSet") -> int:
+        n = min(self.bits.size, other.bits.size)
+        return int(np.bitwise_count(self.bits[:n] & other.bits[:n]).sum())
+
+
+class _Accumulator:
+    """Running totals over the chunks of todo rows (owner_id, id, is_done, duration)."""
+
+    def __init__(self):
+        # bin 0 is [0, 1 s); the rest are log-spaced up to _MAX_SECONDS
+        self.edges = np.concatenate(([0.0], np.geomspace(1.0, _MAX_SECONDS, ANALYTICS_PERCENTILE_BINS)))
+        self.fine = np.zeros(self.edges.size - 1, dtype=np.int64)
+        self.buckets = np.zeros(len(HISTOGRAM_BUCKETS) + 1, dtype=np.int64)
+        self.seconds_total = 0.0
+        self.todos = np.zeros(0, dtype=np.int64)
+        self.done = np.zeros(0, dtype=np.int64)
+        self.live_ids = _IdSet()
+
+    def add(self, rows: list, live: bool) -> None:
+        # None -> NaN: one float array for all four columns
+        chunk = np.array(rows, dtype=np.float64).reshape(-1, 4)
+        owners = chunk[:, 0].astype(np.int64)
+        done = chunk[:, 2] > 0
+        size = int(owners.max()) + 1
+        self.todos, self.done = _grown(self.todos, size), _grown(self.done, size)
+        self.todos[:size] += np.bincount(owners, minlength=size)
+        self.done[:size] += np.bincount(owners[done], minlength=size)
+        if live:
+            self.live_ids.add(chunk[:, 1].astype(np.int64))
+        seconds = chunk[done, 3]
+        # clock skew can make a completion look earlier than the creation
+        seconds = np.clip(seconds[~np.isnan(seconds)], 0.0, _MAX_SECONDS)
+        self.seconds_total += float(seconds.sum())
+        self.fine += np.histogram(seconds, bins=self.edges)[0]
+        self.buckets += np.bincount(
+            np.searchsorted(HISTOGRAM_BUCKETS, seconds, side="left"), minlength=self.buckets.size
+        )
+
+    def percentiles(self) -> dict:
+        total = int(self.fine.sum())
+        if not total:
+            return {f"p{q}": None for q in PERCENTILES}
+        cumulative = np.cumsum(self.fine)
+        targets = np.array(PERCENTILES, dtype=np.float64) / 100.0 * total
+        idx = np.searchsorted(cumulative, targets, side="left")
+        below = np.where(idx > 0, cumulative[idx - 1], 0)
+        # linear interpolation inside the bin
+        frac = (targets - below) / np.maximum(self.fine[idx], 1)
+        values = self.edges[idx] + frac * (self.edges[idx + 1] - self.edges[idx])
+        return {f"p{q}": round(float(v), 3) for q, v in zip(PERCENTILES, values)}
+
+    def top(self, k: int) -> list[dict]:
+        k = min(k, int(np.count_nonzero(self.todos)))
+        if k <= 0:
+            return []
+        owners = np.argpartition(self.todos, -k)[-k:]
+        # largest first; ties by owner id
+        owners = owners[np.lexsort((owners, -self.todos[owners]))]
+        return [{"owner_id": int(o), "todos": int(self.todos[o]), "done": int(self.done[o])} for o in owners]
+
+
+async def _chunks(db, query):
+    result = await db.stream(query.execution_options(yield_per=ANALYTICS_CHUNK_SIZE))
+    async for rows in result.partitions():
+        yield rows
+
+
+async def compute(db, top: int = 10) -> dict:
+    """Scan live and archived todos once and return the figures (uncached)."""
+    if np is None:
+        raise RuntimeError("analytics require the 'numpy' package")
+    dialect = db.bind.dialect.name
+    acc = _Accumulator()
+    for model, live in ((Todo, True), (TodoArchive, False)):
+        query = select(model.owner_id, model.id, model.is_done, _duration_seconds(dialect, model))
+        async for rows in _chunks(db, query):
+            acc.add(rows, live)
+    moved = _IdSet()
+    async for rows in _chunks(db, select(TodoTombstone.todo_id).where(TodoTombstone.list_id.is_(None))):
+        moved.add(np.array(rows, dtype=np.int64).reshape(-1))
+    live = len(acc.live_ids)
+    reassigned = moved.common(acc.live_ids)
+    completed = int(acc.fine.sum())
+    histogram = [{"le_seconds": le, "count": int(n)} for le, n in zip((*HISTOGRAM_BUCKETS, None), acc.buckets)]
+    return {
+        "generated_at": datetime.now(timezone.utc),
+        "todos": int(acc.todos.sum()),
+        "time_to_completion": {
+            "count": completed,
+            "mean_seconds": round(acc.seconds_total / completed, 3) if completed else None,
+            "percentiles": acc.percentiles(),
+            "histogram": histogram,
+        },
+        "reassigned": {"todos": reassigned, "share": reassigned / live if live else 0.0},
+        "busiest_owners": acc.top(top),
+    }
+
+
+class AnalyticsCache:
+    """One result of `compute`, kept for `ttl` seconds; one computation at a time.
+
+    It is computed for the largest `top` (ANALYTICS_MAX_TOP) and sliced per
+    request, so different `top` values share one scan.
+    """
+
+    def __init__(self, ttl: float = ANALYTICS_CACHE_TTL):
+        self.ttl = ttl
+        self._result: Optional[tuple[float, dict]] = None
+        self._lock = asyncio.Lock()
+
+    def _fresh(self) -> Optional[dict]:
+        if self._result is not None and time.monotonic() < self._result[0]:
+            return self._result[1]
+        return None
+
+    async def _full(self, db, refresh: bool) -> dict:
+        if not refresh and (result := self._fresh()) is not None:
+            return result
+        async with self._lock:
+            # someone else may have computed it while we waited
+            if not refresh and (result := self._fresh()) is not None:
+                return result
+            result = await compute(db, ANALYTICS_MAX_TOP)
+            self._result = (time.monotonic() + self.ttl, result)
+            return result
+
+    async def get(self, db, top: int = 10, refresh: bool = False) -> dict:
+        top = max(0, min(top, ANALYTICS_MAX_TOP))
+        result = await self._full(db, refresh)
+        return {**result, "busiest_owners": result["busiest_owners"][:top]}
+
+    def clear(self) -> None:
+        self._result = None
+
+
+cache = AnalyticsCache()
@@ -0,0 +1,164 @@
+"""Archival of old completed todos into `todos_archive`.
+
+`Archiver` runs as a task started from `main.lifespan`. Every
+ARCHIVE_INTERVAL seconds it moves todos completed more than
+ARCHIVE_AFTER_DAYS days ago out of `todos`. It works in transactions of at
+most ARCHIVE_BATCH_SIZE trees, with a short pause between them, so one run
+never holds the owners' locks (or the SQLite writer) for long.
+Candidates come from the partial index ix_todos_done_completed_at.
+
+Only whole finished trees are archived: a top-level todo that is due,
+together with its subtasks, once none of them is open. A subtask never
+leaves on its own, so an open parent keeps its progress and its
+`/todos/{id}/tree`.
+
+Rows are moved with ORM deletes, so the flush hooks treat archival like a
+delete: the owner's change stream gets a tombstone (delta sync clients drop
+the todo) and tag counts go down. The archive row keeps the tag names,
+`parent_id` and `list_id`. `GET /todos/{id}` and
+`GET /todos?include_archived=true` still read archived todos. On Postgres
+the archive is partitioned by completion month (partitions.py).
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import String, cast, false, func, literal, select, true
+from sqlalchemy.orm import aliased
+
+from db import AsyncSessionLocal
+from models import Todo, TodoArchive
+from partitions import MonthlyPartitions
+from realtime import feed as change_feed, todo_event
+from sharing import with_list_members
+from subtasks import delete_subtree, subtree
+from todo_sync import lock_todo_list
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = float(os.environ.get("ARCHIVE_AFTER_DAYS", "30"))
+ARCHIVE_INTERVAL = float(os.environ.get("ARCHIVE_INTERVAL", "3600"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "500"))
+# pause between batches: lets request writers in between
+ARCHIVE_BATCH_PAUSE = float(os.environ.get("ARCHIVE_BATCH_PAUSE", "0.1"))
+
+_COPIED = ("id", "title", "description", "owner_id", "is_done", "created_at", "updated_at",
+           "completed_at", "completed_by", "position", "due_at", "parent_id", "list_id")
+
+
+class Archiver:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        after_days: float = ARCHIVE_AFTER_DAYS,
+        interval: float = ARCHIVE_INTERVAL,
+        batch_size: int = ARCHIVE_BATCH_SIZE,
+    ):
+        self.session_factory = session_factory
+        self.after_days = after_days
+        self.interval = interval
+        self.batch_size = batch_size
+        self._partitions = MonthlyPartitions("todos_archive")
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self.after_days <= 0:
+            logger.info("Todo archival disabled (ARCHIVE_AFTER_DAYS=%s)", self.after_days)
+            return
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="todo-archiver")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Todo archival failed")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[datetime] = None) -> int:
+        """Archive everything that is due, batch by batch; returns the number of todos moved."""
+        cutoff = (now or datetime.now(timezone.utc)) - timedelta(days=self.after_days)
+        total = 0
+        while True:
+            moved = await self.archive_batch(cutoff)
+            total += moved
+            if moved < self.batch_size:
+                break
+            await asyncio.sleep(ARCHIVE_BATCH_PAUSE)
+        if total:
+            logger.info("Archived %d completed todos", total)
+        return total
+
+    async def archive_batch(self, cutoff: datetime) -> int:
+        # top-level todos whose whole tree is done; descendants share the
+        # owner, so the check reads one owner's open todos
+        node = aliased(Todo)
+        open_subtask = (
+            select(node.id)
+            .where(
+                node.owner_id == Todo.owner_id,
+                node.is_done == false(),
+                node.path.like(literal("/") + cast(Todo.id, String) + "/%"),
+            )
+            .exists()
+        )
+        due = (
+            Todo.is_done == true(),
+            Todo.completed_at < cutoff,
+            Todo.parent_id.is_(None),
+            Todo.subtasks_done == Todo.subtasks_total,
+            ~open_subtask,
+        )
+        async with self.session_factory() as db:
+            candidates = (
+                await db.execute(
+                    select(Todo.id, Todo.owner_id)
+                    .where(*due)
+                    .order_by(Todo.completed_at)
+                    .limit(self.batch_size)
+                )
+            ).all()
+            if not candidates:
+                await db.rollback()
+                return 0
+            # same lock order as the change-sequence hook; then re-check, a
+            # concurrent reopen may have committed in between
+            for owner_id in sorted({owner_id for _, owner_id in candidates}):
+                await lock_todo_list(db, owner_id)
+            roots = (
+                await db.execute(select(Todo).where(Todo.id.in_([todo_id for todo_id, _ in candidates]), *due))
+            ).scalars().all()
+            trees = [await subtree(db, root.id) for root in roots]
+            if db.bind.dialect.name == "sqlite":
+                # never the newest row: without AUTOINCREMENT SQLite would hand
+                # its id out again (Postgres sequences never reuse ids)
+                newest = (await db.execute(select(func.max(Todo.id)))).scalar()
+                trees = [nodes for nodes in trees if all(t.id != newest for t in nodes)]
+            todos = [t for nodes in trees for t in nodes]
+            months = await self._partitions.ensure(db, (t.completed_at for t in todos))
+            for todo in todos:
+                db.add(TodoArchive(**{c: getattr(todo, c) for c in _COPIED}, tags=[t.name for t in todo.tags]))
+            for nodes in trees:
+                await delete_subtree(db, nodes[0], nodes)
+            await db.commit()
+            events = await with_list_members(db, [todo_event("archived", t) for t in todos])
+        self._partitions.created(months)
+        change_feed.publish(events)
+        return len(todos)
+
+
+archiver = Archiver()
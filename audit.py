@@ -0,0 +1,181 @@
+"""Batched, asynchronous audit trail of todo and session changes.
+
+Routes call `audit_log.record(...)` after committing a change. That only
+appends the event to an in-memory buffer; `AuditLog` (started from
+`main.lifespan`) writes the buffer to the append-only `audit_events` table
+with one multi-row INSERT:
+
+- every AUDIT_FLUSH_INTERVAL seconds;
+- sooner once AUDIT_BATCH_SIZE events are waiting;
+- once more on shutdown.
+
+The buffer holds at most AUDIT_MAX_PENDING events. AUDIT_OVERFLOW decides
+which events are dropped when it is full: "drop_oldest" (default) or
+"drop_newest". Drops are counted, and the next flush records them as an
+"audit.dropped" event, so the trail shows where it has a gap.
+
+On Postgres `audit_events` is partitioned by month on created_at (see the
+migration and partitions.py). The flush creates the partition for a month
+the first time it sees events of that month.
+"""
+import asyncio
+import logging
+import os
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import insert
+
+from db import AsyncSessionLocal
+from models import AuditEvent
+from partitions import MonthlyPartitions
+
+logger = logging.getLogger(__name__)
+
+AUDIT_FLUSH_INTERVAL = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "1"))
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", "500"))
+AUDIT_MAX_PENDING = int(os.environ.get("AUDIT_MAX_PENDING", "50000"))
+AUDIT_OVERFLOW = os.environ.get("AUDIT_OVERFLOW", "drop_oldest").lower()
+
+# set by `AuditLog.hold()`: events recorded in this context are collected here
+_held_events: ContextVar[Optional[list]] = ContextVar("audit_held_events", default=None)
+
+
+class AuditLog:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        flush_interval: float = AUDIT_FLUSH_INTERVAL,
+        batch_size: int = AUDIT_BATCH_SIZE,
+        max_pending: int = AUDIT_MAX_PENDING,
+        overflow: str = AUDIT_OVERFLOW,
+    ):
+        self.session_factory = session_factory
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.max_pending = max_pending
+        self.overflow = overflow
+        self._pending: deque = deque()
+        self.dropped = 0
+        self._partitions = MonthlyPartitions("audit_events")
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def record(
+        self,
+        action: str,
+        actor_id: Optional[int],
+        target_type: str,
+        target_id: Optional[int] = None,
+        data: Optional[dict] = None,
+        ip: Optional[str] = None,
+    ) -> None:
+        """Queue one event, e.g. record("todo.deleted", 7, "todo", 42, {"title": ...}); no I/O."""
+        self.add([{
+            "created_at": datetime.now(timezone.utc),
+            "actor_id": actor_id,
+            "action": action,
+            "target_type": target_type,
+            "target_id": target_id,
+            "data": data,
+            "ip_address": ip,
+        }])
+
+    def add(self, events: Iterable[dict]) -> None:
+        """Queue already built events (e.g. the ones collected by `hold()`)."""
+        held = _held_events.get()
+        if held is not None:
+            held.extend(events)
+            return
+        for event in events:
+            if len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                if self.overflow == "drop_newest":
+                    continue
+                self._pending.popleft()
+            self._pending.append(event)
+        if len(self._pending) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+
+    @contextmanager
+    def hold(self):
+        """Collect events recorded inside the block; see `realtime.ChangeFeed.hold`."""
+        held: list = []
+        token = _held_events.set(held)
+        try:
+            yield held
+        finally:
+            _held_events.reset(token)
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="audit-log")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        # final flush so nothing buffered is lost on a clean shutdown
+        while self._pending or self.dropped:
+            await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self._stopping:
+                break
+            try:
+                while await self.flush() >= self.batch_size:
+                    pass
+            except Exception:
+                logger.exception("Audit log flush failed")
+
+    async def flush(self) -> int:
+        """Write up to batch_size buffered events; returns how many were written."""
+        batch = [self._pending.popleft() for _ in range(min(self.batch_size, len(self._pending)))]
+        dropped, self.dropped = self.dropped, 0
+        if dropped:
+            logger.warning("Audit log buffer overflowed; %d events dropped", dropped)
+            batch.append({
+                "created_at": datetime.now(timezone.utc),
+                "actor_id": None,
+                "action": "audit.dropped",
+                "target_type": "audit",
+                "target_id": None,
+                "data": {"count": dropped, "policy": self.overflow},
+                "ip_address": None,
+            })
+        if not batch:
+            return 0
+        try:
+            async with self.session_factory() as db:
+                months = await self._partitions.ensure(db, (e["created_at"] for e in batch))
+                await db.execute(insert(AuditEvent), batch)
+                await db.commit()
+        except BaseException:
+            # put the batch back in front; the bound still applies
+            self.dropped += dropped
+            self._pending.extendleft(reversed(batch[:-1] if dropped else batch))
+            while len(self._pending) > self.max_pending:
+                self._pending.pop()
+                self.dropped += 1
+            raise
+        self._partitions.created(months)
+        return len(batch)
+
+
+audit_log = AuditLog()
@@ -5,12 +5,16 @@ from jose import jwt
 from jose.exceptions import JWTError
 from jose.exceptions import ExpiredSignatureError
 from passlib.context import CryptContext
-from fastapi import Depends, HTTPException
+from fastapi import Depends, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials, SecurityScopes
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from db import get_db
 from models import User
+from activity import tracker as activity_tracker
+from ratelimit import client_ip
+from partitions import maintainer as partition_maintainer
 import secrets
 import hashlib
 import hmac
@@ -21,22 +25,44 @@ import hmac
 # обязательно задавайте переменные окружения).
 REFRESH_TOKEN_SECRET = os.environ.get("REFRESH_TOKEN_SECRET", os.environ.get("SECRET_KEY", "top_secret"))
 REFRESH_EXPIRE_DAYS = int(os.environ.get("REFRESH_EXPIRE_DAYS", "30"))
+# сколько дней хранить истёкшие refresh-токены (обнаружение reuse, разбор
+# инцидентов), прежде чем партиция refresh_tokens будет удалена целиком
+REFRESH_RETENTION_GRACE_DAYS = int(os.environ.get("REFRESH_RETENTION_GRACE_DAYS", "7"))
+
+# On the partitioned Postgres layout whole months of expired tokens are dropped
+partition_maintainer.register(
+    "refresh_tokens", retention=timedelta(days=REFRESH_EXPIRE_DAYS + REFRESH_RETENTION_GRACE_DAYS)
+)
 
 
-def generate_raw_refresh_token() -> str:
+def generate_raw_refresh_token(issued_at: Optional[datetime] = None) -> str:
     """Сгенерировать крипто-безопасный raw refresh token (строка).
 
     Raw токен возвращается клиенту один раз; в базе хранится его HMAC.
+    Префикс "YYYYMM." — месяц `issued_at` строки в БД: по нему поиск
+    токена попадает в одну партицию refresh_tokens (см. partitions.py).
     """
-    return secrets.token_urlsafe(64)
+    issued_at = issued_at or datetime.now(timezone.utc)
+    return f"{issued_at:%Y%m}.{secrets.token_urlsafe(64)}"
+
+
+def refresh_token_month(raw: str) -> Optional[datetime]:
+    """Месяц выпуска из префикса raw токена или None (старый формат)."""
+    prefix, dot, _ = raw.partition(".")
+    if not dot or len(prefix) != 6 or not prefix.isdigit():
+        return None
+    try:
+        return datetime(int(prefix[:4]), int(prefix[4:]), 1, tzinfo=timezone.utc)
+    except ValueError:
+        return None
 
 
-def hash_refresh_token(raw: str) -> str:
+def hash_refresh_token(raw: str) -> bytes:
     """Хэшировать raw refresh token безопасным HMAC-SHA256.
 
-    Возвращаем hex-строку.
+    Возвращаем 32 сырых байта (`refresh_tokens.token_hash`), а не hex.
     """
-    return hmac.new(REFRESH_TOKEN_SECRET.encode(), raw.encode(), hashlib.sha256).hexdigest()
+    return hmac.new(REFRESH_TOKEN_SECRET.encode(), raw.encode(), hashlib.sha256).digest()
 
 
 # Настройки JWT: берём из окружения. В продакшне задавайте сильный SECRET_KEY
@@ -80,7 +106,21 @@ def verify_password(plain: str, hashed: str) -> bool:
     return pwd_context.verify(plain, hashed)
 
 
-def create_access_token(subject: str, scopes: List[str]) -> str:
+async def get_password_hash_async(password: str) -> str:
+    """`get_password_hash` в пуле потоков: Argon2 не блокирует event loop.
+
+    Вызывайте, не держа открытой транзакции (соединения из пула), — см.
+    обработчики в routes.py.
+    """
+    return await run_in_threadpool(get_password_hash, password)
+
+
+async def verify_password_async(plain: str, hashed: str) -> bool:
+    """`verify_password` в пуле потоков (см. `get_password_hash_async`)."""
+    return await run_in_threadpool(verify_password, plain, hashed)
+
+
+def create_access_token(subject: str, scopes: List[str], session_id: Optional[int] = None) -> str:
     """Сгенерировать access JWT.
 
     Контракт: возвращается компактный HS256-токен с полями:
@@ -88,6 +128,7 @@ def create_access_token(subject: str, scopes: List[str]) -> str:
     - scopes: список ролей
     - type: 'access' (отдельяем от возможных refresh токенов)
     - iat, exp: временные метки
+    - sid: id refresh-сессии, для которой выдан токен (учёт активности, activity.py)
 
     Примечание: refresh token пока не реализован — см. рекомендации в docs/.
     """
@@ -99,6 +140,8 @@ def create_access_token(subject: str, scopes: List[str]) -> str:
         "iat": int(now.timestamp()),
         "exp": int((now + timedelta(minutes=ACCESS_EXPIRE_MINUTES)).timestamp()),
     }
+    if session_id is not None:
+        payload["sid"] = session_id
     return jwt.encode(payload, SECRET_KEY, algorithm=ALGORITHM)
 
 
@@ -116,6 +159,7 @@ async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
 
 async def get_current_user(
     security_scopes: SecurityScopes,
+    request: Request,
     credentials: HTTPAuthorizationCredentials = Depends(bearer_scheme),
     db: AsyncSession = Depends(get_db),
 ):
@@ -123,11 +167,27 @@ async def get_current_user(
 
     Проверяет токен (валиден ли, не просрочен, правильного типа) и наличие
     требуемых скоупов. Возвращает компактный «принципал» в виде словаря:
-    {"id": ..., "email": ..., "scopes": [...]}
+    {"id": ..., "email": ..., "scopes": [...], "sid": ..., "ip": ...}
+
+    Активность сессии (sid) только запоминается в памяти — в БД её
+    пачками пишет activity.ActivityTracker.
     """
     if not credentials or not credentials.credentials:
         raise HTTPException(status_code=401, detail="Not authenticated")
-    token = credentials.credentials
+    principal = await principal_from_token(db, credentials.credentials, security_scopes.scopes)
+    ip = client_ip(request)
+    if principal["sid"] is not None:
+        activity_tracker.touch(principal["sid"], ip)
+    # IP клиента нужен журналу аудита (audit.py)
+    return {**principal, "ip": ip}
+
+
+async def principal_from_token(db: AsyncSession, token: str, required_scopes: List[str] = ()) -> dict:
+    """Проверить access token и вернуть принципал (см. `get_current_user`).
+
+    Вынесено отдельно для мест, где токен приходит не в заголовке
+    Authorization (например, WebSocket). Ошибки — HTTPException 401/403/400.
+    """
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
     except ExpiredSignatureError:
@@ -151,7 +211,7 @@ async def get_current_user(
         raise HTTPException(status_code=400, detail="Inactive or unknown user")
 
     # Проверка скоупов: если endpoint требует скоупы — они должны быть в токене
-    required = set(security_scopes.scopes)
+    required = set(required_scopes)
     token_scopes = set(payload.get("scopes", []))
     if required and not required.issubset(token_scopes):
         # Inform client about insufficient scopes using RFC-style header
@@ -160,4 +220,4 @@ async def get_current_user(
         raise HTTPException(status_code=403, detail="Not enough permissions", headers=headers)
 
     # Compact principal: минимальный JSON-like объект, пригодный для зависимостей
-    return {"id": user.id, "email": email, "scopes": list(token_scopes)}
+    return {"id": user.id, "email": email, "scopes": list(token_scopes), "sid": payload.get("sid")}
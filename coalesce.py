@@ -0,0 +1,109 @@
+"""Request coalescing (single-flight) for identical concurrent todo reads.
+
+Clients with several sessions (web, mobile) often send the same `GET /todos`
+or `GET /todos/{id}` within milliseconds, e.g. when the app regains focus.
+`SingleFlight.run(key, fetch)` lets such requests share work. The first
+request with a given key (principal + query) runs `fetch` on its own DB
+session. Identical requests arriving while it runs wait for it and receive
+the same serialized result (JSON-ready dicts, not ORM objects bound to the
+leader's session), or the same exception. Waiters do not query the database.
+
+Nothing is cached: a key is forgotten as soon as its call completes, so
+every result comes from a query that was running when the request arrived.
+Writes also bound staleness. Every todo event on the change feed
+(realtime.py), whether local or from another worker through NOTIFY, moves
+the write generation forward. List membership changes do the same. Calls
+started under an older generation take no new waiters, so a read issued
+after a write never gets a result read before it. Reads on a session with
+uncommitted writes (an atomic `/batch`, see `db.has_uncommitted_writes`)
+are never shared: they must see those writes, and nobody else may.
+
+At most COALESCE_MAX_WAITERS requests wait on one call; the rest run their
+own query. If the leading request is cancelled, its waiters run their own
+query as well. Counters: `snapshot()`, under `coalescing` in `/metrics`.
+"""
+import asyncio
+import os
+from typing import Any, Awaitable, Callable, Hashable
+
+from realtime import feed as change_feed
+
+COALESCE_ENABLED = os.environ.get("COALESCE_ENABLED", "true").lower() in ("1", "true", "yes")
+COALESCE_MAX_WAITERS = int(os.environ.get("COALESCE_MAX_WAITERS", "100"))
+
+
+class _Call:
+    __slots__ = ("future", "generation", "waiters")
+
+    def __init__(self, generation: int):
+        self.future = asyncio.get_running_loop().create_future()
+        self.generation = generation
+        self.waiters = 0
+
+
+class SingleFlight:
+    """Identical in-flight calls, keyed by principal and query."""
+
+    def __init__(self, max_waiters: int = COALESCE_MAX_WAITERS, enabled: bool = COALESCE_ENABLED):
+        self.max_waiters = max_waiters
+        self.enabled = enabled
+        self.generation = 0
+        self._calls: dict[Hashable, _Call] = {}
+        self.leaders = 0  # calls that ran fetch
+        self.hits = 0  # requests served by another request's call
+        self.overflows = 0  # requests that found the call full
+
+    def invalidate(self, *_event) -> None:
+        """Data changed: calls in flight take no more waiters."""
+        self.generation += 1
+
+    async def run(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        if not self.enabled:
+            return await fetch()
+        call = self._calls.get(key)
+        if call is not None and call.generation == self.generation:
+            if call.waiters < self.max_waiters:
+                call.waiters += 1
+                self.hits += 1
+                try:
+                    return await asyncio.shield(call.future)
+                except asyncio.CancelledError:
+                    if not call.future.cancelled():
+                        raise  # this request was cancelled
+                    # the leader was cancelled: run our own query
+                    self.hits -= 1
+            else:
+                self.overflows += 1
+            self.leaders += 1
+            return await fetch()
+
+        call = self._calls[key] = _Call(self.generation)
+        self.leaders += 1
+        try:
+            result = await fetch()
+        except asyncio.CancelledError:
+            call.future.cancel()
+            raise
+        except BaseException as exc:
+            call.future.set_exception(exc)
+            # retrieved by the waiters, if any
+            call.future.exception()
+            raise
+        else:
+            call.future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+
+    def snapshot(self) -> dict:
+        return {
+            "in_flight": len(self._calls),
+            "leaders": self.leaders,
+            "hits": self.hits,
+            "overflows": self.overflows,
+        }
+
+
+todo_reads = SingleFlight()
+change_feed.hub.add_listener(todo_reads.invalidate)
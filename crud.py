@@ -1,11 +1,26 @@
-from sqlalchemy import select
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
 from sqlalchemy.ext.asyncio import AsyncSession
 from typing import Optional, List
 
-from models import Todo, User
-from models import RefreshToken
+from models import Todo, TodoList, User
+from models import RefreshToken, EmailOutbox, TodoArchive, TodoTombstone, UserAgent
 from datetime import datetime, timezone
 
+import todo_sync  # noqa: F401  (registers the change-sequence flush hook)
+import tags  # noqa: F401  (registers the tag-count flush hook)
+import subtasks  # noqa: F401  (registers the subtask-progress flush hook; after todo_sync's)
+import todo_stats  # noqa: F401  (registers the stats-rollup flush hook)
+from positions import key_after
+from sharing import shared_lists, visible
+from partitions import month_start, next_month
+
 
 async def get_user_by_email(db: AsyncSession, email: str) -> Optional[User]:
     """Вернуть объект User по email или None.
@@ -48,12 +63,29 @@ async def create_user(db: AsyncSession, user: User):
     return user
 
 
+def enqueue_email(db: AsyncSession, to_email: str, kind: str, payload: dict) -> EmailOutbox:
+    """Add an e-mail to the outbox without committing.
+
+    The row is committed together with the caller's transaction and sent
+    later by `outbox.OutboxDispatcher`.
+    """
+    msg = EmailOutbox(to_email=to_email, kind=kind, payload=payload)
+    db.add(msg)
+    return msg
+
+
 async def get_todo_by_id(db: AsyncSession, todo_id: int) -> Optional[Todo]:
     """Вернуть задачу по id или None."""
     q = await db.execute(select(Todo).where(Todo.id == todo_id))
     return q.scalars().first()
 
 
+async def get_archived_todo(db: AsyncSession, todo_id: int) -> Optional[TodoArchive]:
+    """Вернуть задачу из архива (см. archive.py) или None."""
+    q = await db.execute(select(TodoArchive).where(TodoArchive.id == todo_id))
+    return q.scalars().first()
+
+
 async def list_todos(db: AsyncSession, owner_id: Optional[int] = None) -> List[Todo]:
     """Вернуть список задач. Если указан owner_id, вернуть только задачи этого
     владельца.
@@ -68,8 +100,123 @@ async def list_todos(db: AsyncSession, owner_id: Optional[int] = None) -> List[T
     return q.scalars().all()
 
 
+async def _change_stream(db: AsyncSession, todos, tombstones, since: int, limit: int, token: int):
+    """One sequence (owner's or a shared list's): items after `since`, up to `limit`.
+
+    Returns ([(seq, Todo | deleted id)], next token, has_more).
+    """
+    rows = await db.execute(todos.where(Todo.change_seq > since).order_by(Todo.change_seq).limit(limit + 1))
+    items = [(t.change_seq, t) for t in rows.scalars().all()]
+    if since > 0:
+        # a fresh client (since=0) has nothing to delete
+        tombs = (
+            await db.execute(
+                tombstones.where(TodoTombstone.change_seq > since).order_by(TodoTombstone.change_seq).limit(limit + 1)
+            )
+        ).all()
+        items.extend((seq, todo_id) for seq, todo_id in tombs)
+        items.sort(key=lambda item: item[0])
+    has_more = len(items) > limit
+    if has_more:
+        items = items[:limit]
+        token = items[-1][0]
+    return items, token, has_more
+
+
+async def todo_changes(
+    db: AsyncSession, owner_id: int, since: int, limit: int, list_since: Optional[dict] = None
+) -> dict:
+    """Изменения задач владельца после `since` (см. todo_sync.py).
+
+    Возвращает до `limit` изменений по возрастанию change_seq: живые задачи
+    (`changes`) и id удалённых/переданных другому владельцу (`deleted`).
+    `next_token` — значение для следующего `since`; при `has_more` клиент
+    должен запросить следующую страницу сразу.
+
+    Задачи общих списков, открытых пользователю, идут отдельными потоками
+    (в последовательности владельца списка): `list_since` — {list_id: token}
+    из прошлого ответа (`list_tokens`), новый список начинается с 0. Список,
+    которого больше нет в `list_tokens`, закрыт: клиент удаляет его задачи
+    (`TodoRead.list_id`) сам.
+    """
+    list_since = list_since or {}
+    # counters first: rows committed after this read have larger sequence
+    # numbers and are picked up by the next sync
+    token = (await db.execute(select(User.todo_seq).where(User.id == owner_id))).scalar_one_or_none() or 0
+    shared = (
+        await db.execute(
+            select(TodoList.id, TodoList.owner_id, User.todo_seq)
+            .join(User, User.id == TodoList.owner_id)
+            .where(TodoList.id.in_(shared_lists(owner_id)))
+            .order_by(TodoList.id)
+        )
+    ).all()
+    items, token, has_more = await _change_stream(
+        db,
+        select(Todo).where(Todo.owner_id == owner_id),
+        select(TodoTombstone.change_seq, TodoTombstone.todo_id).where(
+            TodoTombstone.owner_id == owner_id, TodoTombstone.list_id.is_(None)
+        ),
+        since,
+        limit,
+        token,
+    )
+    list_tokens = {}
+    for list_id, list_owner, list_token in shared:
+        list_from = max(list_since.get(list_id, 0), 0)
+        budget = limit - len(items)
+        if budget <= 0:
+            # the page is full: this list continues on the next one
+            list_tokens[list_id] = list_from
+            has_more = True
+            continue
+        more, list_tokens[list_id], list_more = await _change_stream(
+            db,
+            select(Todo).where(visible(Todo, owner_id), Todo.list_id == list_id),
+            # the owner too: SQLite may hand a deleted list's id out again
+            select(TodoTombstone.change_seq, TodoTombstone.todo_id).where(
+                TodoTombstone.list_id == list_id, TodoTombstone.owner_id == list_owner
+            ),
+            list_from,
+            budget,
+            list_token,
+        )
+        items += more
+        has_more = has_more or list_more
+    changes = [item for _, item in items if isinstance(item, Todo)]
+    live = {t.id for t in changes}
+    # a todo that came back later in the same page only needs its final state
+    deleted = list(dict.fromkeys(item for _, item in items if not isinstance(item, Todo) and item not in live))
+    return {
+        "changes": changes,
+        "deleted": deleted,
+        "next_token": token,
+        "list_tokens": list_tokens,
+        "has_more": has_more,
+    }
+
+
+async def last_position(db: AsyncSession, owner_id: int) -> Optional[str]:
+    """Наибольшая позиция в списке владельца (по индексу owner_id, position)."""
+    q = await db.execute(select(func.max(Todo.position)).where(Todo.owner_id == owner_id))
+    return q.scalar()
+
+
+async def neighbour_position(db: AsyncSession, todo: Todo, position: str, below: bool) -> Optional[str]:
+    """Позиция ближайшей задачи ниже (below=True) или выше `position` в списке
+    владельца `todo`, не считая саму `todo`; None — край списка."""
+    if below:
+        q = select(func.min(Todo.position)).where(Todo.position > position)
+    else:
+        q = select(func.max(Todo.position)).where(Todo.position < position)
+    q = q.where(Todo.owner_id == todo.owner_id, Todo.id != todo.id)
+    return (await db.execute(q)).scalar()
+
+
 async def create_todo(db: AsyncSession, todo: Todo):
-    """Сохранить новую задачу и вернуть обновлённый объект."""
+    """Сохранить новую задачу (в конец списка владельца) и вернуть её."""
+    if todo.position is None:
+        todo.position = key_after(await last_position(db, todo.owner_id))
     db.add(todo)
     await db.commit()
     await db.refresh(todo)
@@ -90,9 +237,94 @@ async def create_refresh_token(db: AsyncSession, token: RefreshToken):
     return token
 
 
-async def get_refresh_token_by_hash(db: AsyncSession, token_hash: str) -> Optional[RefreshToken]:
-    q = await db.execute(select(RefreshToken).where(RefreshToken.token_hash == token_hash))
-    return q.scalars().first()
+# digest -> (user_agents.id, expiry); only rows known to be committed. LRU,
+# and entries expire: `prune_user_agents` may delete a row another worker
+# has cached. A cached row was just used for a session, and sessions are
+# kept far longer than USER_AGENT_CACHE_TTL, so it is not pruned before then.
+USER_AGENT_CACHE_SIZE = int(os.environ.get("USER_AGENT_CACHE_SIZE", "10000"))
+USER_AGENT_CACHE_TTL = float(os.environ.get("USER_AGENT_CACHE_TTL", "3600"))
+# longer strings are cut before interning: they carry no more useful detail
+USER_AGENT_MAX_LENGTH = int(os.environ.get("USER_AGENT_MAX_LENGTH", "512"))
+_user_agent_ids: OrderedDict[bytes, tuple[int, float]] = OrderedDict()
+
+
+def user_agent_digest(value: str) -> bytes:
+    """16-байтный ключ строки User-Agent (`user_agents.digest`)."""
+    return hashlib.blake2b(value.encode(), digest_size=16).digest()
+
+
+def _cache_user_agent(digest: bytes, ua_id: int) -> None:
+    _user_agent_ids[digest] = (ua_id, time.monotonic() + USER_AGENT_CACHE_TTL)
+    _user_agent_ids.move_to_end(digest)
+    if len(_user_agent_ids) > USER_AGENT_CACHE_SIZE:
+        _user_agent_ids.popitem(last=False)
+
+
+async def get_user_agent_id(db: AsyncSession, value: Optional[str]) -> Optional[int]:
+    """id строки User-Agent в словаре `user_agents`; недостающая строка создаётся.
+
+    Строка нормализуется (пробелы по краям, не длиннее USER_AGENT_MAX_LENGTH).
+    """
+    value = (value or "").strip()[:USER_AGENT_MAX_LENGTH]
+    if not value:
+        return None
+    digest = user_agent_digest(value)
+    cached = _user_agent_ids.get(digest)
+    if cached is not None and time.monotonic() < cached[1]:
+        _user_agent_ids.move_to_end(digest)
+        return cached[0]
+    q = select(UserAgent.id).where(UserAgent.digest == digest)
+    ua_id = (await db.execute(q)).scalar()
+    if ua_id is not None:
+        _cache_user_agent(digest, ua_id)
+        return ua_id
+    # ON CONFLICT DO NOTHING: a concurrent login may add the same string.
+    # Not cached: the row only exists for others if this transaction commits.
+    insert = pg_insert if db.bind.dialect.name == "postgresql" else sqlite_insert
+    await db.execute(insert(UserAgent).values(digest=digest, value=value).on_conflict_do_nothing(index_elements=["digest"]))
+    return (await db.execute(q)).scalar()
+
+
+async def prune_user_agents(db: AsyncSession) -> int:
+    """Удалить строки `user_agents`, на которые не ссылается ни один refresh token.
+
+    Such rows are left behind when token partitions are dropped or users are
+    deleted. Call `forget_user_agents` after the commit.
+    """
+    unused = ~select(RefreshToken.id).where(RefreshToken.user_agent_id == UserAgent.id).exists()
+    stmt = delete(UserAgent).where(unused).execution_options(synchronize_session=False)
+    return (await db.execute(stmt)).rowcount
+
+
+def forget_user_agents() -> None:
+    """Drop this worker's cached user agent ids (after `prune_user_agents`)."""
+    _user_agent_ids.clear()
+
+
+async def get_refresh_token_by_hash(
+    db: AsyncSession, token_hash: bytes, issued_month: Optional[datetime] = None
+) -> Optional[RefreshToken]:
+    """Найти refresh token по хэшу.
+
+    `issued_month` (see `auth.refresh_token_month`) restricts the lookup to
+    one month of issued_at, i.e. one partition on the partitioned layout.
+    """
+    q = select(RefreshToken).where(RefreshToken.token_hash == token_hash)
+    if issued_month is not None:
+        q = q.where(RefreshToken.issued_at >= issued_month, RefreshToken.issued_at < next_month(issued_month))
+    return (await db.execute(q)).scalars().first()
+
+
+async def prepare_hot_statements(db: AsyncSession) -> None:
+    """Run the hottest lookups once with sentinel values.
+
+    Used by the pool warm-up at startup: executing the exact statements the
+    request path uses fills SQLAlchemy's compiled cache and the asyncpg
+    prepared-statement cache of the connection behind `db`.
+    """
+    await get_user_by_email(db, "")
+    await get_todo_by_id(db, 0)
+    await get_refresh_token_by_hash(db, bytes(32), month_start(datetime.now(timezone.utc)))
 
 
 async def revoke_refresh_token(db: AsyncSession, token: RefreshToken):
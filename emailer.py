@@ -1,38 +1,207 @@
-"""Simple test-friendly email helper.
+"""E-mail rendering and delivery transports.
 
-Usage in tests: call `emailer.last_sent_for(email)` to retrieve the last
-verification message and token.
+Messages are not sent from request handlers: routes add a row to the
+`email_outbox` table (see `crud.enqueue_email`) and `outbox.OutboxDispatcher`
+delivers it in the background through the transport selected by
+EMAIL_BACKEND:
+
+- "memory" (default) — keeps delivered messages in a bounded in-process
+  ring buffer. Usage in tests: call `emailer.wait_for(email)` (or
+  `emailer.last_sent_for(email)`) to retrieve the last message and token.
+- "smtp" — delivers over a small pool of reusable `aiosmtplib` connections
+  (SMTP_HOST, SMTP_PORT, SMTP_USERNAME, SMTP_PASSWORD, SMTP_STARTTLS,
+  SMTP_POOL_SIZE, EMAIL_FROM).
 """
-from datetime import datetime, timedelta
-import secrets
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from email.message import EmailMessage
+import asyncio
 import logging
+import os
+import secrets
+import threading
+from typing import Optional
 
 logger = logging.getLogger(__name__)
 
-# list of dicts: {to, subject, body, token, when, expires_at}
-SENT = []
+EMAIL_BACKEND = os.environ.get("EMAIL_BACKEND", "memory").lower()
+EMAIL_FROM = os.environ.get("EMAIL_FROM", "no-reply@localhost")
+# how many delivered messages the memory sink keeps
+EMAIL_SINK_SIZE = int(os.environ.get("EMAIL_SINK_SIZE", "1000"))
+
+SMTP_HOST = os.environ.get("SMTP_HOST", "localhost")
+SMTP_PORT = int(os.environ.get("SMTP_PORT", "25"))
+SMTP_USERNAME = os.environ.get("SMTP_USERNAME") or None
+SMTP_PASSWORD = os.environ.get("SMTP_PASSWORD") or None
+SMTP_STARTTLS = os.environ.get("SMTP_STARTTLS", "false").lower() in ("1", "true", "yes")
+SMTP_POOL_SIZE = int(os.environ.get("SMTP_POOL_SIZE", "4"))
+SMTP_TIMEOUT = float(os.environ.get("SMTP_TIMEOUT", "10"))
+
+VERIFICATION = "verification"
+REMINDER = "reminder"
 
 
 def generate_token() -> str:
     return secrets.token_urlsafe(32)
 
 
-def send_verification(to_email: str, token: str, expires_in_minutes: int = 60):
-    now = datetime.utcnow()
-    msg = {
-        "to": to_email,
-        "subject": "Verify your email",
-        "body": f"Visit /verify-email?token={token}",
-        "token": token,
-        "when": now,
-        "expires_at": now + timedelta(minutes=expires_in_minutes),
+def verification_payload(token: str, expires_in_minutes: int = 60) -> dict:
+    """Outbox payload for an e-mail verification message."""
+    expires_at = datetime.now(timezone.utc) + timedelta(minutes=expires_in_minutes)
+    return {"token": token, "expires_at": expires_at.isoformat()}
+
+
+def reminder_payload(reminder: dict) -> dict:
+    """Outbox payload for a todo reminder (see reminders.py)."""
+    due_at = reminder.get("due_at")
+    return {
+        "todo_id": reminder["todo_id"],
+        "title": reminder["title"],
+        "due_at": due_at.isoformat() if due_at else None,
     }
-    SENT.append(msg)
-    logger.info("Sent verification email", extra={"to": to_email})
+
+
+def render(kind: str, payload: dict) -> tuple[str, str]:
+    """Return (subject, body) for an outbox message."""
+    if kind == VERIFICATION:
+        return "Verify your email", f"Visit /verify-email?token={payload['token']}"
+    if kind == REMINDER:
+        due = f" (due {payload['due_at']})" if payload.get("due_at") else ""
+        return f"Reminder: {payload['title']}", f"Todo #{payload['todo_id']}{due}: {payload['title']}"
+    raise ValueError(f"unknown email kind: {kind}")
+
+
+# ---------------------------------------------------------------------------
+# In-memory sink (tests / development)
+# ---------------------------------------------------------------------------
+
+# Ring buffer of delivered messages: dicts with to, subject, body, when and
+# the payload fields (e.g. token). Oldest entries fall off when full.
+SENT: deque = deque(maxlen=EMAIL_SINK_SIZE)
+# recipient -> latest message still in SENT
+_latest: dict[str, dict] = {}
+# delivery happens on the event loop, tests read from their own thread
+_sink_cond = threading.Condition()
+
+
+def _record(msg: dict) -> None:
+    with _sink_cond:
+        if len(SENT) == SENT.maxlen:
+            oldest = SENT[0]
+            if _latest.get(oldest["to"]) is oldest:
+                del _latest[oldest["to"]]
+        SENT.append(msg)
+        _latest[msg["to"]] = msg
+        _sink_cond.notify_all()
 
 
 def last_sent_for(email: str):
-    for msg in reversed(SENT):
-        if msg["to"] == email:
-            return msg
-    return None
+    """Latest delivered message for `email` or None (O(1))."""
+    with _sink_cond:
+        return _latest.get(email)
+
+
+def wait_for(email: str, timeout: float = 5.0):
+    """Like `last_sent_for`, but waits up to `timeout` seconds for delivery.
+
+    Delivery is asynchronous, so tests should prefer this right after the
+    request that enqueued the message.
+    """
+    with _sink_cond:
+        _sink_cond.wait_for(lambda: email in _latest, timeout=timeout)
+        return _latest.get(email)
+
+
+class MemoryTransport:
+    """Transport that records messages in the in-memory sink."""
+
+    async def send_many(self, messages: list[dict]) -> list[Optional[Exception]]:
+        now = datetime.now(timezone.utc)
+        for m in messages:
+            _record({**m["payload"], "to": m["to"], "subject": m["subject"], "body": m["body"], "when": now})
+            logger.info("Sent email", extra={"to": m["to"], "kind": m["kind"]})
+        return [None] * len(messages)
+
+    async def close(self) -> None:
+        return None
+
+
+class SMTPTransport:
+    """Delivers over a pool of persistent SMTP connections.
+
+    Up to `pool_size` messages of a batch are sent concurrently, each over
+    its own connection; connections are kept open between batches and
+    dropped after an error.
+    """
+
+    def __init__(
+        self,
+        host: str = SMTP_HOST,
+        port: int = SMTP_PORT,
+        username: Optional[str] = SMTP_USERNAME,
+        password: Optional[str] = SMTP_PASSWORD,
+        start_tls: bool = SMTP_STARTTLS,
+        sender: str = EMAIL_FROM,
+        pool_size: int = SMTP_POOL_SIZE,
+        timeout: float = SMTP_TIMEOUT,
+    ):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.start_tls = start_tls
+        self.sender = sender
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self._idle: list = []
+        self._slots: Optional[asyncio.Semaphore] = None
+
+    async def _connect(self):
+        import aiosmtplib
+
+        client = aiosmtplib.SMTP(
+            hostname=self.host, port=self.port, timeout=self.timeout, start_tls=self.start_tls
+        )
+        await client.connect()
+        if self.username:
+            await client.login(self.username, self.password or "")
+        return client
+
+    async def _send_one(self, m: dict) -> Optional[Exception]:
+        msg = EmailMessage()
+        msg["From"] = self.sender
+        msg["To"] = m["to"]
+        msg["Subject"] = m["subject"]
+        msg.set_content(m["body"])
+        async with self._slots:
+            client = self._idle.pop() if self._idle else None
+            try:
+                if client is None or not client.is_connected:
+                    client = await self._connect()
+                await client.send_message(msg)
+            except Exception as exc:
+                if client is not None:
+                    client.close()
+                return exc
+            self._idle.append(client)
+            return None
+
+    async def send_many(self, messages: list[dict]) -> list[Optional[Exception]]:
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.pool_size)
+        return list(await asyncio.gather(*(self._send_one(m) for m in messages)))
+
+    async def close(self) -> None:
+        while self._idle:
+            client = self._idle.pop()
+            try:
+                await client.quit()
+            except Exception:
+                client.close()
+
+
+def get_transport():
+    """Transport selected by EMAIL_BACKEND."""
+    if EMAIL_BACKEND == "smtp":
+        return SMTPTransport()
+    return MemoryTransport()
@@ -0,0 +1,128 @@
+"""Query guardrails: sort keys, page sizes and per-route timeouts.
+
+- `check_sort` accepts only the sort keys in SORT_KEYS. Each of them is
+  backed by a per-owner index on `todos`: `ix_todos_owner_created`,
+  `ix_todos_owner_id` (owner_id, id) and `ix_todos_owner_position`. Any
+  other key gets 400 instead of a sort over all of the user's rows.
+- `clamp_limit` caps page sizes at QUERY_MAX_LIMIT.
+- On Postgres every connection starts with `statement_timeout` and
+  `lock_timeout` set to QUERY_STATEMENT_TIMEOUT_MS and QUERY_LOCK_TIMEOUT_MS
+  (`connection_settings`, passed by `db.engine_options`), so most requests
+  pay nothing for them. ROUTE_TIMEOUTS holds per-route overrides (0
+  disables a timeout); only those routes, and background work (not
+  limited), run a transaction-local SET when a transaction begins. The
+  route is the one `db.get_db` records in `metrics.route_label`. SQLite has
+  neither setting, and its writes are serialized anyway (see sqlite_mode.py).
+
+A query that hits a timeout fails the request with 503 rather than holding
+its connection. Offenders are logged with the route and the query shape:
+the SQL with placeholders (no values) for timeouts, or the rejected or
+clamped parameter.
+"""
+import logging
+import os
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.responses import JSONResponse
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.orm import Session
+
+from metrics import route_label
+
+logger = logging.getLogger(__name__)
+
+QUERY_MAX_LIMIT = int(os.environ.get("QUERY_MAX_LIMIT", "1000"))
+QUERY_STATEMENT_TIMEOUT_MS = int(os.environ.get("QUERY_STATEMENT_TIMEOUT_MS", "5000"))
+QUERY_LOCK_TIMEOUT_MS = int(os.environ.get("QUERY_LOCK_TIMEOUT_MS", "2000"))
+
+# index-backed sort keys of GET /todos
+SORT_KEYS = ("created_at", "id", "position")
+
+# route -> (statement_timeout, lock_timeout), ms
+ROUTE_TIMEOUTS = {
+    # full scans by design (analytics.py), streamed in chunks
+    "GET /admin/analytics": (int(os.environ.get("ANALYTICS_STATEMENT_TIMEOUT_MS", "60000")), QUERY_LOCK_TIMEOUT_MS),
+    "POST /admin/cleanup_sessions": (30000, QUERY_LOCK_TIMEOUT_MS),
+}
+
+# SQLSTATE: query_canceled (statement_timeout), lock_not_available (lock_timeout)
+_TIMEOUT_STATES = {"57014": "statement_timeout", "55P03": "lock_timeout"}
+
+
+def check_sort(sort_by: str) -> str:
+    """`sort_by` if it is an index-backed sort key, else 400."""
+    if sort_by not in SORT_KEYS:
+        logger.warning("query guardrail: %s sort_by=%r rejected", route_label.get(), sort_by)
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of: {', '.join(SORT_KEYS)}")
+    return sort_by
+
+
+def clamp_limit(limit: int, maximum: int = QUERY_MAX_LIMIT) -> int:
+    """Page size within [1, maximum]."""
+    if limit > maximum:
+        logger.warning("query guardrail: %s limit=%d clamped to %d", route_label.get(), limit, maximum)
+        return maximum
+    return max(limit, 1)
+
+
+def route_timeouts(route: str) -> tuple[int, int]:
+    return ROUTE_TIMEOUTS.get(route, (QUERY_STATEMENT_TIMEOUT_MS, QUERY_LOCK_TIMEOUT_MS))
+
+
+def connection_settings() -> dict:
+    """Postgres settings every new connection starts with: the default timeouts."""
+    return {"statement_timeout": str(QUERY_STATEMENT_TIMEOUT_MS), "lock_timeout": str(QUERY_LOCK_TIMEOUT_MS)}
+
+
+def local_timeouts(route: str) -> Optional[tuple[int, int]]:
+    """Timeouts a transaction of `route` must SET LOCAL, or None if the connection defaults apply."""
+    timeouts = (0, 0) if route == "background" else route_timeouts(route)
+    if timeouts == (QUERY_STATEMENT_TIMEOUT_MS, QUERY_LOCK_TIMEOUT_MS):
+        return None
+    return timeouts
+
+
+@event.listens_for(Session, "after_begin")
+def _apply_timeouts(session, transaction, connection) -> None:
+    if connection.dialect.name != "postgresql":
+        return
+    timeouts = local_timeouts(route_label.get())
+    if timeouts is None:
+        return
+    statement_ms, lock_ms = timeouts
+    # set_config(..., true) is SET LOCAL: it ends with the transaction, so
+    # nothing leaks to the next user of the pooled connection
+    connection.execute(
+        text("SELECT set_config('statement_timeout', :statement, true), set_config('lock_timeout', :lock, true)"),
+        {"statement": str(statement_ms), "lock": str(lock_ms)},
+    )
+
+
+def _timeout_kind(exc) -> Optional[str]:
+    orig = exc.orig if isinstance(exc, DBAPIError) else exc
+    state = getattr(orig, "sqlstate", None) or getattr(orig, "pgcode", None)
+    return _TIMEOUT_STATES.get(state)
+
+
+@event.listens_for(Engine, "handle_error")
+def _log_timeout(context) -> None:
+    kind = _timeout_kind(context.original_exception)
+    if kind is not None:
+        route = route_label.get()
+        limits = dict(zip(("statement_timeout", "lock_timeout"), route_timeouts(route)))
+        logger.warning(
+            "query guardrail: %s hit %s (%d ms): %s",
+            route, kind, limits[kind], " ".join((context.statement or "").split()),
+        )
+
+
+async def query_timeout_handler(request, exc: DBAPIError):
+    """Exception handler: a query stopped by a timeout answers 503."""
+    if _timeout_kind(exc) is None:
+        raise exc
+    return JSONResponse(
+        status_code=503, content={"detail": "Query took too long, retry later"}, headers={"Retry-After": "1"}
+    )
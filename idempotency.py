@@ -0,0 +1,203 @@
+"""`Idempotency-Key` support for retried writes.
+
+Decorate a route handler with `@idempotent(...)` and give it an
+`idempotency_key: Optional[str] = Header(None)` parameter. When a client
+sends the header:
+
+- the first request runs normally and its response body is stored for
+  IDEMPOTENCY_TTL seconds, keyed by user, route and key;
+- a retry with the same key returns the stored body (with
+  `Idempotent-Replayed: true`) without running the handler;
+- a duplicate that arrives while the first one is still running waits for
+  its result (up to IDEMPOTENCY_WAIT seconds, then 409);
+- reusing a key with a different request body is rejected with 422.
+
+Failed requests (HTTPException, errors) are not stored, so the client can
+retry them. The store is `MemoryStore` (per process, bounded LRU) or
+`RedisStore` (shared by all workers), picked with IDEMPOTENCY_BACKEND.
+"""
+import asyncio
+import functools
+import hashlib
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import HTTPException
+from fastapi.encoders import jsonable_encoder
+
+from ratelimit import REDIS_URL
+from wire import NegotiatedResponse
+
+logger = logging.getLogger(__name__)
+
+IDEMPOTENCY_BACKEND = os.environ.get("IDEMPOTENCY_BACKEND", "memory").lower()
+IDEMPOTENCY_TTL = float(os.environ.get("IDEMPOTENCY_TTL", str(24 * 3600)))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get("IDEMPOTENCY_MAX_KEYS", "100000"))
+# how long a duplicate waits for the in-flight original
+IDEMPOTENCY_WAIT = float(os.environ.get("IDEMPOTENCY_WAIT", "10"))
+MAX_KEY_LENGTH = 255
+
+# arguments that do not describe the request itself
+_IGNORED_ARGS = {"current_user", "db", "idempotency_key"}
+
+
+class MemoryStore:
+    """Stored responses in process memory (OrderedDict LRU with TTL)."""
+
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL, max_keys: int = IDEMPOTENCY_MAX_KEYS):
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self._records: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._inflight: dict[str, asyncio.Future] = {}
+
+    def _lookup(self, key: str) -> Optional[dict]:
+        entry = self._records.get(key)
+        if entry is None:
+            return None
+        expires, record = entry
+        if expires <= time.monotonic():
+            del self._records[key]
+            return None
+        self._records.move_to_end(key)
+        return record
+
+    async def begin(self, key: str) -> Optional[dict]:
+        """Stored record for `key`, or None if the caller should execute (and own) it."""
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+        while True:
+            record = self._lookup(key)
+            if record is not None:
+                return record
+            pending = self._inflight.get(key)
+            if pending is None:
+                self._inflight[key] = asyncio.get_running_loop().create_future()
+                return None
+            try:
+                await asyncio.wait_for(asyncio.shield(pending), max(deadline - time.monotonic(), 0))
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+            # either the result is stored now or the original failed and we may run
+
+    async def complete(self, key: str, record: dict) -> None:
+        self._records[key] = (time.monotonic() + self.ttl, record)
+        self._records.move_to_end(key)
+        while len(self._records) > self.max_keys:
+            self._records.popitem(last=False)
+        self._release(key)
+
+    async def abort(self, key: str) -> None:
+        self._release(key)
+
+    def _release(self, key: str) -> None:
+        pending = self._inflight.pop(key, None)
+        if pending is not None and not pending.done():
+            pending.set_result(None)
+
+
+_INFLIGHT = b"inflight"
+
+
+class RedisStore:
+    """Stored responses in Redis, shared by all workers.
+
+    The owner marks the key with SET NX; duplicates poll until the record
+    replaces the marker. If Redis is unreachable requests run without
+    idempotency protection (logged), like the rate limiter.
+    """
+
+    poll_interval = 0.05
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = "idempotency", ttl: float = IDEMPOTENCY_TTL):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as exc:  # pragma: no cover - depends on environment
+            raise RuntimeError("IDEMPOTENCY_BACKEND=redis requires the 'redis' package") from exc
+        self._client = redis_asyncio.from_url(url)
+        self.prefix = prefix
+        self.ttl = ttl
+
+    async def begin(self, key: str) -> Optional[dict]:
+        name = f"{self.prefix}:{key}"
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT
+        try:
+            while True:
+                # the marker expires on its own if the owner dies mid-request
+                if await self._client.set(name, _INFLIGHT, nx=True, ex=max(int(IDEMPOTENCY_WAIT * 6), 1)):
+                    return None
+                value = await self._client.get(name)
+                if value is not None and value != _INFLIGHT:
+                    return json.loads(value)
+                if time.monotonic() >= deadline:
+                    raise HTTPException(status_code=409, detail="A request with this Idempotency-Key is in progress")
+                await asyncio.sleep(self.poll_interval)
+        except HTTPException:
+            raise
+        except Exception:
+            logger.exception("Idempotency store error; executing request")
+            return None
+
+    async def complete(self, key: str, record: dict) -> None:
+        try:
+            await self._client.set(f"{self.prefix}:{key}", json.dumps(record), ex=int(self.ttl))
+        except Exception:
+            logger.exception("Idempotency store error; response not stored")
+
+    async def abort(self, key: str) -> None:
+        try:
+            await self._client.delete(f"{self.prefix}:{key}")
+        except Exception:
+            logger.exception("Idempotency store error")
+
+
+_store = None
+
+
+def get_store():
+    """Return the process-wide store selected by IDEMPOTENCY_BACKEND."""
+    global _store
+    if _store is None:
+        _store = RedisStore() if IDEMPOTENCY_BACKEND == "redis" else MemoryStore()
+    return _store
+
+
+def _fingerprint(kwargs: dict) -> str:
+    args = {k: v for k, v in kwargs.items() if k not in _IGNORED_ARGS}
+    return hashlib.sha256(json.dumps(jsonable_encoder(args), sort_keys=True).encode()).hexdigest()
+
+
+def idempotent(response_model=None):
+    """Route decorator; `response_model` converts ORM results before storing."""
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            key = kwargs.get("idempotency_key")
+            # handlers called directly (e.g. from /batch) get the Header() default
+            if not isinstance(key, str) or not key:
+                return await func(*args, **kwargs)
+            if len(key) > MAX_KEY_LENGTH:
+                raise HTTPException(status_code=400, detail="Idempotency-Key is too long")
+            scope = f"{kwargs['current_user']['id']}:{func.__name__}:{key}"
+            fingerprint = _fingerprint(kwargs)
+            store = get_store()
+            record = await store.begin(scope)
+            if record is not None:
+                if record["fingerprint"] != fingerprint:
+                    raise HTTPException(status_code=422, detail="Idempotency-Key was used for a different request")
+                return NegotiatedResponse(record["body"], headers={"Idempotent-Replayed": "true"})
+            try:
+                result = await func(*args, **kwargs)
+            except BaseException:
+                await store.abort(scope)
+                raise
+            body = jsonable_encoder(response_model.model_validate(result) if response_model else result)
+            await store.complete(scope, {"fingerprint": fingerprint, "body": body})
+            return body
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,225 @@
+"""Load shedding: concurrency limits per route group, with queue deadlines.
+
+`LoadSheddingMiddleware` puts every HTTP request into the group of its
+router in routes.py (`route_groups`), named by the router's OpenAPI tag:
+Auth, Users, Todos, Sessions or Admin. A group runs at most `limit` requests at a time. Further requests
+wait in a FIFO queue of at most LOAD_SHED_MAX_QUEUE entries. A request that
+cannot get a slot within LOAD_SHED_QUEUE_TIMEOUT seconds, or finds the queue
+full, is answered 503 with Retry-After. It never reaches the route, so it
+never touches the database. When the database slows down, each group keeps
+a bounded amount of work in flight and finishes it in time. Requests that
+would only time out later are turned away early, and one slow group does
+not take the other groups down with it.
+
+A slot is held until the response starts, so a streaming response (SSE)
+gives it back once its headers are sent.
+
+The limits adapt to the observed latency (AIMD). A response slower than the
+group's latency target, or a 5xx, cuts the limit by LOAD_SHED_BACKOFF, at
+most once per target interval. Responses within the target, while the limit
+is fully used, raise it by about one per `limit` responses. The limit stays
+between LOAD_SHED_MIN_LIMIT and LOAD_SHED_MAX_FACTOR times its configured
+value. Per-group settings: LOAD_SHED_<GROUP>_LIMIT and
+LOAD_SHED_<GROUP>_LATENCY_TARGET (e.g. LOAD_SHED_TODOS_LIMIT).
+
+Never limited: the paths in LOAD_SHED_BYPASS (`/healthz`, `/metrics`),
+websockets, and routes outside the routers (docs).
+"""
+import asyncio
+import os
+import time
+from collections import deque
+from typing import Optional
+
+from starlette.routing import Match
+
+LOAD_SHED_ENABLED = os.environ.get("LOAD_SHED_ENABLED", "true").lower() in ("1", "true", "yes")
+LOAD_SHED_QUEUE_TIMEOUT = float(os.environ.get("LOAD_SHED_QUEUE_TIMEOUT", "1.0"))
+LOAD_SHED_MAX_QUEUE = int(os.environ.get("LOAD_SHED_MAX_QUEUE", "200"))
+LOAD_SHED_LATENCY_TARGET = float(os.environ.get("LOAD_SHED_LATENCY_TARGET", "0.5"))
+LOAD_SHED_BACKOFF = float(os.environ.get("LOAD_SHED_BACKOFF", "0.9"))
+LOAD_SHED_MIN_LIMIT = int(os.environ.get("LOAD_SHED_MIN_LIMIT", "2"))
+LOAD_SHED_MAX_FACTOR = float(os.environ.get("LOAD_SHED_MAX_FACTOR", "4"))
+LOAD_SHED_BYPASS = frozenset(
+    p.strip() for p in os.environ.get("LOAD_SHED_BYPASS", "/healthz,/metrics").split(",") if p.strip()
+)
+
+# initial limits; password hashing makes Auth requests expensive
+_DEFAULT_LIMITS = {"Auth": 16, "Users": 16, "Todos": 64, "Sessions": 32, "Admin": 8}
+_DEFAULT_TARGETS = {"Auth": 1.0}
+
+
+def _setting(group: str, name: str, default: float) -> float:
+    return float(os.environ.get(f"LOAD_SHED_{group.upper()}_{name}", default))
+
+
+class AdaptiveLimiter:
+    """Concurrency limit of one route group, with a FIFO wait queue."""
+
+    def __init__(
+        self,
+        name: str,
+        limit: int,
+        latency_target: float = LOAD_SHED_LATENCY_TARGET,
+        queue_timeout: float = LOAD_SHED_QUEUE_TIMEOUT,
+        max_queue: int = LOAD_SHED_MAX_QUEUE,
+    ):
+        self.name = name
+        self.limit = float(limit)
+        self.min_limit = min(LOAD_SHED_MIN_LIMIT, limit)
+        self.max_limit = max(limit * LOAD_SHED_MAX_FACTOR, limit)
+        self.latency_target = latency_target
+        self.queue_timeout = queue_timeout
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self._last_backoff = 0.0
+
+    def _has_room(self) -> bool:
+        return self.in_flight < int(self.limit)
+
+    async def acquire(self) -> bool:
+        """Take a slot; False if none freed up within queue_timeout (or the queue is full)."""
+        if self._has_room() and not self._waiters:
+            self.in_flight += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.max_queue:
+            self.shed += 1
+            return False
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as exc:
+            if waiter.done() and not waiter.cancelled():
+                # the slot was handed over just as we gave up: pass it on
+                self._release_slot()
+            else:
+                waiter.cancel()
+                self._waiters.remove(waiter)
+            if isinstance(exc, asyncio.CancelledError):
+                raise
+            self.shed += 1
+            return False
+        self.admitted += 1
+        return True
+
+    def _release_slot(self) -> None:
+        self.in_flight -= 1
+        # hand freed slots to the oldest waiters; the limit may have shrunk
+        while self._waiters and self._has_room():
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    def release(self, latency: float, ok: bool = True) -> None:
+        """Give the slot back and adapt the limit to how the request went."""
+        saturated = self.in_flight >= int(self.limit)
+        if not ok or latency > self.latency_target:
+            now = time.monotonic()
+            # one cut per target interval: the requests already in flight
+            # were admitted under the old limit
+            if now - self._last_backoff >= self.latency_target:
+                self.limit = max(self.min_limit, self.limit * LOAD_SHED_BACKOFF)
+                self._last_backoff = now
+        elif saturated:
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+        self._release_slot()
+
+    def snapshot(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": self.shed,
+        }
+
+
+class LoadShedder:
+    """The limiters of all route groups, created on first use."""
+
+    def __init__(self, enabled: bool = LOAD_SHED_ENABLED):
+        self.enabled = enabled
+        self.limiters: dict[str, AdaptiveLimiter] = {}
+
+    def limiter(self, group: str) -> AdaptiveLimiter:
+        limiter = self.limiters.get(group)
+        if limiter is None:
+            limiter = self.limiters[group] = AdaptiveLimiter(
+                group,
+                int(_setting(group, "LIMIT", _DEFAULT_LIMITS.get(group, 32))),
+                _setting(group, "LATENCY_TARGET", _DEFAULT_TARGETS.get(group, LOAD_SHED_LATENCY_TARGET)),
+            )
+        return limiter
+
+    def snapshot(self) -> dict:
+        return {group: limiter.snapshot() for group, limiter in sorted(self.limiters.items())}
+
+
+shedder = LoadShedder()
+
+
+def route_group(routers, scope) -> Optional[str]:
+    """Tag of the router with a route matching the request (None: no such route)."""
+    for router in routers:
+        for route in router.routes:
+            if route.matches(scope)[0] != Match.NONE:
+                return router.tags[0]
+    return None
+
+
+async def _overloaded(send) -> None:
+    body = b'{"detail":"Server is overloaded, retry later"}'
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", b"1"),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class LoadSheddingMiddleware:
+    """ASGI middleware applying `shedder`'s per-group limits (see module docstring)."""
+
+    def __init__(self, app, routers=(), shedder: LoadShedder = shedder):
+        self.app = app
+        self.routers = routers
+        self.shedder = shedder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.shedder.enabled or scope["path"] in LOAD_SHED_BYPASS:
+            return await self.app(scope, receive, send)
+        group = route_group(self.routers, scope)
+        if group is None:
+            return await self.app(scope, receive, send)
+        limiter = self.shedder.limiter(group)
+        if not await limiter.acquire():
+            return await _overloaded(send)
+
+        started = time.monotonic()
+        held = True
+
+        def release(ok: bool) -> None:
+            nonlocal held
+            if held:
+                held = False
+                limiter.release(time.monotonic() - started, ok)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                release(message["status"] < 500)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            release(False)
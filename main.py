@@ -1,21 +1,77 @@
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
+import logging
+from sqlalchemy.exc import DBAPIError
 
-from db import engine
-from routes import router as api_router
+from db import dispose_engines, warm_up_pool, DB_POOL_WARMUP, DATABASE_URL
+from crud import prepare_hot_statements
+from outbox import dispatcher as outbox_dispatcher
+from realtime import feed as change_feed
+from activity import tracker as activity_tracker
+from positions import rebalancer
+from reminders import scheduler as reminder_scheduler
+from audit import audit_log
+from archive import archiver
+from partitions import maintainer as partition_maintainer
+from routes import router as api_router, route_groups
+from wire import CompressionMiddleware
+from loadshed import LoadSheddingMiddleware
+from guardrails import query_timeout_handler
+
+logger = logging.getLogger(__name__)
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    """Lifespan hook: освобождение ресурсов при shutdown.
+    """Lifespan hook: прогрев пула при старте и освобождение ресурсов при shutdown.
 
-    Явно вызываем engine.dispose() для аккуратного закрытия пула.
+    Прогрев открывает DB_POOL_WARMUP соединений и готовит горячие запросы,
+    чтобы первые запросы после деплоя не платили за установку соединения.
+    Диспетчер e-mail outbox работает в фоне на всё время жизни приложения.
+    Лента изменений задач на Postgres слушает LISTEN/NOTIFY других воркеров.
+    Активность сессий пишется пачками; при shutdown буфер сбрасывается в БД.
+    Планировщик напоминаний держит в памяти только ближайшее окно.
+    Журнал аудита пишется пачками; при shutdown буфер сбрасывается в БД.
+    Старые выполненные задачи переносятся в архив небольшими пачками.
+    Партиции (Postgres) создаются заранее, истёкшие удаляются целиком.
+    При shutdown останавливаем writer SQLite (если есть) и закрываем пулы.
     """
+    try:
+        await warm_up_pool(DB_POOL_WARMUP, prepare_hot_statements)
+    except Exception:
+        # Не блокируем старт приложения: пул наполнится лениво
+        logger.exception("Database pool warm-up failed")
+    partition_maintainer.start()
+    outbox_dispatcher.start()
+    await change_feed.start(DATABASE_URL)
+    activity_tracker.start()
+    audit_log.start()
+    rebalancer.start()
+    reminder_scheduler.start()
+    archiver.start()
     yield
-    await engine.dispose()
+    await archiver.stop()
+    await reminder_scheduler.stop()
+    await rebalancer.stop()
+    await change_feed.stop()
+    await activity_tracker.stop()
+    await audit_log.stop()
+    await outbox_dispatcher.stop()
+    await partition_maintainer.stop()
+    await dispose_engines()
 
 # Инициализируем FastAPI с хуком lifespan
 app = FastAPI(lifespan=lifespan, title="Todo API", description="Async FastAPI + SQLAlchemy")
 
+# Сжатие больших ответов (brotli/gzip, см. wire.py)
+app.add_middleware(CompressionMiddleware)
+
+# Лимиты конкурентности по группам маршрутов и сброс нагрузки (см. loadshed.py);
+# добавлен последним — самый внешний, отказ не доходит до приложения
+app.add_middleware(LoadSheddingMiddleware, routers=route_groups)
+
+# Запрос, упёршийся в statement_timeout/lock_timeout, — 503 (см. guardrails.py)
+app.add_exception_handler(DBAPIError, query_timeout_handler)
+
 # Подключаем маршруты из модуля routes.py
 app.include_router(api_router)
@@ -0,0 +1,69 @@
+"""In-process metrics exposed by the `/metrics` endpoint.
+
+Currently tracks how long each route keeps a pooled DB connection checked
+out (`db_pool_hold_seconds`). The route is taken from `route_label`, which
+`db.get_db` sets for every request; work outside requests (background tasks)
+is reported as "background".
+"""
+import bisect
+import time
+from contextvars import ContextVar
+
+from sqlalchemy import event
+
+route_label: ContextVar[str] = ContextVar("route_label", default="background")
+
+# upper bounds (seconds) of the hold-time histogram buckets
+HOLD_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class Histogram:
+    __slots__ = ("count", "total", "max", "buckets")
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = [0] * (len(HOLD_BUCKETS) + 1)
+
+    def observe(self, value: float) -> None:
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+        self.buckets[bisect.bisect_left(HOLD_BUCKETS, value)] += 1
+
+    def snapshot(self) -> dict:
+        bounds = [str(b) for b in HOLD_BUCKETS] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.total, 6),
+            "max": round(self.max, 6),
+            "buckets": dict(zip(bounds, self.buckets)),
+        }
+
+
+pool_hold_seconds: dict[str, Histogram] = {}
+
+
+def instrument_pool(sync_engine) -> None:
+    """Record connection hold time per route for every checkout of `sync_engine`."""
+
+    @event.listens_for(sync_engine, "checkout")
+    def _on_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["hold_started"] = (time.perf_counter(), route_label.get())
+
+    @event.listens_for(sync_engine, "checkin")
+    def _on_checkin(dbapi_connection, connection_record):
+        started = connection_record.info.pop("hold_started", None)
+        if started is None:
+            return
+        t0, route = started
+        hist = pool_hold_seconds.get(route)
+        if hist is None:
+            hist = pool_hold_seconds[route] = Histogram()
+        hist.observe(time.perf_counter() - t0)
+
+
+def snapshot() -> dict:
+    return {"db_pool_hold_seconds": {route: h.snapshot() for route, h in sorted(pool_hold_seconds.items())}}
@@ -1,9 +1,65 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, JSON, Text, ForeignKey
+import ipaddress
+
+from sqlalchemy import BigInteger, Column, Date, Integer, LargeBinary, String, Boolean, DateTime, JSON, Text, ForeignKey, Index, Table, UniqueConstraint, false, true
+from sqlalchemy.dialects.postgresql import INET
+from sqlalchemy.types import TypeDecorator
 from datetime import datetime, timezone
 from db import Base
 from sqlalchemy.orm import relationship
 
 
+class UTCDateTime(TypeDecorator):
+    """DateTime(timezone=True) that always returns aware UTC values.
+
+    Postgres already does this for timestamptz; SQLite stores no offset and
+    hands back naive datetimes, which then cannot be compared with
+    `datetime.now(timezone.utc)` in the routes.
+    """
+    impl = DateTime(timezone=True)
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is not None and value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value
+
+    def process_result_value(self, value, dialect):
+        if value is not None and value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        return value
+
+
+class IPAddress(TypeDecorator):
+    """IP address, a plain string in Python.
+
+    Stored as INET on Postgres and as 4/16 packed bytes elsewhere. A value
+    that is not an address (e.g. a forged X-Forwarded-For) is stored as NULL.
+    """
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(INET())
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        try:
+            addr = ipaddress.ip_address(value)
+        except ValueError:
+            return None
+        return str(addr) if dialect.name == "postgresql" else addr.packed
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, (bytes, memoryview)):
+            return str(ipaddress.ip_address(bytes(value)))
+        return str(value)
+
+
 class User(Base):
     """Модель пользователя.
 
@@ -28,10 +84,12 @@ class User(Base):
     scopes = Column(JSON, default=lambda: ["user"])
     # Email verification token and expiry for activation flow
     verification_token = Column(String, nullable=True, index=True)
-    verification_expires = Column(DateTime(timezone=True), nullable=True)
+    verification_expires = Column(UTCDateTime(), nullable=True)
     # Use a callable so the timestamp is evaluated for each row at insert
-    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
-    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    created_at = Column(UTCDateTime(), default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(UTCDateTime(), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    # last change sequence number handed out for this user's todos (see todo_sync.py)
+    todo_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
 
 
 class Todo(Base):
@@ -51,22 +109,235 @@ class Todo(Base):
     # Для упрощения удаления аккаунтов и автоматической очистки связанных
     # задач используем ON DELETE CASCADE: при удалении пользователя все
     # связанные todos будут удалены автоматически.
-    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     owner = relationship("User", back_populates="todos")
     is_done = Column(Boolean, default=False)
     # Use a callable so the timestamp is evaluated for each row at insert
-    created_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
-    updated_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+    created_at = Column(UTCDateTime(), default=lambda: datetime.now(timezone.utc))
+    updated_at = Column(UTCDateTime(), default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
     # When the task was completed (nullable)
-    completed_at = Column(DateTime(timezone=True), nullable=True)
+    completed_at = Column(UTCDateTime(), nullable=True)
     # Who completed the task (nullable FK to users)
     completed_by = Column(Integer, nullable=True)
+    # owner's change sequence at the last write; drives `GET /todos/changes`
+    change_seq = Column(BigInteger, nullable=False, default=0, server_default="0")
+    # manual order within the owner's list: fractional key, see positions.py
+    position = Column(String, nullable=False)
+    # срок выполнения (информационно) и время напоминания; remind_at
+    # сбрасывается в NULL, когда напоминание отправлено (см. reminders.py)
+    due_at = Column(UTCDateTime(), nullable=True)
+    remind_at = Column(UTCDateTime(), nullable=True)
+    # подзадачи (см. subtasks.py): родитель, materialized path предков
+    # ("/12/40/"; "/" — задача верхнего уровня) и прогресс прямых детей
+    parent_id = Column(Integer, ForeignKey("todos.id", ondelete="CASCADE"), nullable=True, index=True)
+    path = Column(String, nullable=False, default="/", server_default="/")
+    subtasks_total = Column(Integer, nullable=False, default=0, server_default="0")
+    subtasks_done = Column(Integer, nullable=False, default=0, server_default="0")
+    # общий список (см. sharing.py); задача списка принадлежит его владельцу
+    list_id = Column(Integer, ForeignKey("todo_lists.id", ondelete="SET NULL"), nullable=True, index=True)
+
+    __table_args__ = (
+        Index("ix_todos_owner_change_seq", "owner_id", "change_seq"),
+        # GET /todos, default sort_by=created_at (see guardrails.py)
+        Index("ix_todos_owner_created", "owner_id", "created_at", "id"),
+        # sort_by=id; also serves plain owner_id lookups
+        Index("ix_todos_owner_id", "owner_id", "id"),
+        # sort_by=position + keyset pagination on (position, id)
+        Index("ix_todos_owner_position", "owner_id", "position", "id"),
+        # archival candidates only (archive.py)
+        Index(
+            "ix_todos_done_completed_at",
+            "completed_at",
+            postgresql_where=is_done == true(),
+            sqlite_where=is_done == true(),
+        ),
+        # only open todos with a pending reminder; the scheduler reads a
+        # short range of it per window
+        Index(
+            "ix_todos_pending_reminders",
+            "remind_at",
+            "id",
+            postgresql_where=remind_at.isnot(None) & (is_done == false()),
+            sqlite_where=remind_at.isnot(None) & (is_done == false()),
+        ),
+    )
+
+
+class TodoList(Base):
+    """Общий список задач (см. sharing.py).
+
+    Задачи списка (`Todo.list_id`) принадлежат владельцу списка; другим
+    пользователям доступ выдаётся через `list_members`.
+    """
+    __tablename__ = "todo_lists"
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    name = Column(String, nullable=False)
+    created_at = Column(UTCDateTime(), default=lambda: datetime.now(timezone.utc))
+
+
+class ListMember(Base):
+    """Участник общего списка: role "read" или "write".
+
+    The primary key starts with user_id: "lists shared with user X" — the
+    subquery of every access check — is one index range.
+    """
+    __tablename__ = "list_members"
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    list_id = Column(Integer, ForeignKey("todo_lists.id", ondelete="CASCADE"), primary_key=True)
+    role = Column(String, nullable=False)
+
+    __table_args__ = (Index("ix_list_members_list_id", "list_id"),)
+
+
+class TodoArchive(Base):
+    """Архив выполненных задач (cold storage, see archive.py).
+
+    Same columns as `todos` plus `archived_at`; tags are kept as a JSON list
+    of names. On Postgres the migration partitions the table by completion
+    month, with primary key (id, completed_at).
+    """
+    __tablename__ = "todos_archive"
+    id = Column(Integer, primary_key=True)
+    title = Column(String, nullable=False)
+    description = Column(Text, nullable=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    is_done = Column(Boolean, nullable=False, default=True)
+    created_at = Column(UTCDateTime())
+    updated_at = Column(UTCDateTime())
+    completed_at = Column(UTCDateTime(), nullable=False)
+    completed_by = Column(Integer, nullable=True)
+    position = Column(String, nullable=False)
+    due_at = Column(UTCDateTime(), nullable=True)
+    parent_id = Column(Integer, nullable=True)
+    list_id = Column(Integer, nullable=True)
+    tags = Column(JSON, nullable=False, default=list)
+    archived_at = Column(UTCDateTime(), nullable=False, default=lambda: datetime.now(timezone.utc))
+
+    __table_args__ = (Index("ix_todos_archive_owner_completed", "owner_id", "completed_at", "id"),)
+
+
+class TodoStats(Base):
+    """Сводка задач пользователя для `GET /todos/stats` (см. todo_stats.py).
+
+    Открытые и выполненные задачи, включая архивные; поддерживается при
+    каждом flush, как и `todo_stats_daily`.
+    """
+    __tablename__ = "todo_stats"
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    open_count = Column(Integer, nullable=False, default=0, server_default="0")
+    done_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class TodoStatsDaily(Base):
+    """Задачи пользователя, созданные / выполненные за день (UTC).
+
+    The primary key (owner_id, day) makes a series one index range.
+    """
+    __tablename__ = "todo_stats_daily"
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), primary_key=True)
+    day = Column(Date, primary_key=True)
+    created = Column(Integer, nullable=False, default=0, server_default="0")
+    completed = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+# Join table todo <-> tag. The primary key starts with tag_id, so "todos with
+# tag X" (GET /todos?tag=...) is an index range scan; ix_todo_tags_todo_id
+# serves loading the tags of a page of todos.
+todo_tags = Table(
+    "todo_tags",
+    Base.metadata,
+    Column("tag_id", Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True),
+    Column("todo_id", Integer, ForeignKey("todos.id", ondelete="CASCADE"), primary_key=True),
+    Index("ix_todo_tags_todo_id", "todo_id"),
+)
+
+
+class Tag(Base):
+    """Тег пользователя (имя нормализовано, см. tags.py).
+
+    `todo_count` — число задач владельца с этим тегом; поддерживается при
+    каждом flush (tags.py), чтобы `GET /tags` не сканировал todo_tags.
+    """
+    __tablename__ = "tags"
+    id = Column(Integer, primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    name = Column(String, nullable=False)
+    todo_count = Column(Integer, nullable=False, default=0, server_default="0")
+
+    __table_args__ = (UniqueConstraint("owner_id", "name", name="uq_tags_owner_name"),)
+
+
+Todo.tags = relationship("Tag", secondary=todo_tags, lazy="selectin", order_by=Tag.name)
+
+
+class TodoTombstone(Base):
+    """Marker left in the former owner's change stream when a todo is
+    deleted or reassigned, so delta sync can tell clients to drop it.
+
+    Rows with `list_id` belong to the stream of that shared list instead:
+    members drop a todo that was deleted, reassigned or moved out of it.
+    """
+    __tablename__ = "todo_tombstones"
+    id = Column(Integer, primary_key=True)
+    todo_id = Column(Integer, nullable=False)
+    owner_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
+    change_seq = Column(BigInteger, nullable=False)
+    created_at = Column(UTCDateTime(), default=lambda: datetime.now(timezone.utc))
+    # no FK: the marker outlives a deleted list
+    list_id = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_todo_tombstones_owner_change_seq", "owner_id", "change_seq"),
+        Index("ix_todo_tombstones_list_change_seq", "list_id", "change_seq"),
+    )
+
+
+class AuditEvent(Base):
+    """Append-only audit trail entry (written in batches by audit.py).
+
+    On Postgres the migration creates this table partitioned by month on
+    created_at, with primary key (id, created_at).
+    """
+    __tablename__ = "audit_events"
+    id = Column(BigInteger().with_variant(Integer, "sqlite"), primary_key=True)
+    created_at = Column(UTCDateTime(), nullable=False)
+    # no FK: the trail must outlive deleted users and todos
+    actor_id = Column(Integer, nullable=True)
+    # e.g. "todo.completed", "todo.assigned", "session.revoked"
+    action = Column(String, nullable=False)
+    target_type = Column(String, nullable=False)
+    target_id = Column(Integer, nullable=True)
+    data = Column(JSON, nullable=True)
+    ip_address = Column(String, nullable=True)
+
+    __table_args__ = (
+        # GET /admin/audit: newest first with keyset pagination on (created_at, id)
+        Index("ix_audit_events_created_id", "created_at", "id"),
+        Index("ix_audit_events_actor", "actor_id", "created_at", "id"),
+        Index("ix_audit_events_target", "target_type", "target_id", "created_at", "id"),
+    )
+
+
+class UserAgent(Base):
+    """Словарь строк User-Agent.
+
+    Сессии ссылаются на строку по id вместо того, чтобы повторять её в каждой
+    ротации refresh token. Уникальность держим по 16-байтному дайджесту:
+    сами строки бывают длиннее, чем допускает B-tree индекс.
+    """
+    __tablename__ = "user_agents"
+    id = Column(Integer, primary_key=True)
+    digest = Column(LargeBinary(16), nullable=False, unique=True)
+    value = Column(Text, nullable=False)
 
 
 class RefreshToken(Base):
     """Модель для stateful refresh tokens.
 
-    Храним хэш токена, метаданные и статус ревока/ротации.
+    Храним хэш токена, метаданные и статус ревока/ротации. Компактная
+    раскладка: хэш — 32 сырых байта, User-Agent — ссылка на `user_agents`,
+    IP — INET (см. `IPAddress`).
     """
     __tablename__ = "refresh_tokens"
     id = Column(Integer, primary_key=True, index=True)
@@ -75,20 +346,57 @@ class RefreshToken(Base):
     # удаляются автоматически.
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     user = relationship("User", back_populates="refresh_tokens")
-    token_hash = Column(String, nullable=False, unique=True, index=True)
+    # HMAC-SHA256 digest (32 bytes), see auth.hash_refresh_token
+    token_hash = Column(LargeBinary(32), nullable=False, unique=True, index=True)
     # issued_at should be set at creation time per-row
-    issued_at = Column(DateTime(timezone=True), default=lambda: datetime.now(timezone.utc))
-    expires_at = Column(DateTime(timezone=True), nullable=False)
-    last_used_at = Column(DateTime(timezone=True), nullable=True)
+    issued_at = Column(UTCDateTime(), default=lambda: datetime.now(timezone.utc))
+    expires_at = Column(UTCDateTime(), nullable=False)
+    last_used_at = Column(UTCDateTime(), nullable=True)
     revoked = Column(Boolean, default=False)
     device_id = Column(String, nullable=True)
     # device_type indicates category of client ('web','mobile','desktop', etc.)
     device_type = Column(String, nullable=True, index=True)
-    user_agent = Column(Text, nullable=True)
-    ip_address = Column(String, nullable=True)
+    user_agent_id = Column(Integer, ForeignKey("user_agents.id"), nullable=True)
+    user_agent = relationship("UserAgent", lazy="raise")
+    ip_address = Column(IPAddress(), nullable=True)
     replaced_by_id = Column(Integer, nullable=True)
 
 
+class EmailOutbox(Base):
+    """Transactional outbox for e-mails.
+
+    Rows are written in the same transaction as the change that triggers the
+    mail (e.g. the new user row) and delivered later by
+    `outbox.OutboxDispatcher`. `kind` + `payload` describe the message; it is
+    rendered at send time (see `emailer.render`).
+    """
+    __tablename__ = "email_outbox"
+    id = Column(Integer, primary_key=True)
+    to_email = Column(String, nullable=False)
+    kind = Column(String, nullable=False)
+    payload = Column(JSON, nullable=False, default=dict)
+    created_at = Column(UTCDateTime(), default=lambda: datetime.now(timezone.utc))
+    # earliest time of the next delivery attempt (moved forward on failure)
+    available_at = Column(UTCDateTime(), default=lambda: datetime.now(timezone.utc), nullable=False)
+    # a dispatcher owns the row until this time (lets several workers share the table)
+    claimed_until = Column(UTCDateTime(), nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    last_error = Column(Text, nullable=True)
+    sent_at = Column(UTCDateTime(), nullable=True)
+    failed_at = Column(UTCDateTime(), nullable=True)
+
+    __table_args__ = (
+        # only undelivered rows are ever scanned by the dispatcher
+        Index(
+            "ix_email_outbox_pending",
+            "available_at",
+            "id",
+            postgresql_where=sent_at.is_(None) & failed_at.is_(None),
+            sqlite_where=sent_at.is_(None) & failed_at.is_(None),
+        ),
+    )
+
+
 # Relationships defined on User for ORM convenience
 User.todos = relationship("Todo", back_populates="owner", cascade="all, delete-orphan", passive_deletes=True)
 User.refresh_tokens = relationship("RefreshToken", back_populates="user", cascade="all, delete-orphan", passive_deletes=True)
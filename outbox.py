@@ -0,0 +1,167 @@
+"""Background delivery of the transactional e-mail outbox.
+
+`OutboxDispatcher` runs as a task started from `main.lifespan`. Each round it
+
+1. claims up to OUTBOX_BATCH_SIZE due rows (`claimed_until` lease, with
+   SKIP LOCKED on Postgres so several workers can share the table) and
+   commits, so no DB connection is held while talking to the mail server;
+2. renders and hands the batch to the transport (`emailer.get_transport()`);
+3. marks delivered rows `sent_at`, and reschedules failed ones with
+   exponential backoff, giving up after OUTBOX_MAX_ATTEMPTS (`failed_at`).
+
+Routes call `notify()` after committing new rows so delivery starts without
+waiting for the next poll.
+"""
+import asyncio
+import logging
+import os
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select
+
+import emailer
+from db import AsyncSessionLocal
+from models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = int(os.environ.get("OUTBOX_BATCH_SIZE", "50"))
+OUTBOX_POLL_INTERVAL = float(os.environ.get("OUTBOX_POLL_INTERVAL", "2"))
+OUTBOX_MAX_ATTEMPTS = int(os.environ.get("OUTBOX_MAX_ATTEMPTS", "8"))
+OUTBOX_BACKOFF_BASE = float(os.environ.get("OUTBOX_BACKOFF_BASE", "5"))
+OUTBOX_BACKOFF_MAX = float(os.environ.get("OUTBOX_BACKOFF_MAX", "3600"))
+OUTBOX_CLAIM_SECONDS = float(os.environ.get("OUTBOX_CLAIM_SECONDS", "120"))
+
+
+def backoff_delay(attempts: int) -> float:
+    """Delay before retry number `attempts` (exponential, capped, jittered)."""
+    delay = min(OUTBOX_BACKOFF_MAX, OUTBOX_BACKOFF_BASE * (2 ** max(attempts - 1, 0)))
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxDispatcher:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        transport=None,
+        batch_size: int = OUTBOX_BATCH_SIZE,
+        poll_interval: float = OUTBOX_POLL_INTERVAL,
+        max_attempts: int = OUTBOX_MAX_ATTEMPTS,
+    ):
+        self.session_factory = session_factory
+        self.transport = transport if transport is not None else emailer.get_transport()
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._stopping = False
+        self._wake = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="email-outbox")
+
+    def notify(self) -> None:
+        """Wake the dispatcher: new rows were committed."""
+        if self._wake is not None:
+            self._wake.set()
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wake.set()
+        await self._task
+        self._task = None
+        await self.transport.close()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                sent = await self.run_once()
+            except Exception:
+                logger.exception("Email outbox dispatch failed")
+                sent = 0
+            if sent >= self.batch_size:
+                # backlog: go straight to the next batch
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def _claim(self, now: datetime) -> list[dict]:
+        async with self.session_factory() as db:
+            q = (
+                select(EmailOutbox)
+                .where(
+                    EmailOutbox.sent_at.is_(None),
+                    EmailOutbox.failed_at.is_(None),
+                    EmailOutbox.available_at <= now,
+                    (EmailOutbox.claimed_until.is_(None)) | (EmailOutbox.claimed_until < now),
+                )
+                .order_by(EmailOutbox.available_at, EmailOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            rows = (await db.execute(q)).scalars().all()
+            if not rows:
+                await db.rollback()
+                return []
+            claim = now + timedelta(seconds=OUTBOX_CLAIM_SECONDS)
+            for row in rows:
+                row.claimed_until = claim
+            batch = [
+                {"id": r.id, "to": r.to_email, "kind": r.kind, "payload": dict(r.payload or {}), "attempts": r.attempts}
+                for r in rows
+            ]
+            await db.commit()
+        return batch
+
+    async def run_once(self) -> int:
+        """Deliver one batch of due messages. Returns how many were sent."""
+        now = datetime.now(timezone.utc)
+        batch = await self._claim(now)
+        if not batch:
+            return 0
+        ready, results = [], {}
+        for m in batch:
+            try:
+                m["subject"], m["body"] = emailer.render(m["kind"], m["payload"])
+                ready.append(m)
+            except Exception as exc:
+                results[m["id"]] = exc
+        if ready:
+            for m, exc in zip(ready, await self.transport.send_many(ready)):
+                results[m["id"]] = exc
+        sent = 0
+        done_at = datetime.now(timezone.utc)
+        async with self.session_factory() as db:
+            rows = (
+                await db.execute(select(EmailOutbox).where(EmailOutbox.id.in_([m["id"] for m in batch])))
+            ).scalars().all()
+            for row in rows:
+                exc = results.get(row.id)
+                row.claimed_until = None
+                if exc is None:
+                    row.sent_at = done_at
+                    sent += 1
+                    continue
+                row.attempts = (row.attempts or 0) + 1
+                row.last_error = f"{type(exc).__name__}: {exc}"[:1000]
+                if row.attempts >= self.max_attempts:
+                    row.failed_at = done_at
+                    logger.error("Giving up on email %s to %s after %d attempts", row.id, row.to_email, row.attempts)
+                else:
+                    row.available_at = done_at + timedelta(seconds=backoff_delay(row.attempts))
+            await db.commit()
+        return sent
+
+
+dispatcher = OutboxDispatcher()
@@ -0,0 +1,161 @@
+"""Monthly range partitions on Postgres.
+
+Some tables are created by their migrations as `PARTITION BY RANGE
+(<timestamp>)`:
+
+- `audit_events` and `todos_archive` always;
+- `refresh_tokens` opt-in (REFRESH_TOKENS_PARTITIONED=1 at migration time).
+
+Writers call `MonthlyPartitions.ensure()` with the months they are about to
+write. It creates any missing partition (`<table>_YYYY_MM`) in the writer's
+transaction. `PartitionMaintainer`, started from `main.lifespan`, creates
+partitions PARTITION_MONTHS_AHEAD months in advance for tables whose
+writers cannot do DDL (e.g. the login path). It also drops whole partitions
+once they fall out of a table's retention, instead of deleting rows. On
+other databases, or when a table is not partitioned, all of this does
+nothing.
+"""
+import asyncio
+import logging
+import os
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import text
+
+from db import AsyncSessionLocal
+
+logger = logging.getLogger(__name__)
+
+PARTITION_MONTHS_AHEAD = int(os.environ.get("PARTITION_MONTHS_AHEAD", "2"))
+PARTITION_MAINTENANCE_INTERVAL = float(os.environ.get("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+
+
+def month_start(when: datetime) -> datetime:
+    return when.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+
+def next_month(start: datetime) -> datetime:
+    return start.replace(year=start.year + 1, month=1) if start.month == 12 else start.replace(month=start.month + 1)
+
+
+class MonthlyPartitions:
+    def __init__(self, table: str):
+        self.table = table
+        # months whose partition is known to exist (remembered after commit)
+        self._known: set[datetime] = set()
+
+    async def ensure(self, db, timestamps: Iterable[datetime]) -> set[datetime]:
+        """Create missing partitions for `timestamps`; pass the result to `created` after commit."""
+        if db.bind.dialect.name != "postgresql":
+            return set()
+        months = {month_start(ts) for ts in timestamps} - self._known
+        for start in sorted(months):
+            await db.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {self.table}_{start:%Y_%m} PARTITION OF {self.table} "
+                f"FOR VALUES FROM ('{start.isoformat()}') TO ('{next_month(start).isoformat()}')"
+            ))
+        return months
+
+    def created(self, months: set[datetime]) -> None:
+        self._known |= months
+
+    async def is_partitioned(self, db) -> bool:
+        row = await db.execute(
+            text("SELECT 1 FROM pg_partitioned_table p JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = :t"),
+            {"t": self.table},
+        )
+        return row.first() is not None
+
+    async def months(self, db) -> list[datetime]:
+        """Months that currently have a partition."""
+        rows = await db.execute(
+            text(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = :t"
+            ),
+            {"t": self.table},
+        )
+        pattern = re.compile(rf"^{re.escape(self.table)}_(\d{{4}})_(\d{{2}})$")
+        found = []
+        for (name,) in rows:
+            m = pattern.match(name)
+            if m:
+                found.append(datetime(int(m.group(1)), int(m.group(2)), 1, tzinfo=timezone.utc))
+        return sorted(found)
+
+    async def drop(self, db, start: datetime) -> None:
+        name = f"{self.table}_{start:%Y_%m}"
+        await db.execute(text(f"ALTER TABLE {self.table} DETACH PARTITION {name}"))
+        await db.execute(text(f"DROP TABLE {name}"))
+        self._known.discard(start)
+
+
+class PartitionMaintainer:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        interval: float = PARTITION_MAINTENANCE_INTERVAL,
+        months_ahead: int = PARTITION_MONTHS_AHEAD,
+    ):
+        self.session_factory = session_factory
+        self.interval = interval
+        self.months_ahead = months_ahead
+        # table -> (partitions, retention after the end of a partition's month)
+        self._tables: dict[str, tuple[MonthlyPartitions, Optional[timedelta]]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def register(self, table: str, retention: Optional[timedelta] = None) -> None:
+        """Keep `table` partitioned ahead; drop months that ended more than `retention` ago."""
+        self._tables[table] = (MonthlyPartitions(table), retention)
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="partition-maintenance")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.run_once()
+            except Exception:
+                logger.exception("Partition maintenance failed")
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self, now: Optional[datetime] = None) -> list[str]:
+        """Create upcoming and drop expired partitions; returns the names dropped."""
+        now = now or datetime.now(timezone.utc)
+        upcoming = [month_start(now)]
+        for _ in range(self.months_ahead):
+            upcoming.append(next_month(upcoming[-1]))
+        dropped = []
+        for table, (partitions, retention) in self._tables.items():
+            async with self.session_factory() as db:
+                if db.bind.dialect.name != "postgresql" or not await partitions.is_partitioned(db):
+                    continue
+                created = await partitions.ensure(db, upcoming)
+                if retention is not None:
+                    for start in await partitions.months(db):
+                        # every row of the month is past retention
+                        if next_month(start) + retention <= now:
+                            await partitions.drop(db, start)
+                            dropped.append(f"{table}_{start:%Y_%m}")
+                await db.commit()
+            partitions.created(created)
+        if dropped:
+            logger.info("Dropped expired partitions: %s", ", ".join(dropped))
+        return dropped
+
+
+maintainer = PartitionMaintainer()
@@ -0,0 +1,149 @@
+"""Fractional position keys for manual todo ordering.
+
+A position is a non-empty string over DIGITS (0-9a-z) that never ends in
+"0". Keys compare as plain strings (the alphabet sorts the same under any
+collation), and between any two keys there is always a third one. Moving a
+todo therefore rewrites only that todo's key: `key_between(before, after)`.
+
+Keys grow slowly: repeated inserts at the same spot add about one character
+per five moves, and appends (`key_after`) one character per 35. When a key
+gets longer than POSITION_REBALANCE_LENGTH, `rebalancer` rewrites that
+owner's list in the background with short, evenly spaced keys.
+"""
+import asyncio
+import logging
+import os
+from typing import Optional
+
+from sqlalchemy import select
+
+from db import AsyncSessionLocal
+from models import Todo
+from todo_sync import lock_todo_list
+
+logger = logging.getLogger(__name__)
+
+DIGITS = "0123456789abcdefghijklmnopqrstuvwxyz"
+BASE = len(DIGITS)
+FIRST_KEY = DIGITS[BASE // 2]
+POSITION_REBALANCE_LENGTH = int(os.environ.get("POSITION_REBALANCE_LENGTH", "16"))
+
+
+def _midpoint(a: str, b: Optional[str]) -> str:
+    """Key strictly between a and b ("" = start, None = end of the list)."""
+    if b is not None:
+        # keep the common prefix and recurse on the rest
+        n = 0
+        while n < len(b) and (a[n] if n < len(a) else "0") == b[n]:
+            n += 1
+        if n:
+            return b[:n] + _midpoint(a[n:], b[n:])
+    lo = DIGITS.index(a[0]) if a else 0
+    hi = DIGITS.index(b[0]) if b is not None else BASE
+    if hi - lo > 1:
+        return DIGITS[(lo + hi) // 2]
+    if b is not None and len(b) > 1:
+        return b[0]
+    return DIGITS[lo] + _midpoint(a[1:], None)
+
+
+def key_between(before: Optional[str], after: Optional[str]) -> str:
+    """Key that sorts after `before` and before `after` (either may be None)."""
+    if before is not None and after is not None and before >= after:
+        raise ValueError(f"{before!r} must sort before {after!r}")
+    if before is None and after is None:
+        return FIRST_KEY
+    if after is None:
+        return key_after(before)
+    return _midpoint(before or "", after)
+
+
+def key_after(key: Optional[str]) -> str:
+    """Key for appending after `key`: increments the last digit when possible."""
+    if not key:
+        return FIRST_KEY
+    last = DIGITS.index(key[-1])
+    if last < BASE - 1:
+        return key[:-1] + DIGITS[last + 1]
+    return key + DIGITS[1]
+
+
+def spread_keys(count: int) -> list[str]:
+    """`count` ascending keys of equal, minimal length with even gaps."""
+    width = 1
+    while BASE ** width < (count + 1) * 2:
+        width += 1
+    step = BASE ** width // (count + 1)
+    keys = []
+    for i in range(1, count + 1):
+        n = i * step
+        if n % BASE == 0:
+            n += 1  # keys must not end in "0"
+        digits = []
+        for _ in range(width):
+            n, d = divmod(n, BASE)
+            digits.append(DIGITS[d])
+        keys.append("".join(reversed(digits)))
+    return keys
+
+
+class Rebalancer:
+    """Background task that re-spreads the positions of one owner's todos."""
+
+    def __init__(self, session_factory=AsyncSessionLocal):
+        self.session_factory = session_factory
+        self._queue: Optional[asyncio.Queue] = None
+        self._queued: set[int] = set()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="position-rebalancer")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    def schedule(self, owner_id: int) -> None:
+        if self._queue is None or owner_id in self._queued:
+            return
+        self._queued.add(owner_id)
+        self._queue.put_nowait(owner_id)
+
+    async def _run(self) -> None:
+        while True:
+            owner_id = await self._queue.get()
+            self._queued.discard(owner_id)
+            try:
+                await self.rebalance(owner_id)
+            except Exception:
+                logger.exception("Rebalancing positions of owner %s failed", owner_id)
+
+    async def rebalance(self, owner_id: int) -> int:
+        """Rewrite the owner's positions; returns the number of rows changed."""
+        async with self.session_factory() as db:
+            await lock_todo_list(db, owner_id)
+            todos = (
+                await db.execute(
+                    select(Todo).where(Todo.owner_id == owner_id).order_by(Todo.position, Todo.id)
+                )
+            ).scalars().all()
+            changed = 0
+            for todo, key in zip(todos, spread_keys(len(todos))):
+                if todo.position != key:
+                    todo.position = key
+                    changed += 1
+            await db.commit()
+        logger.info("Rebalanced %d todo positions of owner %s", changed, owner_id)
+        return changed
+
+
+rebalancer = Rebalancer()
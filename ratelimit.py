@@ -0,0 +1,295 @@
+"""Rate limiting for the auth endpoints.
+
+Two O(1) algorithms are available:
+
+- `SlidingWindowCounter` — counts in the current and previous fixed window and
+  weights the previous one by how much of it still overlaps the sliding
+  window. Two integers per key.
+- `TokenBucket` — `limit` tokens refilled evenly over `window` seconds, which
+  allows short bursts up to the bucket size.
+
+State lives in a backend: `MemoryBackend` (per-process, bounded, evicts idle
+and least recently used keys) or `RedisBackend` (shared by all workers; the
+algorithm runs atomically as a Lua script). Pick it with RATE_LIMIT_BACKEND
+("memory" or "redis"; Redis uses REDIS_URL).
+
+Apply a limiter to a route with the `RateLimit` dependency, keyed either by
+client IP or by a field of the JSON body (per-account limits).
+"""
+import hashlib
+import logging
+import math
+import os
+import time
+from collections import OrderedDict
+from typing import Optional
+
+from fastapi import HTTPException, Request
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_BACKEND = os.environ.get("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_MAX_KEYS = int(os.environ.get("RATE_LIMIT_MAX_KEYS", "100000"))
+REDIS_URL = os.environ.get("REDIS_URL", "redis://localhost:6379/0")
+
+
+class SlidingWindowCounter:
+    """Sliding-window counter. State: (window index, previous count, current count)."""
+
+    name = "sliding_window"
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+
+    def step(self, state: Optional[tuple], now: float) -> tuple[tuple, Optional[float]]:
+        """Register one hit. Returns (new state, retry_after or None if allowed)."""
+        current = int(now // self.window)
+        if state is None:
+            prev_count, count = 0, 0
+        else:
+            index, prev_count, count = state
+            if index != current:
+                prev_count = count if index == current - 1 else 0
+                count = 0
+        elapsed = now - current * self.window
+        weight = 1 - elapsed / self.window
+        if prev_count * weight + count >= self.limit:
+            if count >= self.limit or prev_count == 0:
+                retry = self.window - elapsed
+            else:
+                # time until the previous window's share drops enough for one hit
+                retry = self.window * (1 - (self.limit - count) / prev_count) - elapsed
+                retry = max(retry, 0.0)
+            return (current, prev_count, count), max(retry, 1.0)
+        return (current, prev_count, count + 1), None
+
+    def idle_ttl(self) -> float:
+        # after two windows the state no longer affects any decision
+        return 2 * self.window
+
+
+class TokenBucket:
+    """Token bucket with capacity `limit` refilled at limit/window per second."""
+
+    name = "token_bucket"
+
+    def __init__(self, limit: int, window: float):
+        self.limit = limit
+        self.window = window
+        self.rate = limit / window
+
+    def step(self, state: Optional[tuple], now: float) -> tuple[tuple, Optional[float]]:
+        if state is None:
+            tokens = float(self.limit)
+        else:
+            tokens, updated = state
+            tokens = min(float(self.limit), tokens + (now - updated) * self.rate)
+        if tokens < 1:
+            return (tokens, now), max((1 - tokens) / self.rate, 1.0)
+        return (tokens - 1, now), None
+
+    def idle_ttl(self) -> float:
+        # a full bucket is indistinguishable from a missing key
+        return self.window
+
+
+class MemoryBackend:
+    """Per-process state store with bounded memory.
+
+    Keys are kept in LRU order: each hit moves its key to the end, so idle
+    keys collect at the front and are dropped in O(1) per eviction. The
+    store never holds more than `max_keys` entries.
+    """
+
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # key -> (last hit time, idle ttl, state)
+        self._entries: OrderedDict[str, tuple[float, float, tuple]] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    async def hit(self, key: str, algorithm, now: float) -> Optional[float]:
+        entry = self._entries.pop(key, None)
+        state = entry[2] if entry is not None and now - entry[0] <= entry[1] else None
+        state, retry = algorithm.step(state, now)
+        self._entries[key] = (now, algorithm.idle_ttl(), state)
+        self._evict(now)
+        return retry
+
+    def _evict(self, now: float) -> None:
+        entries = self._entries
+        while len(entries) > self.max_keys:
+            entries.popitem(last=False)
+        while entries:
+            key, (last, ttl, _) = next(iter(entries.items()))
+            if now - last <= ttl:
+                break
+            del entries[key]
+
+
+_SLIDING_WINDOW_LUA = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local current = math.floor(now / window)
+local ckey = KEYS[1] .. ':' .. current
+local count = tonumber(redis.call('GET', ckey) or '0')
+local prev = tonumber(redis.call('GET', KEYS[1] .. ':' .. (current - 1)) or '0')
+local elapsed = now - current * window
+if prev * (1 - elapsed / window) + count >= limit then
+  local retry = window - elapsed
+  if count < limit and prev > 0 then
+    retry = math.max(window * (1 - (limit - count) / prev) - elapsed, 0)
+  end
+  return tostring(math.max(retry, 1))
+end
+redis.call('INCR', ckey)
+redis.call('EXPIRE', ckey, math.ceil(window * 2))
+return false
+"""
+
+_TOKEN_BUCKET_LUA = """
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+local rate = limit / window
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1])
+if tokens == nil then
+  tokens = limit
+else
+  tokens = math.min(limit, tokens + (now - tonumber(state[2])) * rate)
+end
+local retry = false
+if tokens < 1 then
+  retry = tostring(math.max((1 - tokens) / rate, 1))
+else
+  tokens = tokens - 1
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(window))
+return retry
+"""
+
+
+class RedisBackend:
+    """State in Redis, shared by all workers. Keys expire when idle.
+
+    Requires the `redis` package (redis.asyncio). If Redis is unreachable the
+    limiter fails open and logs the error: auth must keep working.
+    """
+
+    def __init__(self, url: str = REDIS_URL, prefix: str = "ratelimit"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as exc:  # pragma: no cover - depends on environment
+            raise RuntimeError("RATE_LIMIT_BACKEND=redis requires the 'redis' package") from exc
+        self._client = redis_asyncio.from_url(url)
+        self.prefix = prefix
+        self._scripts = {
+            SlidingWindowCounter.name: self._client.register_script(_SLIDING_WINDOW_LUA),
+            TokenBucket.name: self._client.register_script(_TOKEN_BUCKET_LUA),
+        }
+
+    async def hit(self, key: str, algorithm, now: float) -> Optional[float]:
+        script = self._scripts[algorithm.name]
+        try:
+            retry = await script(keys=[f"{self.prefix}:{key}"], args=[now, algorithm.window, algorithm.limit])
+        except Exception:
+            logger.exception("Rate limit backend error; allowing request")
+            return None
+        return float(retry) if retry else None
+
+
+_backend = None
+
+
+def get_backend():
+    """Return the process-wide backend selected by RATE_LIMIT_BACKEND."""
+    global _backend
+    if _backend is None:
+        _backend = RedisBackend() if RATE_LIMIT_BACKEND == "redis" else MemoryBackend()
+    return _backend
+
+
+class RateLimiter:
+    """A named limit: `limit` hits per `window` seconds per key."""
+
+    def __init__(self, name: str, limit: int, window: float, algorithm: str = "sliding_window", backend=None):
+        self.name = name
+        algo_cls = TokenBucket if algorithm == TokenBucket.name else SlidingWindowCounter
+        self.algorithm = algo_cls(limit, window)
+        self._backend = backend
+
+    @property
+    def backend(self):
+        return self._backend if self._backend is not None else get_backend()
+
+    async def hit(self, key: str, now: Optional[float] = None) -> Optional[float]:
+        """Count a hit for `key`; return seconds to wait if over the limit."""
+        if now is None:
+            now = time.time()
+        return await self.backend.hit(f"{self.name}:{key}", self.algorithm, now)
+
+
+def client_ip(request: Request) -> Optional[str]:
+    """Client address, honouring the first X-Forwarded-For hop."""
+    xff = request.headers.get("x-forwarded-for")
+    if xff:
+        return xff.split(",")[0].strip()
+    return request.client.host if request.client else None
+
+
+class RateLimit:
+    """FastAPI dependency applying `limiter` to a route.
+
+    By default the key is the client IP. With `body_field` the key is that
+    field of the JSON body (e.g. the login e-mail), which limits per account
+    regardless of how many addresses an attacker uses. The field is stripped,
+    and with `ignore_case` also lower-cased, so `Foo@x.com ` and `foo@x.com`
+    share one bucket.
+    """
+
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        *,
+        body_field: Optional[str] = None,
+        ignore_case: bool = False,
+        detail: str = "Too many requests",
+    ):
+        self.limiter = limiter
+        self.body_field = body_field
+        self.ignore_case = ignore_case
+        self.detail = detail
+
+    async def _key(self, request: Request) -> Optional[str]:
+        if self.body_field is None:
+            return client_ip(request)
+        try:
+            # FastAPI has already read the body, so this is served from cache
+            body = await request.json()
+        except Exception:
+            return None
+        value = body.get(self.body_field) if isinstance(body, dict) else None
+        value = str(value).strip() if value is not None else ""
+        if not value:
+            return None
+        if self.ignore_case:
+            value = value.lower()
+        # hashed: keeps keys short and never stores raw secrets (refresh tokens)
+        return hashlib.sha256(value.encode()).hexdigest()[:32]
+
+    async def __call__(self, request: Request) -> None:
+        key = await self._key(request)
+        if not key:
+            return
+        retry = await self.limiter.hit(key)
+        if retry is not None:
+            raise HTTPException(
+                status_code=429,
+                detail=self.detail,
+                headers={"Retry-After": str(math.ceil(retry))},
+            )
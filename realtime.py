@@ -0,0 +1,330 @@
+"""Realtime todo change feed (SSE / WebSocket).
+
+Routes publish an event after every committed todo change
+(`feed.publish([todo_event(...)])`). Recipients are the owners in the event
+(`owner_ids`, which for todos of a shared list include its members) and all
+admins. Events reach subscribers through:
+
+- `ChangeHub` — in-process fan-out. Subscribers are indexed by user id (plus
+  a set of admins who see everything), so publishing costs O(interested
+  subscribers) no matter how many idle connections a worker holds.
+- `PgNotifyBridge` — with Postgres, every event is also sent with NOTIFY on
+  REALTIME_CHANNEL and re-published by the other workers' listeners, so a
+  client sees changes made through any worker.
+
+Each subscription has a bounded buffer (REALTIME_BUFFER events). A client
+that cannot keep up does not grow memory: its buffer is dropped and replaced
+by a single `resync` event, after which the client should refetch its list.
+"""
+import asyncio
+import itertools
+import json
+import logging
+import os
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Iterable, Optional
+
+from sqlalchemy.engine import make_url
+
+logger = logging.getLogger(__name__)
+
+REALTIME_BUFFER = int(os.environ.get("REALTIME_BUFFER", "100"))
+REALTIME_HEARTBEAT = float(os.environ.get("REALTIME_HEARTBEAT", "15"))
+REALTIME_CHANNEL = os.environ.get("REALTIME_CHANNEL", "todo_changes")
+REALTIME_PG_NOTIFY = os.environ.get("REALTIME_PG_NOTIFY", "true").lower() in ("1", "true", "yes")
+# Events waiting to be NOTIFYed; reconnect backoff bounds in seconds
+REALTIME_NOTIFY_QUEUE = int(os.environ.get("REALTIME_NOTIFY_QUEUE", "10000"))
+REALTIME_RECONNECT_MIN = float(os.environ.get("REALTIME_RECONNECT_MIN", "0.5"))
+REALTIME_RECONNECT_MAX = float(os.environ.get("REALTIME_RECONNECT_MAX", "30"))
+# NOTIFY payloads are limited to 8000 bytes; larger events go out without the todo body
+_NOTIFY_MAX_BYTES = 7900
+
+RESYNC = "resync"
+_STOP = object()
+
+# set by `ChangeFeed.hold()`: events published in this context are collected here
+_held_events: ContextVar[Optional[list]] = ContextVar("realtime_held_events", default=None)
+
+
+class Subscription:
+    """One connected client: a bounded queue of events."""
+
+    __slots__ = ("user_id", "is_admin", "_queue", "closed")
+
+    def __init__(self, user_id: int, is_admin: bool, maxsize: int = REALTIME_BUFFER):
+        self.user_id = user_id
+        self.is_admin = is_admin
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def offer(self, event: dict) -> None:
+        """Non-blocking enqueue; on overflow collapse the buffer into `resync`."""
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+            self._queue.put_nowait({"type": RESYNC, "seq": event.get("seq")})
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[dict]:
+        """Next event, or None after `timeout` seconds / when the hub shuts down."""
+        try:
+            event = await asyncio.wait_for(self._queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return event
+
+    def close(self) -> None:
+        self.closed = True
+        try:
+            self._queue.put_nowait(None)
+        except asyncio.QueueFull:
+            self._queue.get_nowait()
+            self._queue.put_nowait(None)
+
+
+class ChangeHub:
+    """In-process publish/subscribe for todo events."""
+
+    def __init__(self):
+        self._by_user: dict[int, set[Subscription]] = {}
+        self._admins: set[Subscription] = set()
+        self._seq = itertools.count(1)
+        # called with every delivered event (e.g. coalesce.py)
+        self._listeners: list[Callable[[dict], None]] = []
+
+    def __len__(self) -> int:
+        return sum(len(s) for s in self._by_user.values())
+
+    def subscribe(self, user_id: int, is_admin: bool = False) -> Subscription:
+        sub = Subscription(user_id, is_admin)
+        self._by_user.setdefault(user_id, set()).add(sub)
+        if is_admin:
+            self._admins.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self._by_user.get(sub.user_id)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._by_user[sub.user_id]
+        self._admins.discard(sub)
+
+    def add_listener(self, callback: Callable[[dict], None]) -> None:
+        """Call `callback(event)` for every event, whoever subscribed."""
+        self._listeners.append(callback)
+
+    def deliver(self, event: dict) -> None:
+        """Hand `event` to every subscriber allowed to see it."""
+        event = {**event, "seq": next(self._seq)}
+        for callback in self._listeners:
+            callback(event)
+        targets: set[Subscription] = set(self._admins)
+        for uid in event.get("owner_ids", ()):
+            targets.update(self._by_user.get(uid, ()))
+        for sub in targets:
+            sub.offer(event)
+
+    def close_all(self) -> None:
+        for subs in self._by_user.values():
+            for sub in subs:
+                sub.close()
+        self._by_user.clear()
+        self._admins.clear()
+
+
+class PgNotifyBridge:
+    """Cross-worker fan-out over Postgres LISTEN/NOTIFY (asyncpg).
+
+    Events published locally are delivered to the local hub right away and
+    also NOTIFYed with this worker's id; listeners ignore their own events.
+    One connection both listens and sends, and asyncpg runs one operation
+    at a time on it, so `send` only queues the event and a single task sends
+    the NOTIFYs in order. When the connection breaks, that task reconnects
+    (and LISTENs again) with exponential backoff up to REALTIME_RECONNECT_MAX
+    seconds and retries the event. At most REALTIME_NOTIFY_QUEUE events wait;
+    beyond that they are dropped (`dropped`) and only local clients see them.
+    """
+
+    def __init__(
+        self,
+        hub: ChangeHub,
+        dsn: str,
+        channel: str = REALTIME_CHANNEL,
+        connect: Optional[Callable[[], Awaitable]] = None,
+        min_delay: float = REALTIME_RECONNECT_MIN,
+        max_delay: float = REALTIME_RECONNECT_MAX,
+    ):
+        self.hub = hub
+        self.dsn = dsn
+        self.channel = channel
+        self.origin = uuid.uuid4().hex
+        self.min_delay = min_delay
+        self.max_delay = max_delay
+        self.dropped = 0
+        self._connect = connect
+        self._conn = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=REALTIME_NOTIFY_QUEUE)
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        """Connect and LISTEN, then start the sending task; raises if Postgres is unreachable."""
+        await self._open()
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="realtime-notify")
+
+    async def stop(self) -> None:
+        """Send what is queued (for a few seconds at most) and disconnect."""
+        if self._task is not None:
+            self._queue.put_nowait(_STOP)
+            try:
+                await asyncio.wait_for(self._task, 5)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
+            self._task = None
+        await self._close()
+
+    async def _open(self) -> None:
+        if self._connect is not None:
+            conn = await self._connect()
+        else:
+            import asyncpg
+
+            conn = await asyncpg.connect(self.dsn)
+        await conn.add_listener(self.channel, self._on_notify)
+        self._conn = conn
+
+    async def _close(self) -> None:
+        conn, self._conn = self._conn, None
+        if conn is not None and not conn.is_closed():
+            try:
+                await conn.close()
+            except Exception:
+                logger.debug("Closing the NOTIFY connection failed", exc_info=True)
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        if message.get("origin") != self.origin:
+            self.hub.deliver(message["event"])
+
+    def _payload(self, event: dict) -> str:
+        payload = json.dumps({"origin": self.origin, "event": event}, default=str)
+        if len(payload.encode()) > _NOTIFY_MAX_BYTES:
+            slim = {k: v for k, v in event.items() if k != "todo"}
+            payload = json.dumps({"origin": self.origin, "event": slim}, default=str)
+        return payload
+
+    def send(self, event: dict) -> None:
+        """Queue `event` for NOTIFY (non-blocking)."""
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("NOTIFY queue full; todo change not sent to other workers")
+
+    async def _run(self) -> None:
+        event, delay = None, 0.0
+        while True:
+            if event is None:
+                try:
+                    # wake up now and then to notice a dropped LISTEN connection
+                    event = await asyncio.wait_for(self._queue.get(), REALTIME_HEARTBEAT)
+                except asyncio.TimeoutError:
+                    pass
+                if event is _STOP:
+                    return
+            try:
+                if self._conn is None or self._conn.is_closed():
+                    await self._close()
+                    await self._open()
+                    logger.info("LISTEN/NOTIFY connection (re)established")
+                if event is not None:
+                    await self._conn.execute("SELECT pg_notify($1, $2)", self.channel, self._payload(event))
+                    event = None
+                delay = 0.0
+            except Exception:
+                if self._conn is not None and not self._conn.is_closed():
+                    # the connection is fine: this event cannot be sent
+                    logger.exception("Failed to NOTIFY todo change")
+                    event = None
+                    continue
+                delay = min(max(delay * 2, self.min_delay), self.max_delay)
+                logger.warning("LISTEN/NOTIFY connection lost; reconnecting in %.1fs", delay, exc_info=True)
+                await self._close()
+                await asyncio.sleep(delay)
+
+
+class ChangeFeed:
+    """Facade used by routes and `main.lifespan`."""
+
+    def __init__(self, hub: Optional[ChangeHub] = None):
+        self.hub = hub or ChangeHub()
+        self.bridge: Optional[PgNotifyBridge] = None
+
+    async def start(self, database_url: str) -> None:
+        url = make_url(database_url)
+        if not REALTIME_PG_NOTIFY or url.get_backend_name() != "postgresql":
+            return
+        dsn = url.set(drivername="postgresql").render_as_string(hide_password=False)
+        bridge = PgNotifyBridge(self.hub, dsn)
+        try:
+            await bridge.start()
+        except Exception:
+            logger.exception("LISTEN/NOTIFY unavailable; change feed is per-worker only")
+            return
+        self.bridge = bridge
+
+    async def stop(self) -> None:
+        self.hub.close_all()
+        if self.bridge is not None:
+            await self.bridge.stop()
+            self.bridge = None
+
+    @contextmanager
+    def hold(self):
+        """Collect events published inside the block instead of delivering them.
+
+        For code that commits once at the end (e.g. atomic `/batch`): the
+        caller passes the yielded list to `publish` after the commit, or
+        drops it on rollback.
+        """
+        held: list = []
+        token = _held_events.set(held)
+        try:
+            yield held
+        finally:
+            _held_events.reset(token)
+
+    def publish(self, events: Iterable[dict]) -> None:
+        """Deliver committed events locally and (in background) to other workers."""
+        held = _held_events.get()
+        if held is not None:
+            held.extend(events)
+            return
+        for event in events:
+            self.hub.deliver(event)
+            if self.bridge is not None:
+                self.bridge.send(event)
+
+
+feed = ChangeFeed()
+
+
+def todo_event(kind: str, todo, owner_ids: Iterable[int] = (), data: Optional[dict] = None) -> dict:
+    """Build an event for `todo`; `owner_ids` adds extra recipients (e.g. previous owner).
+
+    Members of the todo's shared list are added by `sharing.with_list_members`
+    before publishing.
+    """
+    owners = sorted({todo.owner_id, *owner_ids})
+    return {"type": kind, "todo_id": todo.id, "owner_ids": owners, "list_id": todo.list_id, "todo": data}
+
+
+def format_sse(event: dict) -> str:
+    """Serialize an event as a Server-Sent Events frame."""
+    return f"id: {event.get('seq', '')}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
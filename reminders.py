@@ -0,0 +1,239 @@
+"""In-process scheduler for todo reminders (`Todo.remind_at`).
+
+`ReminderScheduler` runs as a task started from `main.lifespan`. It never
+scans `todos`: it loads only the reminders due within the next
+REMINDER_WINDOW seconds (at most REMINDER_BATCH of them) from the partial
+index ix_todos_pending_reminders into a heap, sleeps until the earliest
+one, and reloads when the loaded window ends.
+
+Routes call `rearm(todo_id, remind_at)` after committing a change to a
+reminder (new, moved or cleared, todo completed, reopened or deleted). A
+reminder inside the loaded window goes into the heap right away; stale heap
+entries are skipped lazily. Anything else is picked up by the next reload.
+Code that commits once at the end (atomic `/batch`) wraps its work in
+`hold()` and calls `replay()` only after the commit, so a rolled-back
+change never disarms a committed reminder.
+Firing re-checks the row in the same transaction (`FOR UPDATE SKIP LOCKED`
+on Postgres), so a stale entry or a second worker cannot send a reminder twice.
+
+Due reminders are handed to a notifier, which runs inside that transaction,
+and then `remind_at` is cleared. The default notifier, `EmailNotifier`,
+writes to the e-mail outbox. REMINDER_NOTIFIER=log only logs.
+"""
+import asyncio
+import heapq
+import logging
+import os
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta, timezone
+from typing import Iterable, Optional
+
+from sqlalchemy import false, select
+
+import emailer
+from db import AsyncSessionLocal
+from models import Todo, User
+from outbox import dispatcher as outbox_dispatcher
+
+logger = logging.getLogger(__name__)
+
+REMINDER_WINDOW = float(os.environ.get("REMINDER_WINDOW", "300"))
+REMINDER_BATCH = int(os.environ.get("REMINDER_BATCH", "1000"))
+REMINDER_NOTIFIER = os.environ.get("REMINDER_NOTIFIER", "email").lower()
+
+# set by `ReminderScheduler.hold()`: rearms made in this context are collected here
+_held_rearms: ContextVar[Optional[list]] = ContextVar("reminder_held_rearms", default=None)
+
+
+class EmailNotifier:
+    """Adds one reminder e-mail per todo to the outbox."""
+
+    async def notify(self, db, reminders: list[dict]) -> None:
+        from crud import enqueue_email
+
+        for r in reminders:
+            enqueue_email(db, r["email"], emailer.REMINDER, emailer.reminder_payload(r))
+
+    def after_commit(self) -> None:
+        outbox_dispatcher.notify()
+
+
+class LogNotifier:
+    """Only logs reminders (development)."""
+
+    async def notify(self, db, reminders: list[dict]) -> None:
+        for r in reminders:
+            logger.info("Reminder for todo %s (%s)", r["todo_id"], r["email"])
+
+    def after_commit(self) -> None:
+        return None
+
+
+def get_notifier():
+    """Notifier selected by REMINDER_NOTIFIER."""
+    if REMINDER_NOTIFIER == "log":
+        return LogNotifier()
+    return EmailNotifier()
+
+
+class ReminderScheduler:
+    def __init__(
+        self,
+        session_factory=AsyncSessionLocal,
+        notifier=None,
+        window: float = REMINDER_WINDOW,
+        batch_size: int = REMINDER_BATCH,
+    ):
+        self.session_factory = session_factory
+        self.notifier = notifier if notifier is not None else get_notifier()
+        self.window = window
+        self.batch_size = batch_size
+        # (remind_at, todo_id); an entry is live only while _armed agrees with it
+        self._heap: list[tuple[datetime, int]] = []
+        self._armed: dict[int, datetime] = {}
+        # every pending reminder at or before this time is in the heap
+        self._horizon: Optional[datetime] = None
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is not None and not self._task.done():
+            return
+        self._wake = asyncio.Event()
+        self._horizon = None
+        self._task = asyncio.get_running_loop().create_task(self._run(), name="todo-reminders")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+
+    @contextmanager
+    def hold(self):
+        """Collect rearms made inside the block; see `realtime.ChangeFeed.hold`."""
+        held: list = []
+        token = _held_rearms.set(held)
+        try:
+            yield held
+        finally:
+            _held_rearms.reset(token)
+
+    def replay(self, held: Iterable[tuple[int, Optional[datetime]]]) -> None:
+        """Apply rearms collected by `hold()` once their changes are committed."""
+        for todo_id, remind_at in held:
+            self.rearm(todo_id, remind_at)
+
+    def rearm(self, todo_id: int, remind_at: Optional[datetime]) -> None:
+        """Reminder of `todo_id` is now `remind_at` (None: no pending reminder)."""
+        held = _held_rearms.get()
+        if held is not None:
+            held.append((todo_id, remind_at))
+            return
+        if self._horizon is None:
+            return
+        if remind_at is None or remind_at > self._horizon:
+            # left for the reload; any heap entry for it becomes stale
+            self._armed.pop(todo_id, None)
+            return
+        self._arm(todo_id, remind_at)
+        self._wake.set()
+
+    def _arm(self, todo_id: int, remind_at: datetime) -> None:
+        if self._armed.get(todo_id) != remind_at:
+            self._armed[todo_id] = remind_at
+            heapq.heappush(self._heap, (remind_at, todo_id))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                delay = await self.run_once()
+            except Exception:
+                logger.exception("Reminder scheduler round failed")
+                delay = min(self.window, 5.0)
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+
+    async def run_once(self) -> float:
+        """Reload if needed, fire due reminders; returns seconds until the next round."""
+        now = datetime.now(timezone.utc)
+        if self._horizon is None or now >= self._horizon:
+            await self._load(now)
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            remind_at, todo_id = heapq.heappop(self._heap)
+            if self._armed.get(todo_id) == remind_at:
+                del self._armed[todo_id]
+                due.append(todo_id)
+        if due:
+            await self.fire(due, now)
+        while self._heap and self._armed.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+        wake_at = min(self._heap[0][0], self._horizon) if self._heap else self._horizon
+        return max((wake_at - datetime.now(timezone.utc)).total_seconds(), 0.0)
+
+    async def _load(self, now: datetime) -> None:
+        until = now + timedelta(seconds=self.window)
+        async with self.session_factory() as db:
+            rows = (
+                await db.execute(
+                    select(Todo.id, Todo.remind_at)
+                    .where(Todo.remind_at.isnot(None), Todo.is_done == false(), Todo.remind_at <= until)
+                    .order_by(Todo.remind_at, Todo.id)
+                    .limit(self.batch_size)
+                )
+            ).all()
+        self._heap, self._armed = [], {}
+        for todo_id, remind_at in rows:
+            self._arm(todo_id, remind_at)
+        # a full batch covers only up to its last reminder; load again there
+        self._horizon = rows[-1][1] if len(rows) >= self.batch_size else until
+
+    async def fire(self, todo_ids: list[int], now: datetime) -> int:
+        """Notify and clear the reminders of `todo_ids` that are still due."""
+        async with self.session_factory() as db:
+            rows = (
+                await db.execute(
+                    select(Todo, User.email)
+                    .join(User, User.id == Todo.owner_id)
+                    .where(
+                        Todo.id.in_(todo_ids),
+                        Todo.remind_at.isnot(None),
+                        Todo.is_done == false(),
+                        Todo.remind_at <= now,
+                    )
+                    .with_for_update(skip_locked=True, of=Todo)
+                )
+            ).all()
+            if not rows:
+                await db.rollback()
+                return 0
+            reminders = [
+                {
+                    "todo_id": todo.id,
+                    "owner_id": todo.owner_id,
+                    "email": email,
+                    "title": todo.title,
+                    "due_at": todo.due_at,
+                    "remind_at": todo.remind_at,
+                }
+                for todo, email in rows
+            ]
+            await self.notifier.notify(db, reminders)
+            for todo, _ in rows:
+                todo.remind_at = None
+            await db.commit()
+        self.notifier.after_commit()
+        logger.info("Sent %d todo reminders", len(reminders))
+        return len(reminders)
+
+
+scheduler = ReminderScheduler()
@@ -1,19 +1,24 @@
-from fastapi import APIRouter, Depends, HTTPException, Security, Request
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Security, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
 import os
-import time
+import re
 import logging
 from typing import List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import datetime, timezone, timedelta
 
-from sqlalchemy import text, select, asc, desc
+from sqlalchemy import text, select, asc, desc, literal, tuple_
 
 from auth import (
     get_current_user,
+    principal_from_token,
     create_access_token,
-    get_password_hash,
-    verify_password,
+    get_password_hash_async,
+    verify_password_async,
     generate_raw_refresh_token,
+    refresh_token_month,
     hash_refresh_token,
     REFRESH_EXPIRE_DAYS,
     pwd_context,
@@ -22,22 +27,43 @@ from passlib.exc import UnknownHashError
 
 from crud import (
     get_todo_by_id,
+    get_archived_todo,
+    todo_changes as crud_todo_changes,
+    neighbour_position,
     create_todo as crud_create_todo,
     get_user_by_email,
     create_user as crud_create_user,
     get_user_by_id,
+    enqueue_email,
     create_refresh_token as crud_create_refresh_token,
     get_refresh_token_by_hash as crud_get_refresh_token_by_hash,
+    get_user_agent_id as crud_get_user_agent_id,
+    prune_user_agents as crud_prune_user_agents,
+    forget_user_agents as crud_forget_user_agents,
     revoke_refresh_token as crud_revoke_refresh_token,
     list_refresh_tokens_for_user as crud_list_refresh_tokens_for_user,
     revoke_all_refresh_tokens_for_user as crud_revoke_all_refresh_tokens_for_user,
     revoke_refresh_tokens_for_user_device_type as crud_revoke_refresh_tokens_for_user_device_type,
 )
 
-from models import Todo, User, RefreshToken
+from models import AuditEvent, ListMember, Tag, Todo, TodoArchive, TodoList, User, RefreshToken, UTCDateTime
 from schemas import (
     TodoCreate,
     TodoRead,
+    TodoChanges,
+    TodoMove,
+    TodoTree,
+    TodoStatsRead,
+    TodoListCreate,
+    TodoListRead,
+    ListMemberRead,
+    ListMemberUpdate,
+    TagCount,
+    BatchRequest,
+    AuditEventRead,
+    BatchResponse,
+    BatchResult,
+    BatchOperation,
     TodoUpdate,
     RefreshRequest,
     TokenResponse,
@@ -45,33 +71,93 @@ from schemas import (
     DeviceType,
     UserCreate,
     UserRead,
+    MeRead,
     PasswordChange,
     PasswordResetRequest,
 )
 
-from db import get_db
-from emailer import generate_token, send_verification
+from db import get_db, AsyncSessionLocal, deferred_commit, has_uncommitted_writes
+from emailer import generate_token, verification_payload, VERIFICATION
+from outbox import dispatcher as outbox_dispatcher
+from ratelimit import RateLimit, RateLimiter
+from metrics import snapshot as metrics_snapshot
+from loadshed import shedder as load_shedder
+from realtime import feed as change_feed, todo_event, format_sse, REALTIME_HEARTBEAT
+from wire import NegotiatedResponse, negotiate_format
+from idempotency import idempotent
+from activity import tracker as activity_tracker
+from positions import key_between, rebalancer, POSITION_REBALANCE_LENGTH
+from todo_sync import lock_todo_list
+from tags import normalize_tags, resolve_tags, tag_filter
+from subtasks import child_path, delete_subtree, set_parent, subtree
+from todo_stats import read_stats
+from sharing import OWNER, READ, WRITE, forget_list, get_list, has_role, lists_of, visible, with_list_members, writable
+from reminders import scheduler as reminder_scheduler
+from audit import audit_log
+from analytics import cache as analytics_cache
+from guardrails import check_sort, clamp_limit
+from coalesce import todo_reads
 # ...existing code...
 
 
 # Split endpoints into multiple routers so OpenAPI groups appear with meaningful tags
 # This keeps existing paths intact but organizes docs: Auth, Users, Todos, Sessions
 auth_router = APIRouter(tags=["Auth"])
-users_router = APIRouter(tags=["Users"])
-todos_router = APIRouter(tags=["Todos"])
-sessions_router = APIRouter(tags=["Sessions"])
+# Todos, Users and Sessions also speak MessagePack/CBOR (see wire.py)
+_negotiated = {"dependencies": [Depends(negotiate_format)], "default_response_class": NegotiatedResponse}
+users_router = APIRouter(tags=["Users"], **_negotiated)
+todos_router = APIRouter(tags=["Todos"], **_negotiated)
+sessions_router = APIRouter(tags=["Sessions"], **_negotiated)
 admin_router = APIRouter(tags=["Admin"])
 
 # Combined router exported to main.py (keeps main.py include_router call working)
 router = APIRouter()
+# Route groups with their own concurrency limits (see loadshed.py)
+route_groups = (auth_router, users_router, todos_router, sessions_router, admin_router)
 
 
-# Simple in-memory rate limiter for registration (per-IP timestamps).
-# Defaults are permissive for development/testing; override via env in prod.
+# Rate limits for the auth endpoints (see ratelimit.py). Defaults are
+# permissive for development/testing; override via env in prod. The backend
+# (per-process memory or shared Redis) is chosen with RATE_LIMIT_BACKEND.
 REG_RATE_LIMIT_WINDOW = int(os.environ.get("REG_RATE_LIMIT_WINDOW", str(60 * 60)))  # seconds (default 1 hour)
 REG_MAX_PER_IP = int(os.environ.get("REG_MAX_PER_IP", "100"))  # default 100 per window for dev
-# In-memory store: { ip: [timestamp, ...] }
-_registration_attempts: dict[str, list[float]] = {}
+REG_MAX_PER_EMAIL = int(os.environ.get("REG_MAX_PER_EMAIL", "5"))
+LOGIN_RATE_LIMIT_WINDOW = int(os.environ.get("LOGIN_RATE_LIMIT_WINDOW", "60"))
+LOGIN_MAX_PER_IP = int(os.environ.get("LOGIN_MAX_PER_IP", "100"))
+LOGIN_MAX_PER_ACCOUNT = int(os.environ.get("LOGIN_MAX_PER_ACCOUNT", "20"))
+REFRESH_RATE_LIMIT_WINDOW = int(os.environ.get("REFRESH_RATE_LIMIT_WINDOW", "60"))
+REFRESH_MAX_PER_IP = int(os.environ.get("REFRESH_MAX_PER_IP", "100"))
+REFRESH_MAX_PER_TOKEN = int(os.environ.get("REFRESH_MAX_PER_TOKEN", "10"))
+
+register_ip_limit = RateLimit(
+    RateLimiter("register:ip", REG_MAX_PER_IP, REG_RATE_LIMIT_WINDOW),
+    detail="Too many registration attempts from your IP",
+)
+register_account_limit = RateLimit(
+    RateLimiter("register:email", REG_MAX_PER_EMAIL, REG_RATE_LIMIT_WINDOW),
+    body_field="email",
+    ignore_case=True,
+    detail="Too many registration attempts for this email",
+)
+login_ip_limit = RateLimit(
+    RateLimiter("login:ip", LOGIN_MAX_PER_IP, LOGIN_RATE_LIMIT_WINDOW),
+    detail="Too many login attempts from your IP",
+)
+login_account_limit = RateLimit(
+    RateLimiter("login:account", LOGIN_MAX_PER_ACCOUNT, LOGIN_RATE_LIMIT_WINDOW, algorithm="token_bucket"),
+    body_field="username",
+    ignore_case=True,
+    detail="Too many login attempts for this account",
+)
+refresh_ip_limit = RateLimit(
+    RateLimiter("refresh:ip", REFRESH_MAX_PER_IP, REFRESH_RATE_LIMIT_WINDOW),
+    detail="Too many refresh attempts from your IP",
+)
+refresh_token_limit = RateLimit(
+    RateLimiter("refresh:token", REFRESH_MAX_PER_TOKEN, REFRESH_RATE_LIMIT_WINDOW, algorithm="token_bucket"),
+    body_field="refresh_token",
+    detail="Too many refresh attempts for this session",
+)
 
 # Small denylist of disposable email domains; expand as needed or load from file
 DISPOSABLE_DOMAINS = set([
@@ -86,14 +172,25 @@ DISPOSABLE_DOMAINS = set([
 REQUIRE_CAPTCHA = os.environ.get("REQUIRE_CAPTCHA", "false").lower() in ("1", "true", "yes")
 
 
-@auth_router.post("/token", response_model=TokenResponse)
+@auth_router.post(
+    "/token",
+    response_model=TokenResponse,
+    dependencies=[Depends(login_ip_limit), Depends(login_account_limit)],
+)
 async def login_json(payload: LoginRequest, request: Request, db: AsyncSession = Depends(get_db)):
-    """Аутентификация: возвращает access и refresh токены."""
+    """Аутентификация: возвращает access и refresh токены.
+
+    Работает короткими фазами: чтение пользователя, проверка Argon2 без
+    соединения из пула (в пуле потоков), затем короткая транзакция записи.
+    """
     user = await get_user_by_email(db, payload.username)
+    # end the read transaction so the pooled connection is returned while
+    # Argon2 runs (expire_on_commit=False keeps `user` loaded)
+    await db.commit()
     if not user:
         raise HTTPException(status_code=400, detail="Incorrect username or password")
     try:
-        ok = verify_password(payload.password, user.hashed_password)
+        ok = await verify_password_async(payload.password, user.hashed_password)
     except UnknownHashError:
         ok = False
     if not ok:
@@ -101,17 +198,16 @@ async def login_json(payload: LoginRequest, request: Request, db: AsyncSession =
     # Если хэш устарел (needs_update) — обновим на argon2
     try:
         if pwd_context.needs_update(user.hashed_password):
-            user.hashed_password = get_password_hash(payload.password)
+            user.hashed_password = await get_password_hash_async(payload.password)
             db.add(user)
             await db.commit()
-            await db.refresh(user)
     except Exception:
         # Не критично: если апдейт не прошёл — продолжаем работу (аутентификация успешна)
-        pass
-    token = create_access_token(user.email, user.scopes or [])
-    raw_refresh = generate_raw_refresh_token()
+        await db.rollback()
+    issued_at = datetime.now(timezone.utc)
+    raw_refresh = generate_raw_refresh_token(issued_at)
     token_hash = hash_refresh_token(raw_refresh)
-    expires_at = datetime.now(timezone.utc) + timedelta(days=REFRESH_EXPIRE_DAYS)
+    expires_at = issued_at + timedelta(days=REFRESH_EXPIRE_DAYS)
     # validate/normalize device_type
     device_type = None
     if payload.device_type:
@@ -122,7 +218,7 @@ async def login_json(payload: LoginRequest, request: Request, db: AsyncSession =
         await crud_revoke_refresh_tokens_for_user_device_type(db, user.id, device_type)
     # capture device_id (from payload) and client metadata
     device_id = payload.device_id
-    user_agent = request.headers.get("user-agent")
+    user_agent_id = await crud_get_user_agent_id(db, request.headers.get("user-agent"))
     xff = request.headers.get("x-forwarded-for")
     ip_addr = None
     if xff:
@@ -134,26 +230,31 @@ async def login_json(payload: LoginRequest, request: Request, db: AsyncSession =
     rt = RefreshToken(
         user_id=user.id,
         token_hash=token_hash,
-        issued_at=datetime.now(timezone.utc),
+        issued_at=issued_at,
         expires_at=expires_at,
         device_type=device_type,
         device_id=device_id,
-        user_agent=user_agent,
+        user_agent_id=user_agent_id,
         ip_address=ip_addr,
     )
     await crud_create_refresh_token(db, rt)
+    audit_log.record("session.login", user.id, "session", rt.id, {"device_type": device_type}, ip_addr)
+    token = create_access_token(user.email, user.scopes or [], rt.id)
     return {"access_token": token, "token_type": "bearer", "refresh_token": raw_refresh}
 
 
-@auth_router.post("/token/refresh", response_model=TokenResponse)
+@auth_router.post(
+    "/token/refresh",
+    response_model=TokenResponse,
+    dependencies=[Depends(refresh_ip_limit), Depends(refresh_token_limit)],
+)
 async def refresh_token(payload: RefreshRequest, request: Request, db: AsyncSession = Depends(get_db)):
     """Обновить access token по refresh token."""
-    # (no per-IP rate limiting here; keep refresh focused)
     raw = payload.refresh_token
     if not raw:
         raise HTTPException(status_code=400, detail="refresh_token required")
     token_hash = hash_refresh_token(raw)
-    rt = await crud_get_refresh_token_by_hash(db, token_hash)
+    rt = await crud_get_refresh_token_by_hash(db, token_hash, refresh_token_month(raw))
     if not rt or rt.revoked:
         # If token revoked and replaced_by_id present, it's likely reuse (theft). Keep current behavior
         # and return Invalid. Clients should replace their stored token after successful refresh.
@@ -168,9 +269,10 @@ async def refresh_token(payload: RefreshRequest, request: Request, db: AsyncSess
     if expires_at < datetime.now(timezone.utc):
         raise HTTPException(status_code=401, detail="Refresh token expired")
     # Rotation: создаём новый refresh token, помечаем старый revoked и связываем
-    new_raw = generate_raw_refresh_token()
+    new_issued_at = datetime.now(timezone.utc)
+    new_raw = generate_raw_refresh_token(new_issued_at)
     new_hash = hash_refresh_token(new_raw)
-    new_expires = datetime.now(timezone.utc) + timedelta(days=REFRESH_EXPIRE_DAYS)
+    new_expires = new_issued_at + timedelta(days=REFRESH_EXPIRE_DAYS)
     from models import RefreshToken
 
     # Use device metadata from the stored refresh token. The client does not
@@ -181,7 +283,7 @@ async def refresh_token(payload: RefreshRequest, request: Request, db: AsyncSess
         await crud_revoke_refresh_tokens_for_user_device_type(db, rt.user_id, device_type)
     # reuse stored device_id
     device_id = rt.device_id
-    user_agent = request.headers.get("user-agent")
+    user_agent_id = await crud_get_user_agent_id(db, request.headers.get("user-agent"))
     xff = request.headers.get("x-forwarded-for")
     ip_addr = None
     if xff:
@@ -192,11 +294,11 @@ async def refresh_token(payload: RefreshRequest, request: Request, db: AsyncSess
     new_rt = RefreshToken(
         user_id=rt.user_id,
         token_hash=new_hash,
-        issued_at=datetime.now(timezone.utc),
+        issued_at=new_issued_at,
         expires_at=new_expires,
         device_type=device_type,
         device_id=device_id,
-        user_agent=user_agent,
+        user_agent_id=user_agent_id,
         ip_address=ip_addr,
     )
     await crud_create_refresh_token(db, new_rt)
@@ -206,6 +308,7 @@ async def refresh_token(payload: RefreshRequest, request: Request, db: AsyncSess
     rt.last_used_at = datetime.now(timezone.utc)
     db.add(rt)
     await db.commit()
+    audit_log.record("session.refreshed", rt.user_id, "session", new_rt.id, {"replaces": rt.id}, ip_addr)
     # issue new access
     # Получаем пользователя по id и генерируем новый access
     from crud import get_user_by_id
@@ -213,7 +316,7 @@ async def refresh_token(payload: RefreshRequest, request: Request, db: AsyncSess
     user_obj = await get_user_by_id(db, rt.user_id)
     if not user_obj:
         raise HTTPException(status_code=400, detail="User not found")
-    access = create_access_token(user_obj.email, user_obj.scopes or [])
+    access = create_access_token(user_obj.email, user_obj.scopes or [], new_rt.id)
     return {"access_token": access, "token_type": "bearer", "refresh_token": new_raw}
 
 
@@ -236,7 +339,7 @@ async def revoke_refresh(
     raw = body.get("refresh_token")
     if raw:
         token_hash = hash_refresh_token(raw)
-        rt = await crud_get_refresh_token_by_hash(db, token_hash)
+        rt = await crud_get_refresh_token_by_hash(db, token_hash, refresh_token_month(raw))
         if not rt:
             raise HTTPException(status_code=404, detail="Not found")
         if rt.user_id != int(current_user["id"]) and "admin" not in (
@@ -244,9 +347,11 @@ async def revoke_refresh(
         ):
             raise HTTPException(status_code=403, detail="Not authorized")
         await crud_revoke_refresh_token(db, rt)
+        _audit("session.revoked", current_user, "session", rt.id)
         return {"ok": True}
     # если не указан refresh_token — ревок всех токенов текущего пользователя
     await crud_revoke_all_refresh_tokens_for_user(db, int(current_user["id"]))
+    _audit("session.revoked_all", current_user, "user", int(current_user["id"]))
     return {"ok": True}
 
 
@@ -258,7 +363,16 @@ async def list_sessions(
     if "admin" in (current_user.get("scopes") or []):
         # показать все сессии
         q = await db.execute(
-            text("select id, user_id, issued_at, expires_at, revoked, device_id from refresh_tokens")
+            select(
+                RefreshToken.id,
+                RefreshToken.user_id,
+                RefreshToken.issued_at,
+                RefreshToken.expires_at,
+                RefreshToken.revoked,
+                RefreshToken.device_id,
+                RefreshToken.last_used_at,
+                RefreshToken.ip_address,
+            )
         )
         return [
             dict(
@@ -268,6 +382,7 @@ async def list_sessions(
                 expires_at=r[3].isoformat() if r[3] else None,
                 revoked=bool(r[4]),
                 device_id=r[5],
+                **_session_activity(r[0], r[6], r[7]),
             )
             for r in q.fetchall()
         ]
@@ -279,11 +394,20 @@ async def list_sessions(
             "expires_at": s.expires_at.isoformat() if s.expires_at else None,
             "revoked": s.revoked,
             "device_id": s.device_id,
+            **_session_activity(s.id, s.last_used_at, s.ip_address),
         }
         for s in sessions
     ]
 
 
+def _session_activity(session_id: int, last_used_at, ip_address) -> dict:
+    """last_used_at / ip_address, including activity not yet flushed by the tracker."""
+    pending = activity_tracker.pending(session_id)
+    if pending is not None and (last_used_at is None or pending[0] > last_used_at):
+        last_used_at, ip_address = pending[0], pending[1] or ip_address
+    return {"last_used_at": last_used_at.isoformat() if last_used_at else None, "ip_address": ip_address}
+
+
 @sessions_router.delete("/sessions/{session_id}")
 async def revoke_session_by_id(
     session_id: int,
@@ -305,10 +429,16 @@ async def revoke_session_by_id(
     rt.last_used_at = datetime.now(timezone.utc)
     db.add(rt)
     await db.commit()
+    _audit("session.revoked", current_user, "session", rt.id)
     return {"ok": True, "revoked": True}
 
 
-@users_router.post("/register", response_model=UserRead, status_code=201)
+@users_router.post(
+    "/register",
+    response_model=UserRead,
+    status_code=201,
+    dependencies=[Depends(register_ip_limit), Depends(register_account_limit)],
+)
 async def register(
     payload: UserCreate,
     db: AsyncSession = Depends(get_db),
@@ -320,6 +450,8 @@ async def register(
         raise HTTPException(status_code=400, detail="Password too short (min 8 chars)")
 
     existing = await get_user_by_email(db, payload.email)
+    # release the connection before hashing (see login_json)
+    await db.commit()
     if existing:
         # Best practice: don't allow registration to silently return or
         # overwrite an existing account. Public registration should fail
@@ -327,29 +459,12 @@ async def register(
         # or password-reset flows as appropriate.
         raise HTTPException(status_code=409, detail="User with this email already exists")
 
-    # Rate limiting by IP (in-memory, per-process). For production use a
-    # centralized store like Redis or a reverse-proxy limit.
-    ip = None
-    if request is not None:
-        xff = request.headers.get("x-forwarded-for")
-        ip = xff.split(",")[0].strip() if xff else (request.client.host if request.client else None)
-    if ip:
-        now = time.time()
-        attempts = _registration_attempts.setdefault(ip, [])
-        cutoff = now - REG_RATE_LIMIT_WINDOW
-        # remove timestamps older than window
-        while attempts and attempts[0] < cutoff:
-            attempts.pop(0)
-        if len(attempts) >= REG_MAX_PER_IP:
-            raise HTTPException(status_code=429, detail="Too many registration attempts from your IP")
-        attempts.append(now)
-
     # Disposable email domain check
     domain = payload.email.split("@")[-1].lower()
     if domain in DISPOSABLE_DOMAINS:
         raise HTTPException(status_code=400, detail="Disposable email domains are not allowed")
 
-    hashed = get_password_hash(payload.password)
+    hashed = await get_password_hash_async(payload.password)
     # Ignore any incoming scopes from public registration; assign default scope.
     if getattr(payload, "scopes", None):
         logging.info("register: ignored scopes from payload for email=%s", payload.email)
@@ -366,12 +481,11 @@ async def register(
         verification_expires=expires,
         is_active=False,
     )
+    # the verification mail goes to the outbox in the same transaction as the
+    # user row; the background dispatcher delivers it (see outbox.py)
+    enqueue_email(db, user.email, VERIFICATION, verification_payload(token))
     created = await crud_create_user(db, user)
-    # send verification (test emailer stores messages in memory)
-    try:
-        send_verification(created.email, token)
-    except Exception:
-        logging.exception("Failed to send verification email for %s", created.email)
+    outbox_dispatcher.notify()
     return created
 
 
@@ -403,19 +517,24 @@ async def change_password(
     current_user=Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """Change current user's password (requires current password)."""
+    """Change current user's password (requires current password).
+
+    The DB connection is released before both Argon2 calls; only the final
+    UPDATE runs in a (short) transaction.
+    """
     user = await get_user_by_id(db, int(current_user["id"]))
+    await db.commit()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     try:
-        ok = verify_password(payload.current_password, user.hashed_password)
+        ok = await verify_password_async(payload.current_password, user.hashed_password)
     except UnknownHashError:
         ok = False
     if not ok:
         raise HTTPException(status_code=400, detail="Current password incorrect")
     if len(payload.new_password) < 8:
         raise HTTPException(status_code=400, detail="New password too short (min 8 chars)")
-    user.hashed_password = get_password_hash(payload.new_password)
+    user.hashed_password = await get_password_hash_async(payload.new_password)
     db.add(user)
     await db.commit()
     return {"ok": True}
@@ -446,6 +565,69 @@ async def admin_stats(current_user=Security(get_current_user, scopes=["admin"]),
 
 
 
+@admin_router.get("/admin/analytics")
+async def admin_analytics(
+    top: int = 10,
+    refresh: bool = False,
+    current_user=Security(get_current_user, scopes=["admin"]),
+    db: AsyncSession = Depends(get_db),
+):
+    """Fleet-wide figures: time to completion, reassigned share, busiest owners.
+
+    Computed by a chunked scan of all todos (see analytics.py) and cached for
+    ANALYTICS_CACHE_TTL seconds; refresh=true recomputes.
+    """
+    try:
+        return await analytics_cache.get(db, top, refresh)
+    except RuntimeError as exc:
+        raise HTTPException(status_code=503, detail=str(exc))
+
+
+@admin_router.get("/admin/audit", response_model=List[AuditEventRead])
+async def admin_audit(
+    actor_id: Optional[int] = None,
+    action: Optional[str] = None,
+    target_type: Optional[str] = None,
+    target_id: Optional[int] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    response: Response = None,
+    current_user=Security(get_current_user, scopes=["admin"]),
+    db: AsyncSession = Depends(get_db),
+):
+    """Журнал аудита, новые события первыми.
+
+    Keyset pagination on (created_at, id): pass the `X-Next-Cursor` response
+    header back as `cursor`. Events reach the table in batches, so the last
+    AUDIT_FLUSH_INTERVAL seconds may not be visible yet. Ids are per target
+    type, so `target_id` needs `target_type`.
+    """
+    if target_id is not None and target_type is None:
+        raise HTTPException(status_code=400, detail="target_id requires target_type")
+    q = select(AuditEvent)
+    if actor_id is not None:
+        q = q.where(AuditEvent.actor_id == actor_id)
+    if action is not None:
+        q = q.where(AuditEvent.action == action)
+    if target_type is not None:
+        q = q.where(AuditEvent.target_type == target_type)
+    if target_id is not None:
+        q = q.where(AuditEvent.target_id == target_id)
+    key = tuple_(AuditEvent.created_at, AuditEvent.id)
+    if cursor:
+        # "<created_at ISO>:<id>"
+        created, _, last_id = cursor.rpartition(":")
+        try:
+            bound = tuple_(literal(datetime.fromisoformat(created), UTCDateTime()), int(last_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        q = q.where(key < bound)
+    rows = (await db.execute(q.order_by(desc(AuditEvent.created_at), desc(AuditEvent.id)).limit(limit))).scalars().all()
+    if len(rows) == limit and response is not None:
+        response.headers["X-Next-Cursor"] = f"{rows[-1].created_at.isoformat()}:{rows[-1].id}"
+    return rows
+
+
 @admin_router.get("/healthz")
 async def healthz():
     """Health check endpoint."""
@@ -454,13 +636,18 @@ async def healthz():
 
 @admin_router.get("/metrics")
 async def metrics():
-    """Metrics stub — integrate Prometheus or another exporter in production."""
-    return {"metrics": {}}
+    """In-process metrics (see metrics.py), e.g. DB pool hold time per route, load shedding and coalescing."""
+    return {
+        "metrics": {**metrics_snapshot(), "load_shedding": load_shedder.snapshot(), "coalescing": todo_reads.snapshot()}
+    }
 
 
 @admin_router.post("/admin/cleanup_sessions")
 async def cleanup_sessions(current_user=Security(get_current_user, scopes=["admin"]), db: AsyncSession = Depends(get_db)):
-    """Cleanup expired or long-revoked refresh tokens. Returns number of revoked rows updated."""
+    """Cleanup expired or long-revoked refresh tokens and unused user agent strings.
+
+    Returns number of revoked rows updated and of `user_agents` rows deleted.
+    """
     # Simple implementation: mark tokens with expires_at < now or revoked True as revoked (idempotent)
     from datetime import datetime, timezone
     now = datetime.now(timezone.utc)
@@ -473,11 +660,13 @@ async def cleanup_sessions(current_user=Security(get_current_user, scopes=["admi
         t.last_used_at = now
         db.add(t)
         count += 1
+    user_agents = await crud_prune_user_agents(db)
     await db.commit()
-    return {"revoked_marked": count}
+    crud_forget_user_agents()
+    return {"revoked_marked": count, "user_agents_deleted": user_agents}
 
 
-@users_router.get("/me")
+@users_router.get("/me", response_model=MeRead)
 def me(current_user=Depends(get_current_user)):
     """Информация о текущем пользователе."""
     return current_user
@@ -490,19 +679,54 @@ def admin_only(current_user=Security(get_current_user, scopes=["admin"])):
 
 
 @todos_router.post("/todos", response_model=TodoRead)
+@idempotent(TodoRead)
 async def create_todo(
     payload: TodoCreate,
     current_user=Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None),
 ):
-    """Создать задачу для текущего пользователя."""
-    # owner_id — берем из id аутентифицированного пользователя
+    """Создать задачу для текущего пользователя (или в общем списке)."""
+    # owner_id — берем из id аутентифицированного пользователя; задача
+    # общего списка принадлежит владельцу списка
+    owner_id, list_id = int(current_user["id"]), payload.list_id
+    if list_id is None and payload.parent_id is not None:
+        # a subtask joins its parent's list
+        parent = await get_todo_by_id(db, payload.parent_id)
+        list_id = parent.list_id if parent is not None else None
+    if list_id is not None:
+        owner_id = (await _shared_list(db, current_user, list_id, WRITE)).owner_id
     todo = Todo(
         title=payload.title,
         description=payload.description,
-        owner_id=int(current_user["id"]),
+        owner_id=owner_id,
+        list_id=list_id,
+        due_at=payload.due_at,
+        remind_at=payload.remind_at,
     )
-    return await crud_create_todo(db, todo)
+    if payload.tags:
+        todo.tags = await resolve_tags(db, todo.owner_id, normalize_tags(payload.tags))
+    if payload.parent_id is not None:
+        # the parent must not be deleted or moved before we commit
+        await lock_todo_list(db, todo.owner_id)
+        parent = await _subtask_parent(db, payload.parent_id, todo)
+        todo.parent_id, todo.path = parent.id, child_path(parent)
+    todo = await crud_create_todo(db, todo)
+    await _publish(db, "created", todo)
+    _rearm(todo)
+    _audit("todo.created", current_user, "todo", todo.id)
+    return todo
+
+
+async def _coalesced(db: AsyncSession, key, fetch):
+    """Share an identical concurrent read (coalesce.py) if `db` has no writes of its own.
+
+    Inside an atomic batch a read must see the batch's uncommitted writes,
+    and no other request may see them, so such reads always run alone.
+    """
+    if has_uncommitted_writes(db):
+        return await fetch()
+    return await todo_reads.run(key, fetch)
 
 
 @todos_router.get("/todos", response_model=List[TodoRead])
@@ -513,6 +737,12 @@ async def list_todos_route(
     is_done: Optional[bool] = None,
     sort_by: str = "created_at",
     sort_desc: bool = False,
+    cursor: Optional[str] = None,
+    tag: Optional[List[str]] = Query(None),
+    tag_mode: str = Query("any", pattern="^(any|all)$"),
+    include_archived: bool = False,
+    list_id: Optional[int] = None,
+    response: Response = None,
     current_user=Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
@@ -520,24 +750,338 @@ async def list_todos_route(
 
     Admins may pass owner_id to list others' todos. Regular users will only
     see their own todos regardless of owner_id param.
+
+    With sort_by=position (manual order) use keyset pagination instead of
+    skip: pass the `X-Next-Cursor` response header back as `cursor`.
+
+    `tag` may be repeated: tag_mode=any returns todos with at least one of
+    the tags, tag_mode=all only todos that have every one of them.
+
+    include_archived=true also reads `todos_archive` (old completed todos,
+    see archive.py); tag filters match live todos only.
+
+    list_id returns the todos of a shared list (see sharing.py); an empty
+    page if the caller is neither its owner nor a member.
+
+    sort_by must be index-backed (created_at, id, position) and limit is
+    capped at QUERY_MAX_LIMIT (see guardrails.py).
     """
-    # enforce ownership for non-admins
+    sort_by = check_sort(sort_by)
+    limit = clamp_limit(limit)
+    # enforce ownership for non-admins; shared lists are checked in the query
+    shared = None
     if "admin" not in (current_user.get("scopes") or []):
-        owner_id = int(current_user["id"])
+        owner_id = None if list_id is not None else int(current_user["id"])
+        if list_id is not None:
+            shared = int(current_user["id"])
 
     # Basic selection using ORM select
     q = select(Todo)
     if owner_id is not None:
         q = q.where(Todo.owner_id == owner_id)
+    if list_id is not None:
+        q = q.where(Todo.list_id == list_id)
+    if shared is not None:
+        q = q.where(visible(Todo, shared))
     if is_done is not None:
         q = q.where(Todo.is_done == is_done)
-    # sorting
-    col = getattr(Todo, sort_by, None)
-    if col is not None:
-        q = q.order_by(desc(col) if sort_desc else asc(col))
-    q = q.offset(skip).limit(limit)
-    res = await db.execute(q)
-    return res.scalars().all()
+    tag_names = normalize_tags(tag)
+    if tag_names:
+        q = q.where(tag_filter(tag_names, tag_mode, owner_id))
+    archived = None
+    if include_archived and not tag_names:
+        archived = select(TodoArchive)
+        if owner_id is not None:
+            archived = archived.where(TodoArchive.owner_id == owner_id)
+        if list_id is not None:
+            archived = archived.where(TodoArchive.list_id == list_id)
+        if shared is not None:
+            archived = archived.where(visible(TodoArchive, shared))
+        if is_done is not None:
+            archived = archived.where(TodoArchive.is_done == is_done)
+
+    async def fetch():
+        page = Response()
+        if sort_by == "position":
+            todos = await _list_by_position(db, q, limit, sort_desc, cursor, page, archived)
+        elif archived is not None:
+            todos = await _list_with_archive(db, q, archived, sort_by, sort_desc, skip, limit)
+        else:
+            # sorting; id breaks ties, as in ix_todos_owner_created
+            col = getattr(Todo, sort_by)
+            ordered = q.order_by(*(desc(c) if sort_desc else asc(c) for c in (col, Todo.id)))
+            todos = (await db.execute(ordered.offset(skip).limit(limit))).scalars().all()
+        return [_todo_data(t) for t in todos], page.headers.get("X-Next-Cursor")
+
+    # identical concurrent reads of the same principal share one query (see coalesce.py)
+    key = (
+        "GET /todos", int(current_user["id"]), tuple(current_user.get("scopes") or ()), skip, limit, owner_id,
+        is_done, sort_by, sort_desc, cursor, tuple(tag_names), tag_mode, include_archived, list_id,
+    )
+    todos, next_cursor = await _coalesced(db, key, fetch)
+    if next_cursor is not None and response is not None:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return todos
+
+
+async def _list_by_position(
+    db: AsyncSession, q, limit: int, sort_desc: bool, cursor: Optional[str], response: Response, archived=None
+):
+    """Keyset page ordered by (position, id); cursor is "<position>:<id>".
+
+    `archived` (a query on TodoArchive) is paged the same way and merged in.
+    """
+    bound = None
+    if cursor:
+        position, _, last_id = cursor.rpartition(":")
+        if not position or not last_id.isdigit():
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        bound = (position, int(last_id))
+    todos = []
+    for model, query in ((Todo, q), (TodoArchive, archived)):
+        if query is None:
+            continue
+        key = tuple_(model.position, model.id)
+        if bound is not None:
+            query = query.where(key < tuple_(*bound) if sort_desc else key > tuple_(*bound))
+        order = (desc(model.position), desc(model.id)) if sort_desc else (asc(model.position), asc(model.id))
+        todos += (await db.execute(query.order_by(*order).limit(limit))).scalars().all()
+    if archived is not None:
+        todos = sorted(todos, key=lambda t: (t.position, t.id), reverse=sort_desc)[:limit]
+    if len(todos) == limit and response is not None:
+        response.headers["X-Next-Cursor"] = f"{todos[-1].position}:{todos[-1].id}"
+    return todos
+
+
+async def _list_with_archive(db: AsyncSession, q, archived, sort_by: str, sort_desc: bool, skip: int, limit: int):
+    """Offset page over live and archived todos.
+
+    Both sides are sorted the same way, so their first skip+limit rows are
+    enough to cut the merged page.
+    """
+    rows = []
+    for model, query in ((Todo, q), (TodoArchive, archived)):
+        col = getattr(model, sort_by)
+        query = query.order_by(desc(col) if sort_desc else asc(col), desc(model.id) if sort_desc else asc(model.id))
+        rows += (await db.execute(query.limit(skip + limit))).scalars().all()
+
+    def key(t):
+        value = getattr(t, sort_by, None)
+        return (value is not None, value if value is not None else 0, t.id)
+
+    return sorted(rows, key=key, reverse=sort_desc)[skip:skip + limit]
+
+
+def _todo_data(todo: Todo) -> dict:
+    return TodoRead.model_validate(todo).model_dump(mode="json")
+
+
+async def _publish_events(db: AsyncSession, events: list) -> None:
+    """Опубликовать события об уже закоммиченных изменениях (и участникам списков)."""
+    change_feed.publish(await with_list_members(db, events))
+
+
+async def _publish(db: AsyncSession, kind: str, todo: Todo, *extra_owner_ids: int) -> None:
+    """Опубликовать событие об уже закоммиченном изменении задачи."""
+    await _publish_events(db, [todo_event(kind, todo, extra_owner_ids, _todo_data(todo))])
+
+
+def _audit(action: str, current_user: dict, target_type: str, target_id: Optional[int], **data) -> None:
+    """Записать событие в журнал аудита (только буфер в памяти, см. audit.py)."""
+    audit_log.record(action, int(current_user["id"]), target_type, target_id, data or None, current_user.get("ip"))
+
+
+async def _subtask_parent(db: AsyncSession, parent_id: int, todo: Todo) -> Todo:
+    """Todo that may become the parent of `todo` (400 otherwise): same owner, same shared list."""
+    parent = await db.get(Todo, parent_id, populate_existing=True)
+    if not parent or parent.owner_id != todo.owner_id or parent.list_id != todo.list_id:
+        raise HTTPException(status_code=400, detail="parent_id must be a todo in the same list")
+    return parent
+
+
+async def _authorize(db: AsyncSession, current_user: dict, todo, needed: str, action: str) -> None:
+    """403 unless the caller has `needed` (sharing.READ / WRITE / OWNER) on the todo."""
+    if not await has_role(db, current_user, todo.owner_id, todo.list_id, needed):
+        raise HTTPException(status_code=403, detail=f"Not authorized to {action} this todo")
+
+
+async def _shared_list(db: AsyncSession, current_user: dict, list_id: int, needed: str) -> TodoList:
+    """The list `list_id` if the caller has `needed` on it (404 / 403 otherwise)."""
+    todo_list = await get_list(db, list_id)
+    if todo_list is None:
+        raise HTTPException(status_code=404, detail="List not found")
+    if not await has_role(db, current_user, todo_list.owner_id, todo_list.id, needed):
+        raise HTTPException(status_code=403, detail="Not authorized to use this list")
+    return todo_list
+
+
+async def _reassign(db: AsyncSession, todo: Todo, owner_id: int) -> list:
+    """Give `todo` and its subtasks to `owner_id`; returns the moved todos.
+
+    A tree never spans two lists: the todo leaves its parent and takes its
+    whole subtree along. The new owner does not own the todo's shared list,
+    so the todos leave it too.
+    """
+    if owner_id == todo.owner_id:
+        return [todo]
+    nodes = await subtree(db, todo.id)
+    if todo.parent_id is not None:
+        await set_parent(db, todo, None, nodes)
+    for node in nodes:
+        node.owner_id = owner_id
+        node.list_id = None
+        node.updated_at = datetime.now(timezone.utc)
+    return nodes
+
+
+async def _move_to_list(db: AsyncSession, todo: Todo, list_id: Optional[int]) -> None:
+    """Put `todo` with its subtree into another list of its owner (None: no list)."""
+    if list_id is not None:
+        todo_list = await get_list(db, list_id)
+        if todo_list is None or todo_list.owner_id != todo.owner_id:
+            raise HTTPException(status_code=400, detail="list_id must be a list of the todo's owner")
+    nodes = await subtree(db, todo.id)
+    if todo.parent_id is not None:
+        await set_parent(db, todo, None, nodes)
+    for node in nodes:
+        node.list_id = list_id
+        node.updated_at = datetime.now(timezone.utc)
+
+
+def _rearm(todo: Todo, deleted: bool = False) -> None:
+    """Сообщить планировщику напоминаний об уже закоммиченном изменении."""
+    reminder_scheduler.rearm(todo.id, None if deleted or todo.is_done else todo.remind_at)
+
+
+@todos_router.get("/tags", response_model=List[TagCount])
+async def list_tags(
+    owner_id: Optional[int] = None,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Теги пользователя с числом задач (admins may pass owner_id).
+
+    Counts are maintained on write (see tags.py), so this reads one index
+    range of `tags` no matter how many todos there are.
+    """
+    if owner_id is None or "admin" not in (current_user.get("scopes") or []):
+        owner_id = int(current_user["id"])
+    res = await db.execute(
+        select(Tag.name, Tag.todo_count.label("count"))
+        .where(Tag.owner_id == owner_id, Tag.todo_count > 0)
+        .order_by(Tag.name)
+    )
+    return [TagCount(name=name, count=count) for name, count in res.all()]
+
+
+@todos_router.get("/todos/changes", response_model=TodoChanges)
+async def todo_changes(
+    since: int = 0,
+    limit: int = 500,
+    owner_id: Optional[int] = None,
+    list_since: Optional[str] = None,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Delta sync for offline clients.
+
+    Returns todos changed after the `since` token and the ids of todos that
+    were deleted or reassigned away. Start with `since=0` and pass back the
+    returned `next_token`; repeat while `has_more` is true. Admins may pass
+    owner_id to sync another user's list.
+
+    Todos of lists shared with the user have a token per list: pass the
+    returned `list_tokens` back as `list_since=<list_id>:<token>,...`.
+    """
+    if "admin" not in (current_user.get("scopes") or []) or owner_id is None:
+        owner_id = int(current_user["id"])
+    try:
+        lists = dict(tuple(int(v) for v in part.split(":")) for part in list_since.split(",")) if list_since else {}
+    except ValueError:
+        raise HTTPException(status_code=400, detail="list_since must be <list_id>:<token>,...")
+    return await crud_todo_changes(db, owner_id, max(since, 0), clamp_limit(limit), lists)
+
+
+@todos_router.get("/todos/stats", response_model=TodoStatsRead)
+async def todo_stats(
+    period: str = Query("day", pattern="^(day|week)$"),
+    periods: int = 30,
+    owner_id: Optional[int] = None,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Open / done counts, completion rate and created vs. completed per day or week.
+
+    Read from rollups maintained on write (see todo_stats.py): the cost
+    depends on `periods`, not on the size of the history. Archived todos
+    count as done; days are UTC. Admins may pass owner_id.
+    """
+    if "admin" not in (current_user.get("scopes") or []) or owner_id is None:
+        owner_id = int(current_user["id"])
+    return await read_stats(db, owner_id, period, periods)
+
+
+@todos_router.get("/todos/stream")
+async def stream_todos(current_user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Server-Sent Events feed of changes to the caller's todos (all todos for admins).
+
+    Emits a comment line every REALTIME_HEARTBEAT seconds to keep proxies
+    from closing idle connections; a `resync` event means events were dropped
+    and the client should refetch `/todos`.
+    """
+    # the stream can stay open for hours: give the pooled connection back now
+    await db.close()
+    sub = change_feed.hub.subscribe(int(current_user["id"]), "admin" in (current_user.get("scopes") or []))
+
+    async def events():
+        try:
+            yield ": connected\n\n"
+            while not sub.closed:
+                event = await sub.get(timeout=REALTIME_HEARTBEAT)
+                if event is None:
+                    if sub.closed:
+                        break
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            change_feed.hub.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@todos_router.websocket("/todos/ws")
+async def todos_ws(websocket: WebSocket, token: str):
+    """WebSocket feed with the same events as `/todos/stream`.
+
+    Browsers cannot set headers on WebSocket requests, so the access token is
+    passed as `?token=`.
+    """
+    try:
+        async with AsyncSessionLocal() as db:
+            principal = await principal_from_token(db, token)
+    except HTTPException:
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    sub = change_feed.hub.subscribe(int(principal["id"]), "admin" in (principal.get("scopes") or []))
+    try:
+        while not sub.closed:
+            event = await sub.get(timeout=REALTIME_HEARTBEAT)
+            if event is None:
+                if sub.closed:
+                    break
+                await websocket.send_json({"type": "ping"})
+                continue
+            await websocket.send_json(event)
+    except WebSocketDisconnect:
+        pass
+    finally:
+        change_feed.hub.unsubscribe(sub)
 
 
 @todos_router.get("/todos/{todo_id}", response_model=TodoRead)
@@ -546,15 +1090,40 @@ async def get_todo(
     current_user=Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """Получить задачу по id (владелец или admin)."""
-    todo = await get_todo_by_id(db, todo_id)
-    if not todo:
+    """Получить задачу по id (владелец или admin); архивные тоже.
+
+    Одинаковые одновременные запросы одного пользователя выполняются одним
+    запросом к БД (см. coalesce.py).
+    """
+    async def fetch():
+        todo = await get_todo_by_id(db, todo_id) or await get_archived_todo(db, todo_id)
+        if not todo:
+            raise HTTPException(status_code=404, detail="Todo not found")
+        await _authorize(db, current_user, todo, READ, "view")
+        return _todo_data(todo)
+
+    key = ("GET /todos/{todo_id}", int(current_user["id"]), tuple(current_user.get("scopes") or ()), todo_id)
+    return await _coalesced(db, key, fetch)
+
+
+@todos_router.get("/todos/{todo_id}/tree", response_model=TodoTree)
+async def get_todo_tree(
+    todo_id: int,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Задача со всеми подзадачами, вложенно; один запрос при любой глубине."""
+    nodes = await subtree(db, todo_id)
+    if not nodes:
         raise HTTPException(status_code=404, detail="Todo not found")
-    if todo.owner_id != int(current_user["id"]) and "admin" not in (
-        current_user.get("scopes") or []
-    ):
-        raise HTTPException(status_code=403, detail="Not authorized to view this todo")
-    return todo
+    root = nodes[0]
+    # a tree lies within one list: the root decides
+    await _authorize(db, current_user, root, READ, "view")
+    # parents come before their children, siblings in manual order
+    items = {n.id: {**TodoRead.model_validate(n).model_dump(), "children": []} for n in nodes}
+    for n in nodes[1:]:
+        items[n.parent_id]["children"].append(items[n.id])
+    return items[root.id]
 
 
 @todos_router.patch("/todos/{todo_id}", response_model=TodoRead)
@@ -564,22 +1133,42 @@ async def update_todo(
     current_user=Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """Обновить задачу (владелец или admin)."""
+    """Обновить задачу (владелец, участник списка с правом записи или admin)."""
     todo = await get_todo_by_id(db, todo_id)
     if not todo:
         raise HTTPException(status_code=404, detail="Todo not found")
-    if todo.owner_id != int(current_user["id"]) and "admin" not in (
-        current_user.get("scopes") or []
-    ):
-        raise HTTPException(
-            status_code=403, detail="Not authorized to modify this todo"
-        )
+    await _authorize(db, current_user, todo, WRITE, "modify")
+    change_list = "list_id" in payload.model_fields_set and payload.list_id != todo.list_id
+    if change_list:
+        # only the owner decides who sees the todo
+        await _authorize(db, current_user, todo, OWNER, "move")
+    if change_list or "parent_id" in payload.model_fields_set:
+        # no concurrent move may create a cycle: serialize, then re-read
+        await lock_todo_list(db, todo.owner_id)
+        await db.refresh(todo)
+    if change_list:
+        await _move_to_list(db, todo, payload.list_id)
+    if "parent_id" in payload.model_fields_set:
+        parent = None
+        if payload.parent_id is not None:
+            parent = await _subtask_parent(db, payload.parent_id, todo)
+        try:
+            await set_parent(db, todo, parent)
+        except ValueError as exc:
+            await db.rollback()
+            raise HTTPException(status_code=400, detail=str(exc))
     if payload.title is not None:
         todo.title = payload.title
     if payload.description is not None:
         todo.description = payload.description
     if payload.is_done is not None:
         todo.is_done = payload.is_done
+    if payload.tags is not None:
+        todo.tags = await resolve_tags(db, todo.owner_id, normalize_tags(payload.tags))
+    # null is meaningful for the dates: it clears them
+    for field in ("due_at", "remind_at"):
+        if field in payload.model_fields_set:
+            setattr(todo, field, getattr(payload, field))
     from datetime import datetime, timezone
     todo.updated_at = datetime.now(timezone.utc)
     # manage completed metadata when is_done toggles
@@ -596,6 +1185,9 @@ async def update_todo(
     db.add(todo)
     await db.commit()
     await db.refresh(todo)
+    await _publish(db, "updated", todo)
+    _rearm(todo)
+    _audit("todo.updated", current_user, "todo", todo.id, fields=sorted(payload.model_fields_set))
     return todo
 
 
@@ -605,12 +1197,11 @@ async def complete_todo(
     current_user=Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """Mark a todo as completed (owner or admin)."""
+    """Mark a todo as completed (owner, list writer or admin)."""
     todo = await get_todo_by_id(db, todo_id)
     if not todo:
         raise HTTPException(status_code=404, detail="Todo not found")
-    if todo.owner_id != int(current_user["id"]) and "admin" not in (current_user.get("scopes") or []):
-        raise HTTPException(status_code=403, detail="Not authorized to modify this todo")
+    await _authorize(db, current_user, todo, WRITE, "modify")
     from datetime import datetime, timezone
 
     todo.is_done = True
@@ -623,6 +1214,9 @@ async def complete_todo(
     db.add(todo)
     await db.commit()
     await db.refresh(todo)
+    await _publish(db, "completed", todo)
+    _rearm(todo)
+    _audit("todo.completed", current_user, "todo", todo.id)
     return {"ok": True}
 
 
@@ -632,12 +1226,11 @@ async def reopen_todo(
     current_user=Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """Reopen a completed todo (owner or admin)."""
+    """Reopen a completed todo (owner, list writer or admin)."""
     todo = await get_todo_by_id(db, todo_id)
     if not todo:
         raise HTTPException(status_code=404, detail="Todo not found")
-    if todo.owner_id != int(current_user["id"]) and "admin" not in (current_user.get("scopes") or []):
-        raise HTTPException(status_code=403, detail="Not authorized to modify this todo")
+    await _authorize(db, current_user, todo, WRITE, "modify")
     from datetime import datetime, timezone
 
     todo.is_done = False
@@ -647,23 +1240,84 @@ async def reopen_todo(
     db.add(todo)
     await db.commit()
     await db.refresh(todo)
+    await _publish(db, "reopened", todo)
+    _rearm(todo)
+    _audit("todo.reopened", current_user, "todo", todo.id)
     return {"ok": True}
 
 
 
+@todos_router.post("/todos/{todo_id}/move", response_model=TodoRead)
+async def move_todo(
+    todo_id: int,
+    payload: TodoMove,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Переместить задачу между соседями (ручная сортировка, sort_by=position).
+
+    Меняется только позиция самой задачи: новый ключ берётся между
+    позициями соседей (см. positions.py), остальные задачи не трогаем.
+    """
+    if payload.after_id is None and payload.before_id is None:
+        raise HTTPException(status_code=422, detail="after_id or before_id is required")
+    todo = await get_todo_by_id(db, todo_id)
+    if not todo:
+        raise HTTPException(status_code=404, detail="Todo not found")
+    await _authorize(db, current_user, todo, WRITE, "modify")
+    # neighbours must not move (e.g. be rebalanced) between reading and writing
+    await lock_todo_list(db, todo.owner_id)
+    bounds = {}
+    for name in ("after_id", "before_id"):
+        neighbour_id = getattr(payload, name)
+        if neighbour_id is None:
+            continue
+        neighbour = await get_todo_by_id(db, neighbour_id)
+        if not neighbour or neighbour.owner_id != todo.owner_id or neighbour.id == todo.id:
+            raise HTTPException(status_code=400, detail=f"{name} must be another todo in the same list")
+        bounds[name] = neighbour.position
+    above, below = bounds.get("after_id"), bounds.get("before_id")
+    if below is None:
+        below = await neighbour_position(db, todo, above, below=True)
+    elif above is None:
+        above = await neighbour_position(db, todo, below, below=False)
+    try:
+        todo.position = key_between(above, below)
+    except ValueError:
+        # neighbours are out of order or share a key: the client's view is stale
+        await db.rollback()
+        if above == below:
+            rebalancer.schedule(todo.owner_id)
+        raise HTTPException(status_code=409, detail="Neighbours are out of order; reload the list")
+    todo.updated_at = datetime.now(timezone.utc)
+    await db.commit()
+    if len(todo.position) > POSITION_REBALANCE_LENGTH:
+        rebalancer.schedule(todo.owner_id)
+    await _publish(db, "moved", todo)
+    return todo
+
+
 @todos_router.post("/todos/bulk_complete")
+@idempotent()
 async def bulk_complete(
-    todo_ids: List[int], current_user=Depends(get_current_user), db: AsyncSession = Depends(get_db)
+    todo_ids: List[int],
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None),
 ):
-    """Bulk mark todos as complete. Only affects todos owned by the caller unless admin."""
+    """Bulk mark todos as complete.
+
+    Only affects todos the caller may change (own ones and those of lists
+    shared with write access) unless admin; the check is part of the query.
+    """
     from datetime import datetime, timezone
 
-    q = await db.execute(select(Todo).where(Todo.id.in_(todo_ids)))
-    items = q.scalars().all()
-    updated = 0
+    q = select(Todo).where(Todo.id.in_(todo_ids))
+    if "admin" not in (current_user.get("scopes") or []):
+        q = q.where(writable(Todo, int(current_user["id"])))
+    items = (await db.execute(q)).scalars().all()
+    changed = []
     for t in items:
-        if t.owner_id != int(current_user["id"]) and "admin" not in (current_user.get("scopes") or []):
-            continue
         t.is_done = True
         t.completed_at = datetime.now(timezone.utc)
         try:
@@ -672,30 +1326,39 @@ async def bulk_complete(
             t.completed_by = None
         t.updated_at = datetime.now(timezone.utc)
         db.add(t)
-        updated += 1
+        changed.append(t)
     await db.commit()
-    return {"updated": updated}
+    await _publish_events(db, [todo_event("completed", t, data=_todo_data(t)) for t in changed])
+    for t in changed:
+        _rearm(t)
+        _audit("todo.completed", current_user, "todo", t.id, bulk=True)
+    return {"updated": len(changed)}
 
 
 @todos_router.post("/todos/{todo_id}/assign")
+@idempotent()
 async def assign_todo(
-    todo_id: int, assignee_id: int, current_user=Depends(get_current_user), db: AsyncSession = Depends(get_db)
+    todo_id: int,
+    assignee_id: int,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+    idempotency_key: Optional[str] = Header(None),
 ):
     """Assign a todo to another user (owner or admin)."""
     todo = await get_todo_by_id(db, todo_id)
     if not todo:
         raise HTTPException(status_code=404, detail="Todo not found")
-    if todo.owner_id != int(current_user["id"]) and "admin" not in (current_user.get("scopes") or []):
-        raise HTTPException(status_code=403, detail="Not authorized to assign this todo")
+    await _authorize(db, current_user, todo, OWNER, "assign")
     # lightweight validation: ensure user exists
     u = await get_user_by_id(db, assignee_id)
     if not u:
         raise HTTPException(status_code=404, detail="Assignee not found")
-    todo.owner_id = assignee_id
-    todo.updated_at = datetime.now(timezone.utc)
-    db.add(todo)
+    previous_owner = todo.owner_id
+    moved = await _reassign(db, todo, assignee_id)
     await db.commit()
     await db.refresh(todo)
+    await _publish_events(db, [todo_event("assigned", t, [previous_owner], _todo_data(t)) for t in moved])
+    _audit("todo.assigned", current_user, "todo", todo.id, previous_owner=previous_owner, owner=assignee_id)
     return {"ok": True}
 
 
@@ -707,13 +1370,13 @@ async def unassign_todo(
     todo = await get_todo_by_id(db, todo_id)
     if not todo:
         raise HTTPException(status_code=404, detail="Todo not found")
-    if todo.owner_id != int(current_user["id"]) and "admin" not in (current_user.get("scopes") or []):
-        raise HTTPException(status_code=403, detail="Not authorized to unassign this todo")
-    todo.owner_id = int(current_user["id"])
-    todo.updated_at = datetime.now(timezone.utc)
-    db.add(todo)
+    await _authorize(db, current_user, todo, OWNER, "unassign")
+    previous_owner = todo.owner_id
+    moved = await _reassign(db, todo, int(current_user["id"]))
     await db.commit()
     await db.refresh(todo)
+    await _publish_events(db, [todo_event("unassigned", t, [previous_owner], _todo_data(t)) for t in moved])
+    _audit("todo.unassigned", current_user, "todo", todo.id, previous_owner=previous_owner, owner=todo.owner_id)
     return {"ok": True}
 
 
@@ -723,21 +1386,222 @@ async def delete_todo(
     current_user=Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """Удалить задачу (владелец или admin)."""
+    """Удалить задачу (владелец, участник списка с правом записи или admin)."""
     todo = await get_todo_by_id(db, todo_id)
     if not todo:
         raise HTTPException(status_code=404, detail="Todo not found")
-    if todo.owner_id != int(current_user["id"]) and "admin" not in (
-        current_user.get("scopes") or []
-    ):
-        raise HTTPException(
-            status_code=403, detail="Not authorized to delete this todo"
-        )
-    await db.delete(todo)
+    await _authorize(db, current_user, todo, WRITE, "delete")
+    # subtasks go with their parent
+    nodes = await delete_subtree(db, todo)
+    await db.commit()
+    await _publish_events(db, [todo_event("deleted", t) for t in nodes])
+    for t in nodes:
+        _rearm(t, deleted=True)
+    _audit("todo.deleted", current_user, "todo", todo.id, owner=todo.owner_id, title=todo.title,
+           subtasks=len(nodes) - 1)
+    return {"ok": True}
+
+
+@todos_router.post("/lists", response_model=TodoListRead)
+async def create_list(
+    payload: TodoListCreate,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Создать общий список; задачи в него кладут через `list_id`."""
+    todo_list = TodoList(name=payload.name, owner_id=int(current_user["id"]))
+    db.add(todo_list)
     await db.commit()
+    _audit("list.created", current_user, "list", todo_list.id)
+    return TodoListRead.model_validate(todo_list).model_copy(update={"role": OWNER})
+
+
+@todos_router.get("/lists", response_model=List[TodoListRead])
+async def list_lists(current_user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Списки, которыми пользователь владеет или в которых участвует, с его ролью."""
+    return [
+        TodoListRead.model_validate(todo_list).model_copy(update={"role": role})
+        for todo_list, role in await lists_of(db, int(current_user["id"]))
+    ]
+
+
+@todos_router.delete("/lists/{list_id}")
+async def delete_list(list_id: int, current_user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Удалить список (владелец или admin); его задачи остаются у владельца."""
+    todo_list = await _shared_list(db, current_user, list_id, OWNER)
+    await lock_todo_list(db, todo_list.owner_id)
+    todos = (await db.execute(select(Todo).where(Todo.list_id == list_id))).scalars().all()
+    # through the ORM, so the owner's delta sync sees the todos change
+    for todo in todos:
+        todo.list_id = None
+    await db.delete(todo_list)
+    await db.commit()
+    forget_list(db, list_id)
+    await _publish_events(db, [todo_event("updated", t, data=_todo_data(t)) for t in todos])
+    _audit("list.deleted", current_user, "list", list_id, todos=len(todos))
     return {"ok": True}
 
 
+@todos_router.get("/lists/{list_id}/members", response_model=List[ListMemberRead])
+async def list_members(list_id: int, current_user=Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    """Участники списка (видны всем участникам)."""
+    await _shared_list(db, current_user, list_id, READ)
+    res = await db.execute(select(ListMember).where(ListMember.list_id == list_id).order_by(ListMember.user_id))
+    return res.scalars().all()
+
+
+@todos_router.put("/lists/{list_id}/members/{user_id}", response_model=ListMemberRead)
+async def share_list(
+    list_id: int,
+    user_id: int,
+    payload: ListMemberUpdate,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Открыть список пользователю или сменить его роль (владелец или admin)."""
+    todo_list = await _shared_list(db, current_user, list_id, OWNER)
+    if user_id == todo_list.owner_id:
+        raise HTTPException(status_code=400, detail="The owner is not a member of their own list")
+    if not await get_user_by_id(db, user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    member = await db.get(ListMember, (user_id, list_id))
+    if member is None:
+        member = ListMember(user_id=user_id, list_id=list_id)
+        db.add(member)
+    member.role = payload.role.value
+    await db.commit()
+    forget_list(db, list_id)
+    todo_reads.invalidate()
+    _audit("list.shared", current_user, "list", list_id, user=user_id, role=member.role)
+    return member
+
+
+@todos_router.delete("/lists/{list_id}/members/{user_id}")
+async def unshare_list(
+    list_id: int,
+    user_id: int,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Закрыть доступ к списку (владелец или admin); участник может выйти сам."""
+    if user_id != int(current_user["id"]):
+        await _shared_list(db, current_user, list_id, OWNER)
+    member = await db.get(ListMember, (user_id, list_id))
+    if member is None:
+        raise HTTPException(status_code=404, detail="Member not found")
+    await db.delete(member)
+    await db.commit()
+    forget_list(db, list_id)
+    todo_reads.invalidate()
+    _audit("list.unshared", current_user, "list", list_id, user=user_id)
+    return {"ok": True}
+
+
+# Максимальное число операций в одном POST /batch
+BATCH_MAX_OPERATIONS = int(os.environ.get("BATCH_MAX_OPERATIONS", "100"))
+
+_TODO_PATH = r"/todos/(?P<todo_id>\d+)"
+# (method, path, handler, body schema, names of scalar body fields passed as arguments)
+_BATCH_ROUTES = [
+    ("POST", re.compile(r"/todos"), create_todo, TodoCreate, ()),
+    ("GET", re.compile(_TODO_PATH), get_todo, None, ()),
+    ("PATCH", re.compile(_TODO_PATH), update_todo, TodoUpdate, ()),
+    ("DELETE", re.compile(_TODO_PATH), delete_todo, None, ()),
+    ("POST", re.compile(_TODO_PATH + "/complete"), complete_todo, None, ()),
+    ("POST", re.compile(_TODO_PATH + "/reopen"), reopen_todo, None, ()),
+    ("POST", re.compile(_TODO_PATH + "/assign"), assign_todo, None, ("assignee_id",)),
+    ("POST", re.compile(_TODO_PATH + "/unassign"), unassign_todo, None, ()),
+]
+
+
+async def _run_batch_operation(op: BatchOperation, current_user: dict, db: AsyncSession) -> BatchResult:
+    """Выполнить одну операцию батча через обычный обработчик маршрута."""
+    method = op.method.upper()
+    path = op.path.split("?", 1)[0].rstrip("/")
+    matched = [(m, match, h, schema, args) for m, rx, h, schema, args in _BATCH_ROUTES if (match := rx.fullmatch(path))]
+    if not matched:
+        return BatchResult(status=404, body={"detail": "Not Found"})
+    route = next((r for r in matched if r[0] == method), None)
+    if route is None:
+        return BatchResult(status=405, body={"detail": "Method Not Allowed"})
+    _, match, handler, schema, body_args = route
+    kwargs = {name: int(value) for name, value in match.groupdict().items()}
+    body = op.body or {}
+    try:
+        if schema is not None:
+            kwargs["payload"] = schema.model_validate(body)
+        for name in body_args:
+            if name not in body:
+                return BatchResult(status=422, body={"detail": f"Missing body field: {name}"})
+            kwargs[name] = int(body[name])
+        result = await handler(**kwargs, current_user=current_user, db=db)
+    except HTTPException as exc:
+        return BatchResult(status=exc.status_code, body={"detail": exc.detail})
+    except ValidationError as exc:
+        return BatchResult(status=422, body={"detail": jsonable_encoder(exc.errors(include_url=False))})
+    except (TypeError, ValueError) as exc:
+        return BatchResult(status=422, body={"detail": str(exc)})
+    if isinstance(result, Todo):
+        result = TodoRead.model_validate(result)
+    return BatchResult(status=200, body=jsonable_encoder(result))
+
+
+class _BatchAborted(Exception):
+    pass
+
+
+@todos_router.post("/batch", response_model=BatchResponse)
+async def batch(
+    payload: BatchRequest,
+    current_user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+):
+    """Execute several todo operations in one request.
+
+    Operations run in order in one session, authenticated once. By default
+    each one commits on its own and failures, including unexpected errors
+    (500), do not affect the others. With
+    `atomic: true` everything runs in one transaction. The first failure
+    rolls back the whole batch, the remaining operations report 424, and
+    `committed` is false.
+    """
+    if len(payload.operations) > BATCH_MAX_OPERATIONS:
+        raise HTTPException(status_code=413, detail=f"At most {BATCH_MAX_OPERATIONS} operations per batch")
+    results: List[BatchResult] = []
+    if not payload.atomic:
+        for op in payload.operations:
+            try:
+                result = await _run_batch_operation(op, current_user, db)
+            except Exception:
+                # earlier operations are committed: report this one, keep going
+                logging.exception("batch: %s %s failed", op.method, op.path)
+                result = BatchResult(status=500, body={"detail": "Internal Server Error"})
+            if result.status >= 400:
+                # drop whatever the failed handler left in the session
+                await db.rollback()
+            results.append(result)
+        return BatchResponse(results=results, committed=True)
+
+    with change_feed.hold() as events, audit_log.hold() as audited, reminder_scheduler.hold() as rearms:
+        try:
+            async with deferred_commit(db):
+                for op in payload.operations:
+                    result = await _run_batch_operation(op, current_user, db)
+                    results.append(result)
+                    if result.status >= 400:
+                        raise _BatchAborted()
+        except _BatchAborted:
+            skipped = len(payload.operations) - len(results)
+            results.extend(BatchResult(status=424, body={"detail": "Not executed: batch aborted"}) for _ in range(skipped))
+            return BatchResponse(results=results, committed=False)
+    # subscribers, the audit trail and the reminder heap only hear about the
+    # batch once it is committed
+    change_feed.publish(events)
+    audit_log.add(audited)
+    reminder_scheduler.replay(rearms)
+    return BatchResponse(results=results, committed=True)
+
+
 # include sub-routers into the public router that main.py imports
 router.include_router(auth_router)
 router.include_router(users_router)
@@ -1,14 +1,25 @@
-from pydantic import BaseModel, Field, EmailStr
+from pydantic import BaseModel, Field, EmailStr, field_validator
 from typing import Annotated
 from enum import Enum
-from typing import Optional, List
-from datetime import datetime
+from typing import Any, Dict, Optional, List
+from datetime import date, datetime
+
+
+# Tag names: at most 20 per todo, 50 characters each (normalized in tags.py)
+TagList = Annotated[List[Annotated[str, Field(max_length=50)]], Field(max_length=20)]
 
 
 class TodoCreate(BaseModel):
     """Schema for creating a todo."""
     title: str = Field(..., min_length=1)
     description: Optional[str] = None
+    tags: Optional[TagList] = None
+    due_at: Optional[datetime] = None
+    remind_at: Optional[datetime] = None
+    # makes the new todo a subtask of this one (same list)
+    parent_id: Optional[int] = None
+    # shared list (see sharing.py); a subtask joins its parent's list
+    list_id: Optional[int] = None
 
 
 class TodoRead(BaseModel):
@@ -20,15 +31,117 @@ class TodoRead(BaseModel):
     is_done: bool
     created_at: datetime
     updated_at: datetime
+    position: Optional[str] = None
+    tags: List[str] = []
+    due_at: Optional[datetime] = None
+    remind_at: Optional[datetime] = None
+    parent_id: Optional[int] = None
+    list_id: Optional[int] = None
+    # progress of the direct subtasks
+    subtasks_total: int = 0
+    subtasks_done: int = 0
+    # set for todos read from the archive
+    archived_at: Optional[datetime] = None
+
+    model_config = {"from_attributes": True}
+
+    @field_validator("tags", mode="before")
+    @classmethod
+    def _tag_names(cls, value):
+        # ORM objects carry Tag rows
+        return [getattr(t, "name", t) for t in value or ()]
+
+
+class TodoTree(TodoRead):
+    """Response of `GET /todos/{id}/tree`: a todo with its nested subtasks."""
+    children: List["TodoTree"] = []
+
+
+class TodoChanges(BaseModel):
+    """Response of the delta sync endpoint (`GET /todos/changes`)."""
+    changes: List[TodoRead]
+    deleted: List[int]
+    next_token: int
+    # shared lists: list_id -> token, passed back as `list_since`
+    list_tokens: Dict[int, int] = {}
+    has_more: bool
+
+
+class StatsPoint(BaseModel):
+    """One day or week of `TodoStatsRead.series`, starting on `start`."""
+    start: date
+    created: int
+    completed: int
+
+
+class TodoStatsRead(BaseModel):
+    """Response of `GET /todos/stats`."""
+    open: int
+    done: int
+    completion_rate: float
+    period: str
+    series: List[StatsPoint]
+
+
+class TagCount(BaseModel):
+    """Entry of `GET /tags`: a tag and the number of todos carrying it."""
+    name: str
+    count: int
+
+
+class ListRole(str, Enum):
+    read = "read"
+    write = "write"
+
+
+class TodoListCreate(BaseModel):
+    name: str = Field(..., min_length=1, max_length=200)
+
+
+class TodoListRead(BaseModel):
+    """Shared list; `role` is the caller's: "owner", "write" or "read"."""
+    id: int
+    name: str
+    owner_id: int
+    created_at: datetime
+    role: Optional[str] = None
+
+    model_config = {"from_attributes": True}
+
+
+class ListMemberUpdate(BaseModel):
+    role: ListRole
+
+
+class ListMemberRead(BaseModel):
+    user_id: int
+    role: str
 
     model_config = {"from_attributes": True}
 
 
+class TodoMove(BaseModel):
+    """Target of `POST /todos/{id}/move`: the todos that end up directly
+    above (`after_id`) and below (`before_id`) it. One of them is enough.
+    """
+    after_id: Optional[int] = None
+    before_id: Optional[int] = None
+
+
 class TodoUpdate(BaseModel):
     """Schema for partial updates of a todo."""
     title: Optional[str] = None
     description: Optional[str] = None
     is_done: Optional[bool] = None
+    # replaces the todo's tags; [] removes all of them
+    tags: Optional[TagList] = None
+    # explicit null clears the date
+    due_at: Optional[datetime] = None
+    remind_at: Optional[datetime] = None
+    # moves the todo (with its subtasks) under another todo; null: top level
+    parent_id: Optional[int] = None
+    # moves the todo (with its subtasks) to another list of its owner; null: no list
+    list_id: Optional[int] = None
 
 
 class RefreshRequest(BaseModel):
@@ -86,6 +199,13 @@ class UserRead(BaseModel):
     model_config = {"from_attributes": True}
 
 
+class MeRead(BaseModel):
+    """`GET /me`: the public part of the principal (no session id or client IP)."""
+    id: int
+    email: str
+    scopes: List[str]
+
+
 class PasswordChange(BaseModel):
     current_password: str
     new_password: Annotated[str, Field(min_length=8)]
@@ -93,3 +213,40 @@ class PasswordChange(BaseModel):
 
 class PasswordResetRequest(BaseModel):
     email: EmailStr
+
+
+class AuditEventRead(BaseModel):
+    """Entry of `GET /admin/audit`."""
+    id: int
+    created_at: datetime
+    actor_id: Optional[int]
+    action: str
+    target_type: str
+    target_id: Optional[int]
+    data: Optional[dict]
+    ip_address: Optional[str]
+
+    model_config = {"from_attributes": True}
+
+
+class BatchOperation(BaseModel):
+    """One sub-request of `POST /batch`, e.g. {"method": "PATCH", "path": "/todos/5", "body": {...}}."""
+    method: str
+    path: str
+    body: Optional[dict] = None
+
+
+class BatchRequest(BaseModel):
+    operations: List[BatchOperation] = Field(..., min_length=1)
+    # all-or-nothing: one transaction, rolled back if any operation fails
+    atomic: bool = False
+
+
+class BatchResult(BaseModel):
+    status: int
+    body: Any = None
+
+
+class BatchResponse(BaseModel):
+    results: List[BatchResult]
+    committed: bool
@@ -0,0 +1,47 @@
+"""Backfill the `GET /todos/stats` rollups (todo_stats.py) for every user.
+
+Run once after deploying the application that maintains the rollups; it is
+safe to run again at any time. Each user is recomputed in a transaction of
+its own under the owner lock, so the application keeps serving meanwhile:
+
+    export DATABASE_URL=...
+    python scripts/backfill_todo_stats.py
+"""
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import select  # noqa: E402
+
+from db import AsyncSessionLocal, dispose_engines  # noqa: E402
+from models import User  # noqa: E402
+import crud  # noqa: E402,F401  (registers the flush hooks)
+from todo_stats import backfill  # noqa: E402
+
+# user ids read per query
+BATCH = int(os.environ.get("BACKFILL_BATCH", "500"))
+
+
+async def main():
+    last_id, done = 0, 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            ids = (
+                await db.execute(select(User.id).where(User.id > last_id).order_by(User.id).limit(BATCH))
+            ).scalars().all()
+        if not ids:
+            break
+        for user_id in ids:
+            async with AsyncSessionLocal() as db:
+                await backfill(db, user_id)
+                await db.commit()
+        done += len(ids)
+        last_id = ids[-1]
+        print(f"{done} users")
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
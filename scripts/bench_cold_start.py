@@ -0,0 +1,59 @@
+"""Benchmark: cold-start latency of the first requests after a deploy.
+
+Simulates a fresh worker: the pool is disposed, then a burst of concurrent
+hot lookups (user by email, todo by id, refresh token by hash) is fired and
+per-request latency is recorded. The run is repeated with `warm_up_pool`
+executed first, as `main.lifespan` does.
+
+    DATABASE_URL=postgresql+asyncpg://... python scripts/bench_cold_start.py
+
+Options: BENCH_CONCURRENCY (default 20), BENCH_ROUNDS (default 5).
+"""
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from db import AsyncSessionLocal, engine, warm_up_pool, DB_POOL_WARMUP  # noqa: E402
+from crud import prepare_hot_statements  # noqa: E402
+
+CONCURRENCY = int(os.environ.get("BENCH_CONCURRENCY", "20"))
+ROUNDS = int(os.environ.get("BENCH_ROUNDS", "5"))
+
+
+async def one_request() -> float:
+    start = time.perf_counter()
+    async with AsyncSessionLocal() as session:
+        await prepare_hot_statements(session)
+    return (time.perf_counter() - start) * 1000
+
+
+async def burst(warm: bool) -> list[float]:
+    await engine.dispose()
+    if warm:
+        await warm_up_pool(DB_POOL_WARMUP, prepare_hot_statements)
+    return await asyncio.gather(*(one_request() for _ in range(CONCURRENCY)))
+
+
+def p99(samples: list[float]) -> float:
+    return statistics.quantiles(samples, n=100)[98] if len(samples) > 1 else samples[0]
+
+
+async def main():
+    for warm in (False, True):
+        samples: list[float] = []
+        for _ in range(ROUNDS):
+            samples.extend(await burst(warm))
+        label = "warm" if warm else "cold"
+        print(
+            f"{label}: n={len(samples)} p50={statistics.median(samples):.2f}ms "
+            f"p99={p99(samples):.2f}ms max={max(samples):.2f}ms"
+        )
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,217 @@
+"""Benchmark: storage and lookup cost of the compact refresh-token layout.
+
+Writes BENCH_TOKENS sessions (spread over BENCH_USER_AGENTS distinct user
+agents) twice. One copy goes into `refresh_tokens` (compact layout: 32-byte
+hash, `user_agents` id, INET). The other goes into a scratch table with the
+previous layout (hex hash, user agent text, ip text). For both it reports:
+
+- bytes of the table, of all its indexes and of the token_hash index
+  (Postgres: pg_relation_size; SQLite: dbstat);
+- average row size (Postgres: pg_column_size);
+- buffers touched by one hash lookup (Postgres: EXPLAIN (ANALYZE, BUFFERS));
+- p50/p99 latency of BENCH_LOOKUPS hash lookups with the same Core query,
+  plus `crud.get_refresh_token_by_hash` (ORM, month-scoped) on the compact
+  layout.
+
+Run against a scratch database created by Alembic. On Postgres, run it on
+the non-partitioned layout:
+
+    export DATABASE_URL=sqlite+aiosqlite:///./bench.db   # or postgresql+asyncpg://...
+    alembic upgrade head
+    python scripts/bench_refresh_tokens.py
+"""
+import asyncio
+import json
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import (  # noqa: E402
+    Boolean, Column, Integer, MetaData, String, Table, Text, delete, insert, select, text,
+)
+
+from auth import generate_raw_refresh_token, hash_refresh_token, refresh_token_month  # noqa: E402
+from crud import get_refresh_token_by_hash, get_user_agent_id  # noqa: E402
+from db import AsyncSessionLocal, dispose_engines, engine, sqlite_writer  # noqa: E402
+from models import RefreshToken, User, UTCDateTime  # noqa: E402
+
+TOKENS = int(os.environ.get("BENCH_TOKENS", "100000"))
+USER_AGENTS = int(os.environ.get("BENCH_USER_AGENTS", "20"))
+LOOKUPS = int(os.environ.get("BENCH_LOOKUPS", "2000"))
+_CHUNK = 5000
+
+# DDL needs a writable engine; in SQLite mode `engine` only reads
+ddl_engine = sqlite_writer.engine if sqlite_writer is not None else engine
+legacy = Table(
+    "bench_refresh_tokens_legacy",
+    MetaData(),
+    Column("id", Integer, primary_key=True),
+    Column("user_id", Integer, nullable=False, index=True),
+    Column("token_hash", String(255), nullable=False, unique=True, index=True),
+    Column("issued_at", UTCDateTime()),
+    Column("expires_at", UTCDateTime(), nullable=False),
+    Column("last_used_at", UTCDateTime()),
+    Column("revoked", Boolean, default=False),
+    Column("device_id", String),
+    Column("device_type", String, index=True),
+    Column("user_agent", Text),
+    Column("ip_address", String(100)),
+    Column("replaced_by_id", Integer),
+)
+LAYOUTS = (
+    ("compact", "refresh_tokens", "ix_refresh_tokens_token_hash"),
+    ("legacy", legacy.name, "ix_bench_refresh_tokens_legacy_token_hash"),
+)
+
+
+async def run_ddl(fn) -> None:
+    if sqlite_writer is not None:
+        # the SQLite writer engine is sync
+        with ddl_engine.begin() as conn:
+            fn(conn)
+        return
+    async with ddl_engine.begin() as conn:
+        await conn.run_sync(fn)
+
+
+def user_agent(i: int) -> str:
+    return (
+        "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+        f"(KHTML, like Gecko) Chrome/{100 + i}.0.0.0 Safari/537.36"
+    )
+
+
+async def fill() -> tuple[int, list[tuple[str, bytes]]]:
+    """Write both copies; returns the bench user id and a sample of (raw, hash)."""
+    await run_ddl(legacy.metadata.create_all)
+    async with AsyncSessionLocal() as db:
+        user = User(email=f"bench+{time.time_ns()}@example.com", hashed_password="x", scopes=["user"])
+        db.add(user)
+        await db.flush()
+        agents = [user_agent(i) for i in range(USER_AGENTS)]
+        agent_ids = [await get_user_agent_id(db, ua) for ua in agents]
+        await db.commit()
+        user_id = user.id
+
+    now = datetime.now(timezone.utc)
+    sampled = set(random.sample(range(TOKENS), min(LOOKUPS, TOKENS)))
+    sample: list[tuple[str, bytes]] = []
+    for start in range(0, TOKENS, _CHUNK):
+        compact_rows, legacy_rows = [], []
+        for i in range(start, min(start + _CHUNK, TOKENS)):
+            issued_at = now - timedelta(minutes=i)
+            raw = generate_raw_refresh_token(issued_at)
+            token_hash = hash_refresh_token(raw)
+            if i in sampled:
+                sample.append((raw, token_hash))
+            common = {
+                "user_id": user_id,
+                "issued_at": issued_at,
+                "expires_at": issued_at + timedelta(days=30),
+                "revoked": i % 3 == 0,
+                "device_type": "web" if i % 2 else "mobile",
+            }
+            ip = f"10.{(i >> 16) & 255}.{(i >> 8) & 255}.{i & 255}"
+            compact_rows.append({**common, "token_hash": token_hash,
+                                 "user_agent_id": agent_ids[i % USER_AGENTS], "ip_address": ip})
+            legacy_rows.append({**common, "token_hash": token_hash.hex(),
+                                "user_agent": agents[i % USER_AGENTS], "ip_address": ip})
+        async with AsyncSessionLocal() as db:
+            await db.execute(insert(RefreshToken), compact_rows)
+            await db.execute(insert(legacy), legacy_rows)
+            await db.commit()
+    return user_id, sample
+
+
+async def sizes(db, table: str, hash_index: str) -> dict:
+    if db.bind.dialect.name == "postgresql":
+        await db.execute(text(f"ANALYZE {table}"))
+        row = (await db.execute(text(
+            f"SELECT pg_relation_size('{table}'), pg_indexes_size('{table}'), "
+            f"pg_relation_size('{hash_index}'), (SELECT avg(pg_column_size(t.*)) FROM {table} t)"
+        ))).one()
+        return {"table": row[0], "indexes": row[1], "hash index": row[2], "avg row": float(row[3] or 0)}
+    pages = dict((await db.execute(text("SELECT name, sum(pgsize) FROM dbstat GROUP BY name"))).all())
+    indexes = [name for (name,) in (await db.execute(text(
+        "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :t"), {"t": table}
+    )).all()]
+    return {
+        "table": pages.get(table, 0),
+        "indexes": sum(pages.get(name, 0) for name in indexes),
+        "hash index": pages.get(hash_index, 0),
+    }
+
+
+async def buffers(db, query) -> int:
+    """Shared buffers (hit + read) touched by one execution of `query` (Postgres)."""
+    compiled = query.compile(db.bind, compile_kwargs={"literal_binds": True})
+    plan = (await db.execute(text(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {compiled}"))).scalar()
+    plan = (json.loads(plan) if isinstance(plan, str) else plan)[0]["Plan"]
+    return plan["Shared Hit Blocks"] + plan["Shared Read Blocks"]
+
+
+async def lookups(sample: list[tuple[str, bytes]]) -> dict[str, list[float]]:
+    """Per-lookup ms: the same Core query on both layouts, and the crud helper."""
+    compact = RefreshToken.__table__
+    queries = {
+        "compact": lambda raw, h: select(compact).where(compact.c.token_hash == h),
+        "legacy": lambda raw, h: select(legacy).where(legacy.c.token_hash == h.hex()),
+    }
+    timings: dict[str, list[float]] = {"compact": [], "legacy": [], "crud": []}
+    async with AsyncSessionLocal() as db:
+        for raw, token_hash in sample:
+            for label, query in queries.items():
+                started = time.perf_counter()
+                assert (await db.execute(query(raw, token_hash))).first() is not None
+                timings[label].append((time.perf_counter() - started) * 1000)
+            started = time.perf_counter()
+            assert await get_refresh_token_by_hash(db, token_hash, refresh_token_month(raw)) is not None
+            timings["crud"].append((time.perf_counter() - started) * 1000)
+            db.expunge_all()
+        await db.rollback()
+    return timings
+
+
+def p99(samples: list[float]) -> float:
+    return statistics.quantiles(samples, n=100)[98] if len(samples) > 1 else samples[0]
+
+
+async def main():
+    user_id, sample = await fill()
+    timings = await lookups(sample)
+    async with AsyncSessionLocal() as db:
+        postgres = db.bind.dialect.name == "postgresql"
+        print(f"{TOKENS} sessions, {USER_AGENTS} user agents, {len(sample)} lookups")
+        for label, table, hash_index in LAYOUTS:
+            stats = await sizes(db, table, hash_index)
+            if postgres:
+                raw, token_hash = sample[0]
+                model = legacy if label == "legacy" else RefreshToken.__table__
+                value = token_hash.hex() if label == "legacy" else token_hash
+                stats["lookup buffers"] = await buffers(db, select(model).where(model.c.token_hash == value))
+            ms = timings[label]
+            print(
+                f"{label:<8} " + " ".join(f"{k}={v:.0f}" if isinstance(v, float) else f"{k}={v}" for k, v in stats.items())
+                + f" p50={statistics.median(ms):.3f}ms p99={p99(ms):.3f}ms"
+            )
+        ms = timings["crud"]
+        print(f"crud.get_refresh_token_by_hash (compact, ORM) p50={statistics.median(ms):.3f}ms p99={p99(ms):.3f}ms")
+        await db.rollback()
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(RefreshToken).where(RefreshToken.user_id == user_id))
+        await db.execute(delete(User).where(User.id == user_id))
+        await db.commit()
+    if sqlite_writer is not None:
+        # the writer task holds the only writer connection
+        await sqlite_writer.close()
+    await run_ddl(legacy.metadata.drop_all)
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
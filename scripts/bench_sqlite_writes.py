@@ -0,0 +1,59 @@
+"""Benchmark: write throughput of the SQLite single-writer mode.
+
+Fires BENCH_WRITES todo inserts from BENCH_CONCURRENCY concurrent sessions,
+each doing what a request does (own session, add, a read, BENCH_WORK_MS of
+other work, commit), and reports writes per second. Run against a scratch
+file created by Alembic:
+
+    export DATABASE_URL=sqlite+aiosqlite:///./bench.db
+    alembic upgrade head
+    python scripts/bench_sqlite_writes.py
+"""
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from sqlalchemy import func, select  # noqa: E402
+
+from db import AsyncSessionLocal, dispose_engines  # noqa: E402
+from models import Todo, User  # noqa: E402
+from positions import FIRST_KEY  # noqa: E402
+
+WRITES = int(os.environ.get("BENCH_WRITES", "5000"))
+CONCURRENCY = int(os.environ.get("BENCH_CONCURRENCY", "100"))
+# request-side work between the first change and the commit (rendering, other awaits)
+WORK_MS = float(os.environ.get("BENCH_WORK_MS", "0"))
+
+
+async def main():
+    async with AsyncSessionLocal() as session:
+        user = User(email=f"bench+{time.time_ns()}@example.com", hashed_password="x", scopes=["user"])
+        session.add(user)
+        await session.commit()
+        owner_id = user.id
+
+    remaining = WRITES
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            async with AsyncSessionLocal() as session:
+                session.add(Todo(title="bench", owner_id=owner_id, position=FIRST_KEY))
+                await session.execute(select(func.count()).select_from(User).where(User.id == owner_id))
+                if WORK_MS:
+                    await asyncio.sleep(WORK_MS / 1000)
+                await session.commit()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(CONCURRENCY)))
+    elapsed = time.perf_counter() - start
+    print(f"{WRITES} writes, concurrency={CONCURRENCY}, work={WORK_MS}ms: {elapsed:.2f}s, {WRITES / elapsed:.0f} writes/s")
+    await dispose_engines()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,68 @@
+"""Benchmark: encode CPU vs bytes on the wire for a page of todos.
+
+Builds a BENCH_TODOS-item `GET /todos` payload (exactly what the route hands
+to the response class) and, for every available wire format (JSON,
+MessagePack, CBOR) and content encoding (none, gzip, brotli), reports the
+body size and the time to encode + compress it. No database is needed:
+
+    python scripts/bench_wire_format.py
+"""
+import os
+import sys
+import time
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+
+import wire  # noqa: E402
+from schemas import TodoRead  # noqa: E402
+
+TODOS = int(os.environ.get("BENCH_TODOS", "500"))
+ROUNDS = int(os.environ.get("BENCH_ROUNDS", "200"))
+
+
+def page() -> list:
+    now = datetime.now(timezone.utc)
+    todos = [
+        TodoRead(
+            id=100000 + i,
+            title=f"Buy groceries #{i}",
+            description="milk, eggs, bread" if i % 3 else None,
+            owner_id=42,
+            is_done=i % 4 == 0,
+            created_at=now - timedelta(minutes=i),
+            updated_at=now - timedelta(seconds=i),
+        )
+        for i in range(TODOS)
+    ]
+    return jsonable_encoder(todos)
+
+
+def timed(fn) -> tuple[bytes, float]:
+    started = time.perf_counter()
+    for _ in range(ROUNDS):
+        out = fn()
+    return out, (time.perf_counter() - started) / ROUNDS
+
+
+def main():
+    content = page()
+    encodings = [None, "gzip"] + (["br"] if wire.brotli is not None else [])
+    print(f"{TODOS} todos, mean of {ROUNDS} rounds")
+    print(f"{'format':<22}{'encoding':<10}{'bytes':>10}{'encode ms':>12}")
+    for media, encode in wire.ENCODERS.items():
+        for encoding in encodings:
+            if encoding is None:
+                body, seconds = timed(lambda: encode(content))
+            else:
+                body, seconds = timed(lambda: wire.compress(encode(content), encoding))
+            print(f"{media:<22}{encoding or '-':<10}{len(body):>10}{seconds * 1000:>12.3f}")
+    missing = [name for name in ("msgpack", "cbor2", "brotli") if getattr(wire, name) is None]
+    if missing:
+        print("not installed (skipped):", ", ".join(missing))
+
+
+if __name__ == "__main__":
+    main()
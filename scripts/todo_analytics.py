@@ -0,0 +1,29 @@
+"""Print the admin analytics (analytics.py) as JSON, without the API.
+
+The same figures as `GET /admin/analytics`, computed fresh (no cache):
+
+    export DATABASE_URL=...
+    ANALYTICS_TOP=20 python scripts/todo_analytics.py
+"""
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from analytics import compute  # noqa: E402
+from db import AsyncSessionLocal, dispose_engines  # noqa: E402
+
+TOP = int(os.environ.get("ANALYTICS_TOP", "10"))
+
+
+async def main():
+    async with AsyncSessionLocal() as db:
+        result = await compute(db, TOP)
+    await dispose_engines()
+    print(json.dumps(result, indent=2, default=str))
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
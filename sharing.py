@@ -0,0 +1,131 @@
+"""Shared todo lists: who may read or change which todos.
+
+A `TodoList` groups todos of its owner (`Todo.list_id`). The owner shares it
+through `list_members` with a role: "read" or "write". The todos stay the
+owner's, so positions, tags, subtasks and delta sync keep working per owner;
+members follow each shared list in delta sync with a token of its own.
+
+Access is decided in SQL, never by looking at rows one by one in Python:
+
+- list queries add `visible(Todo, user_id)` (`writable` for writes):
+  `owner_id = :me OR list_id IN (SELECT list_id FROM list_members WHERE
+  user_id = :me)`. The subquery is one range of the (user_id, list_id)
+  primary key; the outer side uses ix_todos_list_id;
+- realtime events of a list's todos go to its members as well
+  (`with_list_members`, one query per publish);
+- checks of a single todo (`has_role`) need the caller's role in one list.
+  `ListAccess` looks it up once and keeps it in `db.info`: get_db opens one
+  session per request, and all operations of a `/batch` share it.
+"""
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy import or_, select
+
+from models import ListMember, TodoList
+
+# members are granted READ or WRITE (schemas.ListRole); the owner's role is implicit
+READ, WRITE, OWNER = "read", "write", "owner"
+_RANK = {READ: 1, WRITE: 2, OWNER: 3}
+
+
+def _is_admin(principal: dict) -> bool:
+    return "admin" in (principal.get("scopes") or [])
+
+
+def shared_lists(user_id: int, role: str = READ):
+    """Ids of the lists shared with `user_id` with at least `role`."""
+    q = select(ListMember.list_id).where(ListMember.user_id == user_id)
+    if role == WRITE:
+        q = q.where(ListMember.role == WRITE)
+    return q
+
+
+async def with_list_members(db, events: list[dict]) -> list[dict]:
+    """Add the members of each event's shared list to its recipients (realtime.py)."""
+    list_ids = {e["list_id"] for e in events if e.get("list_id") is not None}
+    if not list_ids:
+        return events
+    members = defaultdict(set)
+    rows = await db.execute(select(ListMember.list_id, ListMember.user_id).where(ListMember.list_id.in_(list_ids)))
+    for list_id, user_id in rows.all():
+        members[list_id].add(user_id)
+    return [{**e, "owner_ids": sorted({*e["owner_ids"], *members[e.get("list_id")]})} for e in events]
+
+
+def visible(model, user_id: int):
+    """WHERE clause: todos (`model`: Todo or TodoArchive) `user_id` may read."""
+    return or_(model.owner_id == user_id, model.list_id.in_(shared_lists(user_id)))
+
+
+def writable(model, user_id: int):
+    """WHERE clause: todos `user_id` may change."""
+    return or_(model.owner_id == user_id, model.list_id.in_(shared_lists(user_id, WRITE)))
+
+
+class ListAccess:
+    """Roles of one user in shared lists; each list is looked up once."""
+
+    def __init__(self, user_id: int):
+        self.user_id = user_id
+        self._roles: dict[int, Optional[str]] = {}
+
+    async def role(self, db, list_id: int) -> Optional[str]:
+        if list_id not in self._roles:
+            self._roles[list_id] = (
+                await db.execute(
+                    select(ListMember.role).where(ListMember.user_id == self.user_id, ListMember.list_id == list_id)
+                )
+            ).scalar()
+        return self._roles[list_id]
+
+    def forget(self, list_id: int) -> None:
+        self._roles.pop(list_id, None)
+
+
+def list_access(db, principal: dict) -> ListAccess:
+    """The `ListAccess` of `principal` for this session (i.e. this request)."""
+    cache = db.info.setdefault("list_access", {})
+    user_id = int(principal["id"])
+    if user_id not in cache:
+        cache[user_id] = ListAccess(user_id)
+    return cache[user_id]
+
+
+def forget_list(db, list_id: int) -> None:
+    """Drop cached roles in `list_id` after its members changed."""
+    for access in db.info.get("list_access", {}).values():
+        access.forget(list_id)
+
+
+async def role(db, principal: dict, owner_id: int, list_id: Optional[int]) -> Optional[str]:
+    """Role of `principal` for a todo or list of `owner_id` in `list_id`.
+
+    Owners and admins get OWNER; None means no access at all.
+    """
+    if owner_id == int(principal["id"]) or _is_admin(principal):
+        return OWNER
+    if list_id is None:
+        return None
+    return await list_access(db, principal).role(db, list_id)
+
+
+async def has_role(db, principal: dict, owner_id: int, list_id: Optional[int], needed: str) -> bool:
+    return _RANK.get(await role(db, principal, owner_id, list_id), 0) >= _RANK[needed]
+
+
+async def get_list(db, list_id: int) -> Optional[TodoList]:
+    return (await db.execute(select(TodoList).where(TodoList.id == list_id))).scalars().first()
+
+
+async def lists_of(db, user_id: int) -> list[tuple[TodoList, str]]:
+    """Lists `user_id` owns or is a member of, with their role, oldest first."""
+    owned = (await db.execute(select(TodoList).where(TodoList.owner_id == user_id))).scalars().all()
+    shared = (
+        await db.execute(
+            select(TodoList, ListMember.role)
+            .join(ListMember, ListMember.list_id == TodoList.id)
+            .where(ListMember.user_id == user_id)
+        )
+    ).all()
+    return sorted([(lst, OWNER) for lst in owned] + [tuple(row) for row in shared], key=lambda item: item[0].id)
@@ -0,0 +1,307 @@
+"""First-class SQLite mode: tuned pragmas, a read pool and a single writer.
+
+SQLite allows one writer at a time. With a plain pool every session that
+writes competes for the file lock and, in WAL mode, a transaction that read
+first and then tries to write fails immediately with "database is locked".
+Here all writes go through one dedicated connection owned by `SQLiteWriter`:
+
+- sessions read through the regular (reader) engine;
+- pending ORM changes are not flushed by queries (no autoflush before the
+  session holds the writer): they are written when the session commits.
+  The commit takes a *lease* on the writer connection, flushes inside a
+  SAVEPOINT of the writer's open transaction and gives the writer back, so
+  a session holds it only for its own INSERT/UPDATE/DELETE statements and
+  never while the request does other work;
+- an explicit `flush()` or a DML statement (e.g. `todo_sync.lock_todo_list`)
+  takes the lease right away and keeps it until commit/rollback: that is
+  the way to serialize a read-modify-write with the other writers;
+- the writer serves leases one after another from an asyncio queue and
+  commits the outer transaction once for everything that queued up in the
+  meantime (group commit, at most SQLITE_WRITE_BATCH sessions);
+  `commit()` of each session returns only after that outer COMMIT.
+
+The writer connection is a plain (sync) sqlite3 connection: statements of
+the lease holder run inline, which costs microseconds instead of a thread
+hop per statement, while BEGIN IMMEDIATE and COMMIT (which may wait for
+another process or run a WAL checkpoint) go to a worker thread.
+
+A failing session only rolls back its own savepoint; the rest of the batch
+is still committed.
+"""
+import asyncio
+import logging
+import os
+import re
+from typing import Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Connection, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
+from sqlalchemy.orm import Session
+from sqlalchemy.sql.elements import TextClause
+from sqlalchemy.util import await_only
+
+logger = logging.getLogger(__name__)
+
+SQLITE_READ_POOL_SIZE = int(os.environ.get("SQLITE_READ_POOL_SIZE", "8"))
+# Upper bound of sessions folded into one writer transaction
+SQLITE_WRITE_BATCH = int(os.environ.get("SQLITE_WRITE_BATCH", "64"))
+SQLITE_MMAP_SIZE = int(os.environ.get("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+WRITER_INFO_KEY = "sqlite_writer"
+LEASE_INFO_KEY = "sqlite_writer_lease"
+
+_WRITE_SQL = re.compile(r"^\s*(insert|update|delete|replace|create|drop|alter)\b", re.IGNORECASE)
+
+
+def is_sqlite_file(url: str) -> bool:
+    """True for SQLite URLs that point to a file (not `:memory:`)."""
+    u = make_url(url)
+    return u.get_backend_name() == "sqlite" and u.database not in (None, "", ":memory:")
+
+
+def apply_pragmas(sync_engine, *, writer: bool) -> None:
+    """Register a connect hook that tunes every new SQLite connection.
+
+    Reader connections are additionally marked `query_only` so a statement
+    routed to them by mistake fails loudly instead of taking the write lock.
+    The writer connection switches the driver to manual transaction control
+    (needed for SAVEPOINT) and starts transactions with BEGIN IMMEDIATE.
+    """
+
+    @event.listens_for(sync_engine, "connect")
+    def _on_connect(dbapi_connection, connection_record):
+        if writer:
+            dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+        cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.execute("PRAGMA temp_store=MEMORY")
+        if not writer:
+            cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    if writer:
+
+        @event.listens_for(sync_engine, "begin")
+        def _on_begin(conn):
+            conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+
+def _is_write(clause) -> bool:
+    if clause is None:
+        return False
+    if getattr(clause, "is_dml", False) or getattr(clause, "is_ddl", False):
+        return True
+    return isinstance(clause, TextClause) and bool(_WRITE_SQL.match(clause.text))
+
+
+class _Lease:
+    """One session's turn on the writer connection."""
+
+    __slots__ = ("granted", "finished", "durable", "connection")
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.granted = loop.create_future()
+        self.finished = loop.create_future()
+        self.durable = loop.create_future()
+        self.connection: Optional[Connection] = None
+
+
+class SQLiteWriter:
+    """Owner of the single SQLite writer connection.
+
+    `engine` is a sync engine with a single connection. The serving task is
+    started lazily on first use (and restarted if the event loop changed,
+    e.g. between test clients); `close()` stops it.
+    """
+
+    def __init__(self, engine: Engine, batch_size: int = SQLITE_WRITE_BATCH):
+        self.engine = engine
+        self.batch_size = batch_size
+        self._queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+
+    def _ensure_started(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._task is not None and not self._task.done() and self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue()
+        self._task = loop.create_task(self._run(), name="sqlite-writer")
+
+    async def acquire(self, session: Session) -> Connection:
+        """Wait for the writer connection and attach it to `session`."""
+        self._ensure_started()
+        lease = _Lease(self._loop)
+        self._queue.put_nowait(lease)
+        try:
+            lease.connection = await lease.granted
+        except asyncio.CancelledError:
+            if lease.granted.done() and not lease.granted.cancelled():
+                # granted right before the cancellation: hand the turn back
+                lease.finished.set_result(False)
+            raise
+        session.info[LEASE_INFO_KEY] = lease
+        return lease.connection
+
+    async def release(self, session: Session, wrote: bool) -> None:
+        """Give the writer connection back.
+
+        `wrote=True` means the session's savepoint was released and its
+        changes must become durable: wait for the batch COMMIT.
+        """
+        lease = session.info.pop(LEASE_INFO_KEY, None)
+        if lease is None:
+            return
+        if not lease.finished.done():
+            lease.finished.set_result(wrote)
+        if wrote:
+            await lease.durable
+
+    async def close(self) -> None:
+        if self._task is None or self._task.done():
+            return
+        self._queue.put_nowait(None)
+        await self._task
+        self._task = None
+
+    async def _run(self) -> None:
+        queue = self._queue
+        try:
+            await self._serve(queue)
+        except Exception as exc:
+            logger.exception("SQLite writer stopped")
+            # fail everybody still waiting so requests do not hang
+            while not queue.empty():
+                lease = queue.get_nowait()
+                if lease is not None and not lease.granted.done():
+                    lease.granted.set_exception(exc)
+            raise
+
+    async def _serve(self, queue: asyncio.Queue) -> None:
+        conn = await asyncio.to_thread(self.engine.connect)
+        try:
+            while True:
+                lease = await queue.get()
+                if lease is None:
+                    return
+                # BEGIN IMMEDIATE may wait for another process (busy_timeout)
+                await asyncio.to_thread(conn.begin)
+                served: list[_Lease] = []
+                stop = False
+                while lease is not None:
+                    if not lease.granted.cancelled():
+                        lease.granted.set_result(conn)
+                        if await lease.finished:
+                            served.append(lease)
+                    if len(served) >= self.batch_size or queue.empty():
+                        break
+                    lease = queue.get_nowait()
+                    if lease is None:
+                        stop = True
+                try:
+                    # COMMIT may run a WAL checkpoint: off the event loop
+                    await asyncio.to_thread(conn.commit)
+                except Exception as exc:
+                    logger.exception("SQLite group commit failed (%d sessions)", len(served))
+                    await asyncio.to_thread(conn.rollback)
+                    for item in served:
+                        if not item.durable.done():
+                            item.durable.set_exception(exc)
+                else:
+                    for item in served:
+                        if not item.durable.done():
+                            item.durable.set_result(None)
+                if stop:
+                    return
+        finally:
+            await asyncio.to_thread(conn.close)
+
+
+class WriterRoutingSession(Session):
+    """Sync session that sends reads to the pool and writes to the writer."""
+
+    def _autoflush(self) -> None:
+        # pending ORM changes wait for commit() instead of taking the writer
+        # at the first query; only an explicit flush() or DML takes it early
+        if self.info.get(WRITER_INFO_KEY) is not None and LEASE_INFO_KEY not in self.info:
+            return
+        super()._autoflush()
+
+    def get_bind(self, mapper=None, *, clause=None, **kw):
+        writer = self.info.get(WRITER_INFO_KEY)
+        if writer is not None:
+            lease = self.info.get(LEASE_INFO_KEY)
+            if lease is None and (self._flushing or _is_write(clause)):
+                # get_bind is sync, but AsyncSession runs it inside a greenlet
+                # so we can wait for our turn here.
+                await_only(writer.acquire(self))
+                lease = self.info[LEASE_INFO_KEY]
+            if lease is not None:
+                # once leased, reads must see the session's own writes
+                return lease.connection
+        return super().get_bind(mapper, clause=clause, **kw)
+
+
+class QueuedWriteSession(AsyncSession):
+    """AsyncSession whose commits go through the SQLite writer queue."""
+
+    sync_session_class = WriterRoutingSession
+
+    def _writer(self) -> Optional[SQLiteWriter]:
+        return self.sync_session.info.get(WRITER_INFO_KEY)
+
+    async def commit(self) -> None:
+        writer = self._writer()
+        if writer is None:
+            return await super().commit()
+        s = self.sync_session
+        if LEASE_INFO_KEY not in s.info:
+            if not (s.new or s.dirty or s.deleted):
+                # read-only transaction: nothing to send to the writer
+                return await super().commit()
+            await writer.acquire(s)
+        try:
+            await super().commit()
+        except BaseException:
+            await self.rollback()
+            raise
+        await writer.release(s, wrote=True)
+
+    async def rollback(self) -> None:
+        try:
+            await super().rollback()
+        finally:
+            writer = self._writer()
+            if writer is not None:
+                await writer.release(self.sync_session, wrote=False)
+
+    async def close(self) -> None:
+        try:
+            await super().close()
+        finally:
+            writer = self._writer()
+            if writer is not None:
+                await writer.release(self.sync_session, wrote=False)
+
+
+def create_sqlite_engines(url: str, **options) -> tuple[AsyncEngine, SQLiteWriter]:
+    """Create the reader engine and the writer for a file-backed SQLite URL.
+
+    The writer gets a sync pysqlite engine on the same file; its connection
+    is used from the event loop and from worker threads (never at once).
+    """
+    reader = create_async_engine(url, pool_size=SQLITE_READ_POOL_SIZE, max_overflow=0, **options)
+    apply_pragmas(reader.sync_engine, writer=False)
+    writer_url = make_url(url).set(drivername="sqlite+pysqlite")
+    writer_engine = create_engine(
+        writer_url, pool_size=1, max_overflow=0, connect_args={"check_same_thread": False}, **options
+    )
+    apply_pragmas(writer_engine, writer=True)
+    return reader, SQLiteWriter(writer_engine)
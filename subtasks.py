@@ -0,0 +1,140 @@
+"""Subtasks: todo trees with a materialized path and maintained progress.
+
+`Todo.parent_id` makes a todo a subtask of another todo of the same owner.
+`Todo.path` lists the ancestor ids, root first: "/12/40/" for a todo under
+40, which is under 12; "/" for a top-level todo. The path gives the
+ancestors and the depth without a query, and turns the cycle check of a
+re-parent into a string test. A whole subtree is read with one recursive
+CTE over ix_todos_parent_id (`subtree`), however deep it is.
+
+Each todo keeps the progress of its direct subtasks in `subtasks_total` /
+`subtasks_done`. A before_flush hook maintains them with `+ delta` updates,
+like the tag counts in tags.py. It fires on every flush that adds, deletes,
+completes, reopens or re-parents a subtask, so complete / reopen / PATCH /
+bulk_complete need no code of their own. The same UPDATE gives the parent a
+new change_seq (todo_sync.py), so delta sync sees the new counts.
+"""
+from collections import defaultdict
+from itertools import groupby
+from typing import Optional
+
+from sqlalchemy import bindparam, event, func, inspect, literal, select, update
+from sqlalchemy.orm import Session
+
+from models import Todo
+from todo_sync import bump_todo_seq
+
+
+def child_path(parent: Optional[Todo]) -> str:
+    """`path` of a direct subtask of `parent` (None: top level)."""
+    return "/" if parent is None else f"{parent.path}{parent.id}/"
+
+
+def depth(todo: Todo) -> int:
+    """0 for a top-level todo, 1 for its subtasks, and so on."""
+    return todo.path.count("/") - 1
+
+
+async def subtree(db, todo_id: int) -> list[Todo]:
+    """`todo_id` and all its descendants in one query, parents before children."""
+    tree = select(Todo.id).where(Todo.id == todo_id).cte("subtree", recursive=True)
+    tree = tree.union_all(select(Todo.id).where(Todo.parent_id == tree.c.id))
+    q = select(Todo).where(Todo.id.in_(select(tree.c.id))).order_by(Todo.position, Todo.id)
+    # stable sort: manual order within each level
+    return sorted((await db.execute(q)).scalars().all(), key=depth)
+
+
+async def set_parent(db, todo: Todo, parent: Optional[Todo], nodes: Optional[list[Todo]] = None) -> None:
+    """Move `todo` with its subtree under `parent` (None: top level).
+
+    `nodes` is `subtree(db, todo.id)` if the caller already has it. Raises
+    ValueError if `parent` is the todo itself or one of its descendants.
+    """
+    if parent is not None and (parent.id == todo.id or f"/{todo.id}/" in parent.path):
+        raise ValueError("a todo cannot be moved under itself or its subtasks")
+    new_path = child_path(parent)
+    if todo.path != new_path:
+        old_prefix, new_prefix = f"{todo.path}{todo.id}/", f"{new_path}{todo.id}/"
+        descendant_ids = [t.id for t in (nodes if nodes is not None else await subtree(db, todo.id)) if t.id != todo.id]
+        if descendant_ids:
+            await db.execute(
+                update(Todo)
+                .where(Todo.id.in_(descendant_ids))
+                .values(path=literal(new_prefix).concat(func.substr(Todo.path, len(old_prefix) + 1)))
+                .execution_options(synchronize_session="fetch")
+            )
+        todo.path = new_path
+    todo.parent_id = parent.id if parent is not None else None
+
+
+async def delete_subtree(db, todo: Todo, nodes: Optional[list[Todo]] = None) -> list[Todo]:
+    """ORM-delete `todo` and its descendants, deepest level first; returns them.
+
+    `nodes` is `subtree(db, todo.id)` if the caller already has it. Row by
+    row so the flush hooks see every todo (tombstones, tag counts); level by
+    level so no row is removed by the FK cascade behind the ORM's back.
+    """
+    if nodes is None:
+        nodes = await subtree(db, todo.id)
+    for _, level in groupby(reversed(nodes), key=depth):
+        for node in level:
+            await db.delete(node)
+        await db.flush()
+    return nodes
+
+
+@event.listens_for(Session, "before_flush")
+def _maintain_progress(session, flush_context, instances) -> None:
+    # parent id -> [owner, total delta, done delta]
+    delta: dict[int, list] = defaultdict(lambda: [None, 0, 0])
+
+    def count(parent_id, owner_id, done, sign):
+        if parent_id is None:
+            return
+        entry = delta[parent_id]
+        entry[0] = owner_id
+        entry[1] += sign
+        entry[2] += sign if done else 0
+
+    for obj in session.new:
+        if isinstance(obj, Todo):
+            count(obj.parent_id, obj.owner_id, obj.is_done, 1)
+    for obj in session.dirty:
+        if not isinstance(obj, Todo):
+            continue
+        state = inspect(obj)
+        parent, done = state.attrs.parent_id.history, state.attrs.is_done.history
+        if not parent.has_changes() and not done.has_changes():
+            continue
+        old_parent = parent.deleted[0] if parent.deleted else obj.parent_id
+        old_done = done.deleted[0] if done.deleted else obj.is_done
+        owner = state.attrs.owner_id.history
+        old_owner = owner.deleted[0] if owner.deleted else obj.owner_id
+        count(old_parent, old_owner, old_done, -1)
+        count(obj.parent_id, obj.owner_id, obj.is_done, 1)
+    for obj in session.deleted:
+        if isinstance(obj, Todo):
+            count(obj.parent_id, obj.owner_id, obj.is_done, -1)
+
+    changed = {pid: d for pid, d in delta.items() if d[1] or d[2]}
+    if not changed:
+        return
+    rows = []
+    # same lock order as todo_sync's hook
+    for owner_id, items in groupby(sorted(changed.items(), key=lambda kv: (kv[1][0], kv[0])), key=lambda kv: kv[1][0]):
+        items = list(items)
+        seq = bump_todo_seq(session, owner_id, len(items)) - len(items)
+        for parent_id, (_, total, done) in items:
+            seq += 1
+            rows.append({"pid": parent_id, "dt": total, "dd": done, "seq": seq})
+    table = Todo.__table__
+    session.execute(
+        table.update()
+        .where(table.c.id == bindparam("pid"))
+        .values(
+            subtasks_total=table.c.subtasks_total + bindparam("dt"),
+            subtasks_done=table.c.subtasks_done + bindparam("dd"),
+            change_seq=bindparam("seq"),
+        ),
+        rows,
+    )
@@ -0,0 +1,110 @@
+"""Todo tags: normalization, lookup and maintained per-tag counts.
+
+Tags belong to an owner (`tags`, unique on (owner_id, name)) and are linked
+to todos through `todo_tags`. Names are normalized by `normalize_tags`:
+stripped, lower-cased, without a leading "#", de-duplicated.
+
+`Tag.todo_count` is kept up to date by a before_flush hook, like the change
+sequence in todo_sync.py. Every ORM flush that adds or removes tags, deletes
+tagged todos or moves them to another owner adjusts the counters with
+`todo_count = todo_count + delta`. Concurrent writers therefore never lose
+increments, and `GET /tags` reads the counters instead of counting rows.
+When a todo changes owner, its tags are re-created in the new owner's
+namespace under the same names.
+"""
+from collections import Counter
+from typing import Iterable, Optional
+
+from sqlalchemy import bindparam, event, func, inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from models import Tag, Todo, todo_tags
+
+
+def normalize_tags(names: Optional[Iterable[str]]) -> list[str]:
+    """Normalized, de-duplicated tag names in their original order; blanks are dropped."""
+    result: list[str] = []
+    for name in names or ():
+        name = " ".join(name.strip().lstrip("#").lower().split())
+        if name and name not in result:
+            result.append(name)
+    return result
+
+
+def _resolve(session: Session, owner_id: int, names: list[str]) -> list[Tag]:
+    """Tag rows for `names` of `owner_id`, creating missing ones."""
+    if not names:
+        return []
+    found = {t.name: t for t in session.execute(
+        select(Tag).where(Tag.owner_id == owner_id, Tag.name.in_(names))
+    ).scalars()}
+    missing = [n for n in names if n not in found]
+    if missing:
+        # ON CONFLICT DO NOTHING: a concurrent request may create the same tag
+        insert = pg_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+        session.execute(
+            insert(Tag)
+            .values([{"owner_id": owner_id, "name": n, "todo_count": 0} for n in missing])
+            .on_conflict_do_nothing(index_elements=["owner_id", "name"])
+        )
+        found.update((t.name, t) for t in session.execute(
+            select(Tag).where(Tag.owner_id == owner_id, Tag.name.in_(missing))
+        ).scalars())
+    return [found[n] for n in names]
+
+
+async def resolve_tags(db, owner_id: int, names: list[str]) -> list[Tag]:
+    """Async wrapper of `_resolve` for the routes; `names` must be normalized."""
+    return await db.run_sync(_resolve, owner_id, names)
+
+
+def tag_filter(names: list[str], mode: str = "any", owner_id: Optional[int] = None):
+    """WHERE clause for todos tagged with any / all of `names`.
+
+    Resolves names to tag ids through uq_tags_owner_name and todo ids through
+    the (tag_id, todo_id) primary key of todo_tags; "all" keeps the todos
+    that matched every name.
+    """
+    sub = select(todo_tags.c.todo_id).join(Tag, Tag.id == todo_tags.c.tag_id).where(Tag.name.in_(names))
+    if owner_id is not None:
+        sub = sub.where(Tag.owner_id == owner_id)
+    if mode == "all":
+        sub = sub.group_by(todo_tags.c.todo_id).having(func.count() == len(names))
+    return Todo.id.in_(sub)
+
+
+@event.listens_for(Session, "before_flush")
+def _maintain_tag_counts(session, flush_context, instances) -> None:
+    delta: Counter = Counter()
+    for obj in session.new:
+        if isinstance(obj, Todo):
+            for tag in obj.tags:
+                delta[tag.id] += 1
+    for obj in session.dirty:
+        if not isinstance(obj, Todo):
+            continue
+        state = inspect(obj)
+        previous = state.attrs.owner_id.history.deleted
+        if previous and previous[0] != obj.owner_id and obj.tags:
+            obj.tags = _resolve(session, obj.owner_id, [t.name for t in obj.tags])
+        history = state.attrs.tags.history
+        for tag in history.added:
+            delta[tag.id] += 1
+        for tag in history.deleted:
+            delta[tag.id] -= 1
+    for obj in session.deleted:
+        if isinstance(obj, Todo):
+            history = inspect(obj).attrs.tags.load_history()
+            for tag in (*history.unchanged, *history.deleted):
+                delta[tag.id] -= 1
+    rows = [{"tag_id": tag_id, "delta": d} for tag_id, d in sorted(delta.items()) if d]
+    if rows:
+        table = Tag.__table__
+        session.execute(
+            table.update()
+            .where(table.c.id == bindparam("tag_id"))
+            .values(todo_count=table.c.todo_count + bindparam("delta")),
+            rows,
+        )
@@ -1,12 +1,81 @@
+import asyncio
+import uuid
 
 import pytest
 from fastapi.testclient import TestClient
+from sqlalchemy import update
+from sqlalchemy.orm import sessionmaker
 
 # Import the FastAPI app
+from db import AsyncSessionLocal, Base
+from emailer import wait_for
 from main import app
+from models import User
+from sqlite_mode import WRITER_INFO_KEY, QueuedWriteSession, create_sqlite_engines
+
+PASSWORD = "s3cretpass"
+
 
 @pytest.fixture(scope="session")
 def client():
     """Provide a TestClient for the app."""
     with TestClient(app) as c:
         yield c
+
+
+@pytest.fixture
+def auth_headers(client):
+    """Factory: register and verify a fresh user, return its bearer headers.
+
+    `admin=True` grants the admin scope before logging in (scopes live in
+    the token). Pass `email` when the test needs the address, e.g. to read
+    the mails sent to it.
+    """
+
+    def login(admin=False, email=None):
+        email = email or f"user+{uuid.uuid4().hex}@example.com"
+        assert client.post("/register", json={"email": email, "password": PASSWORD}).status_code == 201
+        assert client.get(f"/verify-email?token={wait_for(email)['token']}").status_code == 200
+        if admin:
+            async def promote():
+                async with AsyncSessionLocal() as db:
+                    await db.execute(update(User).where(User.email == email).values(scopes=["user", "admin"]))
+                    await db.commit()
+
+            client.portal.call(promote)
+        access = client.post("/token", json={"username": email, "password": PASSWORD}).json()["access_token"]
+        return {"Authorization": f"Bearer {access}"}
+
+    return login
+
+
+@pytest.fixture
+def run_on_sqlite(tmp_path):
+    """Run `scenario(factory)` against a fresh SQLite file in SQLite mode.
+
+    `factory` makes sessions wired to the writer like db.py does; engines
+    and the writer are closed afterwards. Returns what the scenario returns.
+    """
+
+    def run(scenario):
+        async def main():
+            reader, writer = create_sqlite_engines(f"sqlite+aiosqlite:///{tmp_path / 'app.db'}")
+            with writer.engine.begin() as conn:
+                Base.metadata.create_all(conn)
+            factory = sessionmaker(
+                reader,
+                expire_on_commit=False,
+                class_=QueuedWriteSession,
+                info={WRITER_INFO_KEY: writer},
+                join_transaction_mode="create_savepoint",
+            )
+            try:
+                return await scenario(factory)
+            finally:
+                await writer.close()
+                writer.engine.dispose()
+                await reader.dispose()
+
+        return asyncio.run(main())
+
+    return run
@@ -0,0 +1,43 @@
+import numpy as np
+
+from analytics import PERCENTILES, _Accumulator
+
+
+def test_percentiles_from_chunks_match_numpy():
+    rng = np.random.default_rng(7)
+    seconds = rng.lognormal(mean=9, sigma=2, size=20_000)
+    acc = _Accumulator()
+    for start in range(0, seconds.size, 3_000):
+        part = seconds[start:start + 3_000]
+        acc.add([(1, start + i, 1, s) for i, s in enumerate(part)] + [(2, 0, 0, None)], live=False)
+    for q in PERCENTILES:
+        assert abs(acc.percentiles()[f"p{q}"] - np.percentile(seconds, q)) / np.percentile(seconds, q) < 0.01
+    assert acc.top(1) == [{"owner_id": 1, "todos": 20_000, "done": 20_000}]
+    assert int(acc.buckets.sum()) == 20_000
+
+
+def test_admin_analytics_endpoint_is_cached(client, auth_headers):
+    headers, other, admin = auth_headers(), auth_headers(), auth_headers(admin=True)
+    owner_id, other_id = (client.get("/me", headers=h).json()["id"] for h in (headers, other))
+    ids = [client.post("/todos", json={"title": t}, headers=headers).json()["id"] for t in "abc"]
+    for todo_id in ids[:2]:
+        assert client.post(f"/todos/{todo_id}/complete", headers=headers).status_code == 200
+    assert client.post(f"/todos/{ids[2]}/assign?assignee_id={other_id}", headers=headers).status_code == 200
+
+    assert client.get("/admin/analytics", headers=headers).status_code == 403
+    first = client.get("/admin/analytics", params={"top": 100, "refresh": "true"}, headers=admin).json()
+    owners = {o["owner_id"]: o for o in first["busiest_owners"]}
+    assert (owners[owner_id]["todos"], owners[owner_id]["done"]) == (2, 2)
+    assert first["reassigned"]["todos"] >= 1 and 0 < first["reassigned"]["share"] <= 1
+    ttc = first["time_to_completion"]
+    assert ttc["count"] >= 2 and sum(b["count"] for b in ttc["histogram"]) == ttc["count"]
+    assert ttc["histogram"][0]["count"] >= 2 and ttc["histogram"][-1]["le_seconds"] is None
+
+    client.post("/todos", json={"title": "d"}, headers=headers)
+    cached = client.get("/admin/analytics", params={"top": 100}, headers=admin).json()
+    assert cached == first
+    fresh = client.get("/admin/analytics", params={"top": 100, "refresh": "true"}, headers=admin).json()
+    assert fresh["todos"] == first["todos"] + 1
+    # any other top is a slice of the same cached scan
+    one = client.get("/admin/analytics", params={"top": 1}, headers=admin).json()
+    assert one == {**fresh, "busiest_owners": fresh["busiest_owners"][:1]}
@@ -0,0 +1,71 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update
+
+from archive import archiver
+from db import AsyncSessionLocal
+from models import Todo
+
+
+def test_old_completed_todos_move_to_archive_and_stay_readable(client, auth_headers):
+    headers = auth_headers()
+    old = client.post("/todos", json={"title": "old", "tags": ["done"]}, headers=headers).json()
+    recent = client.post("/todos", json={"title": "recent"}, headers=headers).json()
+    client.post("/todos", json={"title": "open"}, headers=headers)
+    for todo in (old, recent):
+        assert client.post(f"/todos/{todo['id']}/complete", headers=headers).status_code == 200
+    token = client.get("/todos/changes", headers=headers).json()["next_token"]
+
+    async def backdate():
+        async with AsyncSessionLocal() as db:
+            long_ago = datetime.now(timezone.utc) - timedelta(days=archiver.after_days + 1)
+            await db.execute(update(Todo).where(Todo.id == old["id"]).values(completed_at=long_ago))
+            await db.commit()
+
+    client.portal.call(backdate)
+    assert client.portal.call(archiver.run_once) >= 1
+
+    assert sorted(t["title"] for t in client.get("/todos", headers=headers).json()) == ["open", "recent"]
+    everything = client.get("/todos", params={"include_archived": "true", "sort_by": "id"}, headers=headers).json()
+    assert [t["title"] for t in everything] == ["old", "recent", "open"]
+    assert everything[0]["archived_at"] is not None and everything[0]["tags"] == ["done"]
+    by_position = client.get("/todos", params={"include_archived": "true", "sort_by": "position"}, headers=headers)
+    assert [t["title"] for t in by_position.json()] == ["old", "recent", "open"]
+
+    archived = client.get(f"/todos/{old['id']}", headers=headers)
+    assert archived.status_code == 200 and archived.json()["title"] == "old"
+    assert client.get("/tags", headers=headers).json() == []
+    assert client.get("/todos/changes", params={"since": token}, headers=headers).json()["deleted"] == [old["id"]]
+
+
+def test_subtasks_are_archived_with_their_finished_tree_only(client, auth_headers):
+    headers = auth_headers()
+    parent = client.post("/todos", json={"title": "trip"}, headers=headers).json()["id"]
+    done, pending = (
+        client.post("/todos", json={"title": title, "parent_id": parent}, headers=headers).json()["id"]
+        for title in ("tickets", "hotel")
+    )
+    assert client.post(f"/todos/{done}/complete", headers=headers).status_code == 200
+
+    async def backdate(*ids):
+        async with AsyncSessionLocal() as db:
+            long_ago = datetime.now(timezone.utc) - timedelta(days=archiver.after_days + 1)
+            await db.execute(update(Todo).where(Todo.id.in_(ids)).values(completed_at=long_ago))
+            await db.commit()
+
+    # a done subtask of an open parent stays put
+    client.portal.call(backdate, done)
+    client.portal.call(archiver.run_once)
+    tree = client.get(f"/todos/{parent}/tree", headers=headers).json()
+    assert [c["id"] for c in tree["children"]] == [done, pending]
+    assert (tree["subtasks_total"], tree["subtasks_done"]) == (2, 1)
+
+    # once the whole tree is done, it moves as one
+    for todo_id in (pending, parent):
+        assert client.post(f"/todos/{todo_id}/complete", headers=headers).status_code == 200
+    client.portal.call(backdate, parent)
+    client.post("/todos", json={"title": "next"}, headers=headers)
+    assert client.portal.call(archiver.run_once) >= 3
+    assert [t["title"] for t in client.get("/todos", headers=headers).json()] == ["next"]
+    for todo_id in (parent, done, pending):
+        assert client.get(f"/todos/{todo_id}", headers=headers).json()["archived_at"] is not None
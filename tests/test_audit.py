@@ -0,0 +1,36 @@
+from audit import AuditLog, audit_log
+
+
+def test_todo_changes_are_audited_and_paged(client, auth_headers):
+    headers = {**auth_headers(), "X-Forwarded-For": "198.51.100.4"}
+    admin = auth_headers(admin=True)
+    user_id = client.get("/me", headers=headers).json()["id"]
+    todo = client.post("/todos", json={"title": "secret"}, headers=headers).json()
+    assert client.post(f"/todos/{todo['id']}/complete", headers=headers).status_code == 200
+    assert client.delete(f"/todos/{todo['id']}", headers=headers).status_code == 200
+    while client.portal.call(audit_log.flush):
+        pass
+
+    assert client.get("/admin/audit", headers=headers).status_code == 403
+    assert client.get("/admin/audit", params={"target_id": todo["id"]}, headers=admin).status_code == 400
+    params = {"target_type": "todo", "target_id": todo["id"], "limit": 2}
+    first = client.get("/admin/audit", params=params, headers=admin)
+    assert [e["action"] for e in first.json()] == ["todo.deleted", "todo.completed"]
+    deleted = first.json()[0]
+    assert deleted["actor_id"] == user_id and deleted["ip_address"] == "198.51.100.4"
+    assert deleted["data"]["title"] == "secret"
+
+    rest = client.get("/admin/audit", params={**params, "cursor": first.headers["x-next-cursor"]}, headers=admin)
+    assert [e["action"] for e in rest.json()] == ["todo.created"]
+    assert "x-next-cursor" not in rest.headers
+
+
+def test_overflow_policy_bounds_the_buffer():
+    def run(policy):
+        log = AuditLog(max_pending=3, overflow=policy)
+        for i in range(5):
+            log.record("todo.created", 1, "todo", i)
+        return [e["target_id"] for e in log._pending], log.dropped
+
+    assert run("drop_oldest") == ([2, 3, 4], 2)
+    assert run("drop_newest") == ([0, 1, 2], 2)
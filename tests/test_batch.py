@@ -0,0 +1,92 @@
+from sqlalchemy.exc import OperationalError
+
+import routes
+from models import Todo
+
+
+def test_batch_runs_operations_in_order_with_per_operation_status(client, auth_headers):
+    headers = auth_headers()
+    todo_id = client.post("/todos", json={"title": "a"}, headers=headers).json()["id"]
+
+    resp = client.post(
+        "/batch",
+        json={
+            "operations": [
+                {"method": "PATCH", "path": f"/todos/{todo_id}", "body": {"title": "b"}},
+                {"method": "POST", "path": f"/todos/{todo_id}/complete"},
+                {"method": "GET", "path": "/todos/999999999"},
+                {"method": "POST", "path": "/todos", "body": {"title": "new"}},
+                {"method": "PUT", "path": "/todos"},
+            ]
+        },
+        headers=headers,
+    )
+    assert resp.status_code == 200
+    results = resp.json()["results"]
+    assert [r["status"] for r in results] == [200, 200, 404, 200, 405]
+    assert results[0]["body"]["title"] == "b"
+    assert results[3]["body"]["title"] == "new"
+    assert client.get(f"/todos/{todo_id}", headers=headers).json()["is_done"] is True
+
+
+def test_atomic_batch_rolls_back_on_failure(client, auth_headers):
+    headers = auth_headers()
+    todo_id = client.post("/todos", json={"title": "keep"}, headers=headers).json()["id"]
+
+    resp = client.post(
+        "/batch",
+        json={
+            "atomic": True,
+            "operations": [
+                {"method": "PATCH", "path": f"/todos/{todo_id}", "body": {"title": "changed"}},
+                {"method": "DELETE", "path": "/todos/999999999"},
+                {"method": "POST", "path": "/todos", "body": {"title": "never"}},
+            ],
+        },
+        headers=headers,
+    )
+    body = resp.json()
+    assert body["committed"] is False
+    assert [r["status"] for r in body["results"]] == [200, 404, 424]
+    assert client.get(f"/todos/{todo_id}", headers=headers).json()["title"] == "keep"
+    titles = [t["title"] for t in client.get("/todos", headers=headers).json()]
+    assert "never" not in titles
+
+    resp = client.post(
+        "/batch",
+        json={"atomic": True, "operations": [{"method": "PATCH", "path": f"/todos/{todo_id}", "body": {"title": "ok"}}]},
+        headers=headers,
+    )
+    assert resp.json()["committed"] is True
+    assert client.get(f"/todos/{todo_id}", headers=headers).json()["title"] == "ok"
+
+
+def test_unexpected_error_fails_only_its_operation(client, auth_headers, monkeypatch):
+    headers = auth_headers()
+    todo_id = client.post("/todos", json={"title": "a"}, headers=headers).json()["id"]
+
+    async def broken(todo_id, current_user, db):
+        todo = await db.get(Todo, todo_id)
+        todo.title = "half-done"
+        await db.flush()
+        raise OperationalError("UPDATE todos", {}, Exception("disk I/O error"))
+
+    monkeypatch.setattr(routes, "_BATCH_ROUTES", [
+        (m, rx, broken if h is routes.reopen_todo else h, schema, args) for m, rx, h, schema, args in routes._BATCH_ROUTES
+    ])
+    resp = client.post(
+        "/batch",
+        json={
+            "operations": [
+                {"method": "PATCH", "path": f"/todos/{todo_id}", "body": {"title": "b"}},
+                {"method": "POST", "path": f"/todos/{todo_id}/reopen"},
+                {"method": "POST", "path": f"/todos/{todo_id}/complete"},
+            ]
+        },
+        headers=headers,
+    )
+    assert resp.status_code == 200
+    assert [r["status"] for r in resp.json()["results"]] == [200, 500, 200]
+    todo = client.get(f"/todos/{todo_id}", headers=headers).json()
+    # the failed operation's flushed change is rolled back, the others stay
+    assert (todo["title"], todo["is_done"]) == ("b", True)
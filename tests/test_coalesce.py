@@ -0,0 +1,129 @@
+import asyncio
+
+import httpx
+import pytest
+
+from coalesce import SingleFlight, todo_reads
+from main import app
+
+
+def test_single_flight_shares_calls_until_invalidated():
+    async def scenario():
+        flight = SingleFlight(max_waiters=2)
+        release, calls = asyncio.Event(), []
+
+        async def fetch():
+            calls.append(1)
+            await release.wait()
+            return [len(calls)]
+
+        first = asyncio.ensure_future(flight.run("k", fetch))
+        await asyncio.sleep(0)
+        joined = [asyncio.ensure_future(flight.run("k", fetch)) for _ in range(2)]
+        await asyncio.sleep(0)
+        # the call is full: the next request runs its own query
+        own = asyncio.ensure_future(flight.run("k", fetch))
+        await asyncio.sleep(0)
+        # after a write, newcomers do not join the older call either
+        flight.invalidate()
+        fresh = asyncio.ensure_future(flight.run("k", fetch))
+        await asyncio.sleep(0)
+        release.set()
+        results = await asyncio.gather(first, *joined, own, fresh)
+        assert results[0] is results[1] is results[2] and len(calls) == 3
+        assert flight.snapshot() == {"in_flight": 0, "leaders": 3, "hits": 2, "overflows": 1}
+
+        # errors are shared; nothing is cached once the call is done
+        async def missing():
+            await asyncio.sleep(0)
+            raise KeyError("gone")
+
+        failures = await asyncio.gather(flight.run("e", missing), flight.run("e", missing), return_exceptions=True)
+        assert all(isinstance(f, KeyError) for f in failures) and flight.hits == 3
+        assert await flight.run("e", fetch) == [4]
+
+    asyncio.run(scenario())
+
+
+def test_waiters_survive_a_cancelled_leader():
+    async def scenario():
+        flight = SingleFlight()
+        gate = asyncio.Event()
+
+        async def fetch():
+            await gate.wait()
+            return "ok"
+
+        leader = asyncio.ensure_future(flight.run("k", fetch))
+        await asyncio.sleep(0)
+        waiter = asyncio.ensure_future(flight.run("k", fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        assert await waiter == "ok"
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_identical_reads(client, auth_headers):
+    headers = auth_headers()
+    todo_id = client.post("/todos", json={"title": "same"}, headers=headers).json()["id"]
+    before = todo_reads.snapshot()
+
+    async def burst():
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            return await asyncio.gather(
+                *(http.get("/todos", headers=headers) for _ in range(5)),
+                *(http.get(f"/todos/{todo_id}", headers=headers) for _ in range(5)),
+            )
+
+    responses = client.portal.call(burst)
+    assert all(r.status_code == 200 for r in responses)
+    assert all(r.json() == responses[0].json() for r in responses[:5])
+    assert all(r.json() == responses[0].json()[0] for r in responses[5:])
+    after = todo_reads.snapshot()
+    assert (after["leaders"] + after["hits"]) - (before["leaders"] + before["hits"]) == 10
+    assert after["in_flight"] == 0
+    assert client.get("/metrics").json()["metrics"]["coalescing"]["leaders"] >= after["leaders"]
+
+
+def test_atomic_batch_reads_are_not_shared(client, auth_headers):
+    headers = auth_headers()
+    user_id = client.get("/me", headers=headers).json()["id"]
+    todo_id = client.post("/todos", json={"title": "before"}, headers=headers).json()["id"]
+    key = ("GET /todos/{todo_id}", user_id, ("user",), todo_id)
+    operations = [
+        {"method": "PATCH", "path": f"/todos/{todo_id}", "body": {"title": "after"}},
+        {"method": "GET", "path": f"/todos/{todo_id}"},
+    ]
+
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def outside_read():
+            await gate.wait()
+            return {"title": "before"}
+
+        # a read from another session is in flight while the batch runs
+        outside = asyncio.ensure_future(todo_reads.run(key, outside_read))
+        await asyncio.sleep(0)
+        before = todo_reads.snapshot()
+        transport = httpx.ASGITransport(app=app)
+        try:
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+                batch = http.post("/batch", json={"atomic": True, "operations": operations}, headers=headers)
+                resp = await asyncio.wait_for(batch, 5)
+        finally:
+            gate.set()
+            await outside
+        return resp, before, todo_reads.snapshot()
+
+    resp, before, after = client.portal.call(scenario)
+    assert resp.status_code == 200 and resp.json()["committed"]
+    # the batch sees its own write and its read is neither joined nor shared
+    assert resp.json()["results"][1]["body"]["title"] == "after"
+    assert (after["leaders"], after["hits"]) == (before["leaders"], before["hits"])
@@ -0,0 +1,16 @@
+import db
+
+
+def test_engine_options_postgres_pool_settings():
+    opts = db.engine_options("postgresql+asyncpg://u:p@localhost/x")
+    assert opts["pool_size"] == db.DB_POOL_SIZE
+    assert opts["max_overflow"] == db.DB_MAX_OVERFLOW
+    assert opts["pool_recycle"] == db.DB_POOL_RECYCLE
+    assert opts["pool_pre_ping"] is db.DB_POOL_PRE_PING
+    assert opts["connect_args"]["prepared_statement_cache_size"] == db.DB_STATEMENT_CACHE_SIZE
+
+
+def test_engine_options_sqlite_skips_pool_sizing():
+    opts = db.engine_options("sqlite+aiosqlite:///./todo.db")
+    assert "pool_size" not in opts
+    assert "connect_args" not in opts
@@ -1,6 +1,6 @@
 import uuid
 
-from emailer import last_sent_for
+from emailer import wait_for
 
 
 def test_email_verification_flow(client):
@@ -12,7 +12,7 @@ def test_email_verification_flow(client):
     # new user should be inactive until verified
     assert body.get("is_active") is False
 
-    sent = last_sent_for(email)
+    sent = wait_for(email)
     assert sent is not None
     token = sent["token"]
 
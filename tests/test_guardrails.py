@@ -0,0 +1,54 @@
+import asyncio
+import logging
+
+from sqlalchemy.exc import DBAPIError
+
+import db
+from guardrails import (
+    QUERY_MAX_LIMIT,
+    QUERY_STATEMENT_TIMEOUT_MS,
+    local_timeouts,
+    query_timeout_handler,
+    route_timeouts,
+)
+from models import Todo
+
+
+def test_sort_keys_and_limits_are_guarded(client, caplog, auth_headers):
+    headers = auth_headers()
+    for title in "abc":
+        client.post("/todos", json={"title": title}, headers=headers)
+
+    with caplog.at_level(logging.WARNING, logger="guardrails"):
+        resp = client.get("/todos", params={"sort_by": "description"}, headers=headers)
+        assert resp.status_code == 400 and "created_at" in resp.json()["detail"]
+        resp = client.get("/todos", params={"limit": 1_000_000, "sort_by": "id", "sort_desc": "true"}, headers=headers)
+        assert resp.status_code == 200 and [t["title"] for t in resp.json()] == ["c", "b", "a"]
+    assert "GET /todos sort_by='description' rejected" in caplog.text
+    assert f"GET /todos limit=1000000 clamped to {QUERY_MAX_LIMIT}" in caplog.text
+    assert client.get("/todos", params={"limit": 2}, headers=headers).json()[1]["title"] == "b"
+
+
+class _Canceled(Exception):
+    sqlstate = "57014"
+
+
+def test_timed_out_query_answers_503():
+    assert route_timeouts("GET /todos")[0] == QUERY_STATEMENT_TIMEOUT_MS
+    assert route_timeouts("GET /admin/analytics")[0] > QUERY_STATEMENT_TIMEOUT_MS
+    resp = asyncio.run(query_timeout_handler(None, DBAPIError("SELECT 1", {}, _Canceled())))
+    assert resp.status_code == 503 and resp.headers["retry-after"] == "1"
+
+
+def test_sort_keys_are_backed_by_per_owner_indexes():
+    indexes = {tuple(c.name for c in ix.columns) for ix in Todo.__table__.indexes}
+    assert {("owner_id", "created_at", "id"), ("owner_id", "id"), ("owner_id", "position", "id")} <= indexes
+
+
+def test_default_timeouts_are_set_per_connection():
+    settings = db.engine_options("postgresql+asyncpg://u:p@localhost/x")["connect_args"]["server_settings"]
+    assert settings["statement_timeout"] == str(QUERY_STATEMENT_TIMEOUT_MS)
+    # only routes with other limits (and unlimited background work) SET LOCAL
+    assert local_timeouts("GET /todos") is None
+    assert local_timeouts("GET /admin/analytics") == route_timeouts("GET /admin/analytics")
+    assert local_timeouts("background") == (0, 0)
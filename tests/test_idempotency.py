@@ -0,0 +1,42 @@
+import asyncio
+import uuid
+
+from idempotency import MemoryStore
+
+
+def test_retried_create_returns_stored_response(client, auth_headers):
+    headers = {**auth_headers(), "Idempotency-Key": uuid.uuid4().hex}
+    first = client.post("/todos", json={"title": "once"}, headers=headers)
+    retry = client.post("/todos", json={"title": "once"}, headers=headers)
+    assert first.status_code == retry.status_code == 200
+    assert retry.json() == first.json()
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert [t["title"] for t in client.get("/todos", headers=headers).json()] == ["once"]
+
+    reused = client.post("/todos", json={"title": "other"}, headers=headers)
+    assert reused.status_code == 422
+
+
+def test_concurrent_duplicate_waits_for_in_flight_result():
+    async def run():
+        store = MemoryStore()
+        assert await store.begin("k") is None
+        waiter = asyncio.create_task(store.begin("k"))
+        await asyncio.sleep(0)
+        assert not waiter.done()
+        await store.complete("k", {"fingerprint": "f", "body": {"id": 1}})
+        return await waiter
+
+    assert asyncio.run(run())["body"] == {"id": 1}
+
+
+def test_aborted_request_lets_duplicate_execute():
+    async def run():
+        store = MemoryStore()
+        await store.begin("k")
+        waiter = asyncio.create_task(store.begin("k"))
+        await asyncio.sleep(0)
+        await store.abort("k")
+        return await waiter
+
+    assert asyncio.run(run()) is None
@@ -0,0 +1,53 @@
+import asyncio
+
+from loadshed import AdaptiveLimiter, shedder
+
+
+def test_limiter_queue_deadline_and_adaptive_limit():
+    async def scenario():
+        limiter = AdaptiveLimiter("test", 2, latency_target=0.1, queue_timeout=0.05)
+        assert await limiter.acquire() and await limiter.acquire()
+        # full: the third request waits out its deadline and is shed
+        assert not await limiter.acquire()
+        assert (limiter.in_flight, limiter.shed) == (2, 1)
+
+        # a freed slot goes to the waiter
+        waiter = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        limiter.release(0.01)
+        assert await waiter and limiter.in_flight == 2
+        assert limiter.limit > 2  # fast responses at saturation raise the limit
+
+        # slow responses cut it, once per target interval
+        limiter.limit = 8.0
+        limiter.release(1.0)
+        limiter.release(1.0)
+        assert limiter.limit == 8.0 * 0.9 and limiter.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_saturated_group_is_shed_others_and_health_pass(client, auth_headers):
+    headers = auth_headers()
+    assert client.get("/todos", headers=headers).status_code == 200
+    todos = shedder.limiter("Todos")
+    saved = todos.limit, todos.queue_timeout
+    todos.limit, todos.queue_timeout = 1.0, 0.05
+
+    async def hold():
+        assert await todos.acquire()
+
+    client.portal.call(hold)
+    try:
+        resp = client.get("/todos", headers=headers)
+        assert resp.status_code == 503 and resp.headers["retry-after"] == "1"
+        # other groups and the health endpoints are not affected
+        assert client.get("/me", headers=headers).status_code == 200
+        assert client.get("/healthz").status_code == 200
+        state = client.get("/metrics").json()["metrics"]["load_shedding"]["Todos"]
+        assert state["shed"] >= 1 and state["in_flight"] == 1
+    finally:
+        todos.limit, todos.queue_timeout = saved
+        client.portal.call(lambda: asyncio.sleep(0, todos.release(0.0)))
+    assert client.get("/todos", headers=headers).status_code == 200
+    assert todos.in_flight == 0
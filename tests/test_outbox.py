@@ -0,0 +1,123 @@
+import asyncio
+
+import pytest
+from sqlalchemy import select
+
+import emailer
+from models import EmailOutbox
+from outbox import OutboxDispatcher
+
+
+async def _enqueue(factory, *recipients):
+    async with factory() as db:
+        for to in recipients:
+            db.add(EmailOutbox(to_email=to, kind=emailer.VERIFICATION, payload={"token": f"t-{to}"}))
+        await db.commit()
+
+
+class FlakyTransport:
+    """Fails every message for the recipients in `failing`."""
+
+    def __init__(self, failing):
+        self.failing = set(failing)
+        self.sent = []
+
+    async def send_many(self, messages):
+        results = []
+        for m in messages:
+            if m["to"] in self.failing:
+                results.append(ConnectionError("smtp down"))
+            else:
+                self.sent.append(m)
+                results.append(None)
+        return results
+
+    async def close(self):
+        pass
+
+
+def test_dispatcher_sends_batch_and_backs_off_failures(run_on_sqlite):
+    transport = FlakyTransport(failing={"bad@example.com"})
+
+    async def scenario(factory):
+        await _enqueue(factory, "a@example.com", "bad@example.com", "b@example.com")
+        d = OutboxDispatcher(factory, transport, batch_size=10, max_attempts=2)
+        first = await d.run_once()
+        # the failed row is rescheduled into the future, so nothing is due now
+        second = await d.run_once()
+        async with factory() as db:
+            rows = (await db.execute(select(EmailOutbox).order_by(EmailOutbox.id))).scalars().all()
+        return first, second, rows
+
+    first, second, rows = run_on_sqlite(scenario)
+    assert (first, second) == (2, 0)
+    assert [m["to"] for m in transport.sent] == ["a@example.com", "b@example.com"]
+    assert transport.sent[0]["body"] == "Visit /verify-email?token=t-a@example.com"
+    bad = rows[1]
+    assert bad.sent_at is None and bad.attempts == 1 and "smtp down" in bad.last_error
+    assert bad.available_at > bad.created_at
+    assert rows[0].sent_at is not None and rows[2].sent_at is not None
+
+
+def test_memory_sink_is_bounded_ring_with_index(monkeypatch):
+    monkeypatch.setattr(emailer, "SENT", emailer.deque(maxlen=2))
+    monkeypatch.setattr(emailer, "_latest", {})
+    for to in ("x@example.com", "y@example.com", "z@example.com"):
+        emailer._record({"to": to, "token": to})
+    assert len(emailer.SENT) == 2
+    assert emailer.last_sent_for("x@example.com") is None
+    assert emailer.last_sent_for("z@example.com")["token"] == "z@example.com"
+
+
+class _SMTPStub:
+    """Minimal local SMTP server: accepts everything, records DATA blocks."""
+
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        writer.write(b"220 stub ESMTP\r\n")
+        while line := await reader.readline():
+            cmd = line.decode().strip().upper()
+            if cmd.startswith(("EHLO", "HELO")):
+                writer.write(b"250 stub\r\n")
+            elif cmd == "DATA":
+                writer.write(b"354 go ahead\r\n")
+                await writer.drain()
+                data = []
+                while (chunk := await reader.readline()) != b".\r\n":
+                    data.append(chunk)
+                self.messages.append(b"".join(data).decode())
+                writer.write(b"250 OK\r\n")
+            elif cmd == "QUIT":
+                writer.write(b"221 bye\r\n")
+                await writer.drain()
+                break
+            else:
+                writer.write(b"250 OK\r\n")
+            await writer.drain()
+        writer.close()
+
+
+def test_smtp_transport_reuses_pooled_connections():
+    pytest.importorskip("aiosmtplib")
+
+    async def main():
+        stub = _SMTPStub()
+        server = await asyncio.start_server(stub.handle, "127.0.0.1", 0)
+        port = server.sockets[0].getsockname()[1]
+        transport = emailer.SMTPTransport(host="127.0.0.1", port=port, pool_size=2, username=None)
+        msgs = [{"to": f"u{i}@example.com", "subject": "s", "body": f"b{i}"} for i in range(6)]
+        first = await transport.send_many(msgs[:3])
+        second = await transport.send_many(msgs[3:])
+        await transport.close()
+        server.close()
+        await server.wait_closed()
+        return stub, first + second
+
+    stub, results = asyncio.run(main())
+    assert results == [None] * 6
+    assert len(stub.messages) == 6
+    assert stub.connections <= 2
@@ -0,0 +1,29 @@
+import uuid
+
+from emailer import wait_for
+
+
+def _login(client, email, password):
+    resp = client.post("/token", json={"username": email, "password": password})
+    assert resp.status_code == 200
+    return resp.json()["access_token"]
+
+
+def test_login_and_change_password_report_pool_hold_time(client):
+    email = f"pool+{uuid.uuid4().hex}@example.com"
+    assert client.post("/register", json={"email": email, "password": "s3cretpass"}).status_code == 201
+    token = wait_for(email)["token"]
+    assert client.get(f"/verify-email?token={token}").status_code == 200
+
+    access = _login(client, email, "s3cretpass")
+    resp = client.post(
+        "/change-password",
+        json={"current_password": "s3cretpass", "new_password": "n3wsecret"},
+        headers={"Authorization": f"Bearer {access}"},
+    )
+    assert resp.status_code == 200
+    _login(client, email, "n3wsecret")
+
+    holds = client.get("/metrics").json()["metrics"]["db_pool_hold_seconds"]
+    assert holds["POST /token"]["count"] >= 2
+    assert holds["POST /change-password"]["count"] >= 1
@@ -0,0 +1,66 @@
+import asyncio
+
+from ratelimit import MemoryBackend, RateLimit, RateLimiter, SlidingWindowCounter, TokenBucket
+
+
+def _hits(limiter, key, times):
+    async def run():
+        return [await limiter.hit(key, now=t) for t in times]
+
+    return asyncio.run(run())
+
+
+def test_sliding_window_blocks_over_limit_and_recovers():
+    limiter = RateLimiter("t", 3, 60, backend=MemoryBackend())
+    results = _hits(limiter, "ip", [0, 1, 2, 3])
+    assert results[:3] == [None, None, None]
+    assert results[3] is not None and results[3] >= 1
+    # two windows later the previous counts no longer weigh in
+    assert _hits(limiter, "ip", [125]) == [None]
+
+
+def test_sliding_window_weights_previous_window():
+    algo = SlidingWindowCounter(10, 60)
+    state = (0, 0, 10)
+    # 30s into the next window half of the previous 10 hits still count
+    state, retry = algo.step(state, 90)
+    assert retry is None and state == (1, 10, 1)
+
+
+def test_token_bucket_refills():
+    limiter = RateLimiter("t", 2, 10, algorithm="token_bucket", backend=MemoryBackend())
+    assert isinstance(limiter.algorithm, TokenBucket)
+    results = _hits(limiter, "acct", [0, 0, 0, 5])
+    assert results[0] is None and results[1] is None
+    assert results[2] is not None
+    # 5s refills one token at 2 tokens / 10s
+    assert results[3] is None
+
+
+def test_memory_backend_is_bounded_and_evicts_idle_keys():
+    backend = MemoryBackend(max_keys=100)
+    limiter = RateLimiter("t", 5, 10, backend=backend)
+    _hits(limiter, "old", [0])
+    for i in range(500):
+        asyncio.run(limiter.hit(f"ip{i}", now=1))
+    assert len(backend) == 100
+    # idle keys (older than two windows) are dropped on the next hit
+    _hits(limiter, "fresh", [100])
+    assert len(backend) == 1
+
+
+def test_account_key_ignores_case_and_surrounding_spaces():
+    class _Request:
+        def __init__(self, body):
+            self.body = body
+
+        async def json(self):
+            return self.body
+
+    limit = RateLimit(RateLimiter("t", 1, 60, backend=MemoryBackend()), body_field="email", ignore_case=True)
+
+    async def keys(*values):
+        return [await limit._key(_Request({"email": v})) for v in values]
+
+    first, second, other, blank = asyncio.run(keys("Foo@x.com", " foo@x.com ", "bar@x.com", "  "))
+    assert first == second != other and blank is None
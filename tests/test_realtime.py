@@ -0,0 +1,98 @@
+import asyncio
+import json
+
+from realtime import ChangeFeed, ChangeHub, PgNotifyBridge, RESYNC, Subscription
+
+
+async def _drain(sub: Subscription) -> list:
+    events = []
+    while (event := await sub.get(timeout=0.01)) is not None:
+        events.append(event)
+    return events
+
+
+def test_hub_delivers_only_to_owners_and_admins():
+    async def run():
+        hub = ChangeHub()
+        owner, other, admin = hub.subscribe(1), hub.subscribe(2), hub.subscribe(3, is_admin=True)
+        hub.deliver({"type": "created", "todo_id": 10, "owner_ids": [1]})
+        return await _drain(owner), await _drain(other), await _drain(admin)
+
+    owner, other, admin = asyncio.run(run())
+    assert [e["todo_id"] for e in owner] == [10]
+    assert other == []
+    assert [e["todo_id"] for e in admin] == [10]
+
+
+def test_slow_subscriber_gets_single_resync():
+    async def run():
+        hub = ChangeHub()
+        sub = hub.subscribe(1)
+        for i in range(sub._queue.maxsize + 5):
+            hub.deliver({"type": "updated", "todo_id": i, "owner_ids": [1]})
+        return await _drain(sub)
+
+    events = asyncio.run(run())
+    assert events[0]["type"] == RESYNC
+    assert len(events) < 10
+
+
+class _FakeConnection:
+    """asyncpg-like connection: one operation at a time, can be cut off."""
+
+    def __init__(self, sent, fail_after=None):
+        self.sent, self.fail_after = sent, fail_after
+        self.busy = self.closed = False
+
+    async def add_listener(self, channel, callback):
+        pass
+
+    async def execute(self, query, channel, payload):
+        if self.busy:
+            raise RuntimeError("another operation is in progress")
+        self.busy = True
+        await asyncio.sleep(0)
+        self.busy = False
+        if self.fail_after is not None and len(self.sent) >= self.fail_after:
+            self.closed = True
+            raise ConnectionError("connection lost")
+        self.sent.append(json.loads(payload)["event"]["todo_id"])
+
+    def is_closed(self):
+        return self.closed
+
+    async def close(self):
+        self.closed = True
+
+
+def test_notify_bridge_sends_every_event_in_order_and_reconnects():
+    async def run():
+        sent, connections = [], []
+
+        async def connect():
+            # the first connection drops after two NOTIFYs
+            connections.append(_FakeConnection(sent, fail_after=2 if not connections else None))
+            return connections[-1]
+
+        feed = ChangeFeed()
+        feed.bridge = PgNotifyBridge(feed.hub, "postgresql://", connect=connect, min_delay=0.01)
+        await feed.bridge.start()
+        feed.publish([{"type": "deleted", "todo_id": i, "owner_ids": [1]} for i in range(5)])
+        await feed.stop()
+        return sent, len(connections)
+
+    sent, connections = asyncio.run(run())
+    assert sent == [0, 1, 2, 3, 4] and connections == 2
+
+
+def test_websocket_receives_created_event(client, auth_headers):
+    headers = auth_headers()
+    access = headers["Authorization"].removeprefix("Bearer ")
+
+    with client.websocket_connect(f"/todos/ws?token={access}") as ws:
+        resp = client.post("/todos", json={"title": "live"}, headers=headers)
+        assert resp.status_code == 200
+        event = ws.receive_json()
+    assert event["type"] == "created"
+    assert event["todo_id"] == resp.json()["id"]
+    assert event["todo"]["title"] == "live"
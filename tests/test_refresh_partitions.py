@@ -0,0 +1,30 @@
+import uuid
+from datetime import datetime, timezone
+
+from auth import generate_raw_refresh_token, refresh_token_month
+from emailer import wait_for
+from partitions import maintainer
+
+
+def test_refresh_token_carries_its_issue_month():
+    issued = datetime(2025, 12, 31, 23, 59, tzinfo=timezone.utc)
+    raw = generate_raw_refresh_token(issued)
+    assert raw.startswith("202512.")
+    assert refresh_token_month(raw) == datetime(2025, 12, 1, tzinfo=timezone.utc)
+    # tokens issued before the prefix existed are looked up without it
+    assert refresh_token_month("legacy-token.abc") is None
+    assert refresh_token_month("202513.abc") is None
+
+
+def test_refresh_rotation_uses_month_scoped_lookup(client):
+    email = f"rtp+{uuid.uuid4().hex}@example.com"
+    assert client.post("/register", json={"email": email, "password": "s3cretpass"}).status_code == 201
+    assert client.get(f"/verify-email?token={wait_for(email)['token']}").status_code == 200
+    tokens = client.post("/token", json={"username": email, "password": "s3cretpass"}).json()
+    rotated = client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]})
+    assert rotated.status_code == 200
+    assert refresh_token_month(rotated.json()["refresh_token"]) is not None
+    # the old token was revoked by the rotation
+    assert client.post("/token/refresh", json={"refresh_token": tokens["refresh_token"]}).status_code == 401
+    # maintenance is a no-op unless the table is partitioned (Postgres only)
+    assert client.portal.call(maintainer.run_once) == []
@@ -0,0 +1,78 @@
+import uuid
+
+from sqlalchemy import select, update
+
+from crud import USER_AGENT_MAX_LENGTH, user_agent_digest
+from db import AsyncSessionLocal
+from emailer import wait_for
+from models import RefreshToken, User, UserAgent
+
+UA = "Mozilla/5.0 (X11; Linux x86_64) storage-test/" + uuid.uuid4().hex
+
+
+def _login(client, email, ip):
+    headers = {"User-Agent": UA, "X-Forwarded-For": ip}
+    resp = client.post("/token", json={"username": email, "password": "s3cretpass"}, headers=headers)
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def test_refresh_tokens_use_compact_columns(client):
+    email = f"rts+{uuid.uuid4().hex}@example.com"
+    assert client.post("/register", json={"email": email, "password": "s3cretpass"}).status_code == 201
+    assert client.get(f"/verify-email?token={wait_for(email)['token']}").status_code == 200
+    _login(client, email, "2001:DB8:0:0::7")
+    tokens = _login(client, email, "not-an-address")
+    rotated = client.post(
+        "/token/refresh", json={"refresh_token": tokens["refresh_token"]}, headers={"User-Agent": UA}
+    )
+    assert rotated.status_code == 200
+
+    async def stored():
+        async with AsyncSessionLocal() as db:
+            rows = (
+                await db.execute(
+                    select(RefreshToken, UserAgent.value)
+                    .join(UserAgent, UserAgent.id == RefreshToken.user_agent_id)
+                    .where(UserAgent.value == UA)
+                    .order_by(RefreshToken.id)
+                )
+            ).all()
+            return [(rt.token_hash, rt.user_agent_id, rt.ip_address, value) for rt, value in rows]
+
+    rows = client.portal.call(stored)
+    assert len(rows) == 3
+    # raw 32-byte digests, one dictionary entry for the repeated user agent
+    assert all(isinstance(h, bytes) and len(h) == 32 for h, _, _, _ in rows)
+    assert len({ua_id for _, ua_id, _, _ in rows}) == 1 and rows[0][3] == UA
+    # addresses come back normalized; anything else is not stored
+    assert rows[0][2] == "2001:db8::7"
+    assert rows[1][2] is None
+
+
+def test_user_agents_are_cut_and_unused_ones_pruned(client):
+    email = f"rts+{uuid.uuid4().hex}@example.com"
+    assert client.post("/register", json={"email": email, "password": "s3cretpass"}).status_code == 201
+    assert client.get(f"/verify-email?token={wait_for(email)['token']}").status_code == 200
+    long_ua = UA + " x" * 2000
+    cut = long_ua[:USER_AGENT_MAX_LENGTH]
+    orphan = f"orphan/{uuid.uuid4().hex}"
+
+    async def seed():
+        async with AsyncSessionLocal() as db:
+            db.add(UserAgent(digest=user_agent_digest(orphan), value=orphan))
+            await db.execute(update(User).where(User.email == email).values(scopes=["user", "admin"]))
+            await db.commit()
+
+    async def stored():
+        async with AsyncSessionLocal() as db:
+            values = await db.execute(select(UserAgent.value).where(UserAgent.value.in_([orphan, cut])))
+            return sorted(values.scalars().all(), key=len)
+
+    client.portal.call(seed)
+    resp = client.post("/token", json={"username": email, "password": "s3cretpass"}, headers={"User-Agent": long_ua})
+    access = resp.json()["access_token"]
+    assert client.portal.call(stored) == [orphan, cut]
+    resp = client.post("/admin/cleanup_sessions", headers={"Authorization": f"Bearer {access}"})
+    assert resp.status_code == 200 and resp.json()["user_agents_deleted"] >= 1
+    assert client.portal.call(stored) == [cut]
@@ -0,0 +1,63 @@
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+from emailer import last_sent_for
+
+
+def _register(auth_headers):
+    email = f"remind+{uuid.uuid4().hex}@example.com"
+    return email, auth_headers(email=email)
+
+
+def _in(seconds):
+    return (datetime.now(timezone.utc) + timedelta(seconds=seconds)).isoformat()
+
+
+def _wait_for_reminder(email, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        msg = last_sent_for(email)
+        if msg and msg["subject"].startswith("Reminder"):
+            return msg
+        time.sleep(0.05)
+    return None
+
+
+def test_reminder_fires_once_and_is_cleared(client, auth_headers):
+    email, headers = _register(auth_headers)
+    todo = client.post(
+        "/todos", json={"title": "call bob", "due_at": _in(3600), "remind_at": _in(0.3)}, headers=headers
+    ).json()
+    assert todo["remind_at"] is not None
+    msg = _wait_for_reminder(email)
+    assert msg and msg["subject"] == "Reminder: call bob" and msg["todo_id"] == todo["id"]
+    assert client.get(f"/todos/{todo['id']}", headers=headers).json()["remind_at"] is None
+
+
+def test_moved_and_completed_reminders_are_rearmed(client, auth_headers):
+    email, headers = _register(auth_headers)
+    moved = client.post("/todos", json={"title": "moved", "remind_at": _in(0.3)}, headers=headers).json()
+    done = client.post("/todos", json={"title": "done", "remind_at": _in(0.3)}, headers=headers).json()
+    later = _in(3600)
+    assert client.patch(f"/todos/{moved['id']}", json={"remind_at": later}, headers=headers).status_code == 200
+    assert client.post(f"/todos/{done['id']}/complete", headers=headers).status_code == 200
+
+    time.sleep(0.8)
+    assert not last_sent_for(email)["subject"].startswith("Reminder")
+    assert client.get(f"/todos/{moved['id']}", headers=headers).json()["remind_at"] is not None
+
+    # moving it back into the past fires right away
+    assert client.patch(f"/todos/{moved['id']}", json={"remind_at": _in(-1)}, headers=headers).status_code == 200
+    assert _wait_for_reminder(email)["todo_id"] == moved["id"]
+
+
+def test_rolled_back_batch_keeps_the_reminder_armed(client, auth_headers):
+    email, headers = _register(auth_headers)
+    todo = client.post("/todos", json={"title": "pay rent", "remind_at": _in(0.5)}, headers=headers).json()
+    resp = client.post("/batch", json={"atomic": True, "operations": [
+        {"method": "POST", "path": f"/todos/{todo['id']}/complete"},
+        {"method": "DELETE", "path": "/todos/999999999"},
+    ]}, headers=headers)
+    assert resp.json()["committed"] is False
+    assert _wait_for_reminder(email)["todo_id"] == todo["id"]
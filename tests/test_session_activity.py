@@ -0,0 +1,36 @@
+import uuid
+
+from activity import tracker
+from db import AsyncSessionLocal
+from emailer import wait_for
+from models import RefreshToken
+
+
+def test_activity_is_buffered_and_flushed_in_one_batch(client):
+    email = f"act+{uuid.uuid4().hex}@example.com"
+    assert client.post("/register", json={"email": email, "password": "s3cretpass"}).status_code == 201
+    assert client.get(f"/verify-email?token={wait_for(email)['token']}").status_code == 200
+    access = client.post("/token", json={"username": email, "password": "s3cretpass"}).json()["access_token"]
+    headers = {"Authorization": f"Bearer {access}", "X-Forwarded-For": "203.0.113.7"}
+
+    for _ in range(3):
+        me = client.get("/me", headers=headers)
+        # the session id and IP are tracked, not exposed
+        assert me.status_code == 200 and set(me.json()) == {"id", "email", "scopes"}
+    [session] = client.get("/sessions", headers=headers).json()
+    sid = session["id"]
+    assert tracker.pending(sid)[1] == "203.0.113.7"
+
+    # visible before the flush...
+    assert session["last_used_at"] is not None and session["ip_address"] == "203.0.113.7"
+
+    # ...and after it, from the database
+    assert client.portal.call(tracker.flush) >= 1
+    assert tracker.pending(sid) is None
+
+    async def stored():
+        async with AsyncSessionLocal() as db:
+            return await db.get(RefreshToken, sid)
+
+    row = client.portal.call(stored)
+    assert row.last_used_at is not None and row.ip_address == "203.0.113.7"
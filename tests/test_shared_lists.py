@@ -0,0 +1,114 @@
+def _id(client, headers):
+    return client.get("/me", headers=headers).json()["id"]
+
+
+def test_roles_of_list_members(client, auth_headers):
+    owner, writer, reader, stranger = (auth_headers() for _ in range(4))
+    list_id = client.post("/lists", json={"name": "groceries"}, headers=owner).json()["id"]
+    for headers, role in ((writer, "write"), (reader, "read")):
+        resp = client.put(f"/lists/{list_id}/members/{_id(client, headers)}", json={"role": role}, headers=owner)
+        assert resp.status_code == 200 and resp.json()["role"] == role
+    # only the owner shares
+    assert client.put(
+        f"/lists/{list_id}/members/{_id(client, stranger)}", json={"role": "read"}, headers=writer
+    ).status_code == 403
+    assert [(lst["id"], lst["role"]) for lst in client.get("/lists", headers=reader).json()] == [(list_id, "read")]
+
+    # a writer adds to the list; the todo belongs to the list owner
+    todo = client.post("/todos", json={"title": "milk", "list_id": list_id}, headers=writer).json()
+    assert todo["owner_id"] == _id(client, owner) and todo["list_id"] == list_id
+    sub = client.post("/todos", json={"title": "oat", "parent_id": todo["id"]}, headers=writer).json()
+    assert sub["list_id"] == list_id
+    assert client.post("/todos", json={"title": "x", "list_id": list_id}, headers=reader).status_code == 403
+    own = client.post("/todos", json={"title": "private"}, headers=owner).json()["id"]
+
+    assert client.get(f"/todos/{todo['id']}", headers=reader).status_code == 200
+    assert client.get(f"/todos/{todo['id']}/tree", headers=reader).json()["children"][0]["id"] == sub["id"]
+    assert client.get(f"/todos/{todo['id']}", headers=stranger).status_code == 403
+    assert client.get(f"/todos/{own}", headers=reader).status_code == 403
+    assert client.post(f"/todos/{todo['id']}/complete", headers=reader).status_code == 403
+    assert client.post(f"/todos/{sub['id']}/complete", headers=writer).status_code == 200
+    assert client.get(f"/todos/{todo['id']}", headers=owner).json()["subtasks_done"] == 1
+    # writers edit, only the owner moves todos out of the list
+    assert client.patch(f"/todos/{todo['id']}", json={"title": "milk 2"}, headers=writer).status_code == 200
+    assert client.patch(f"/todos/{todo['id']}", json={"list_id": None}, headers=writer).status_code == 403
+
+    listed = client.get(f"/todos?list_id={list_id}", headers=reader).json()
+    assert sorted(t["id"] for t in listed) == sorted([todo["id"], sub["id"]])
+    assert client.get(f"/todos?list_id={list_id}", headers=stranger).json() == []
+    # without list_id everyone still sees their own todos only
+    assert client.get("/todos", headers=writer).json() == []
+
+    # bulk_complete skips what the caller may not change
+    assert client.post("/todos/bulk_complete", json=[todo["id"], own], headers=writer).json() == {"updated": 1}
+    assert client.post("/todos/bulk_complete", json=[own], headers=reader).json() == {"updated": 0}
+
+    # revoking takes effect on the next request
+    assert client.delete(f"/lists/{list_id}/members/{_id(client, reader)}", headers=owner).status_code == 200
+    assert client.get(f"/todos/{todo['id']}", headers=reader).status_code == 403
+
+
+def test_list_moves_and_deletion(client, auth_headers):
+    owner, member = auth_headers(), auth_headers()
+    list_id = client.post("/lists", json={"name": "work"}, headers=owner).json()["id"]
+    client.put(f"/lists/{list_id}/members/{_id(client, member)}", json={"role": "read"}, headers=owner)
+    parent = client.post("/todos", json={"title": "p"}, headers=owner).json()["id"]
+    child = client.post("/todos", json={"title": "c", "parent_id": parent}, headers=owner).json()["id"]
+    leaf = client.post("/todos", json={"title": "l", "parent_id": child}, headers=owner).json()["id"]
+
+    # moving a subtask into a list detaches it and takes its subtree along
+    assert client.patch(f"/todos/{child}", json={"list_id": list_id}, headers=owner).status_code == 200
+    assert client.get(f"/todos/{parent}", headers=owner).json()["subtasks_total"] == 0
+    assert client.get(f"/todos/{leaf}", headers=member).json()["list_id"] == list_id
+    # subtasks stay in their parent's list
+    assert client.patch(f"/todos/{parent}", json={"parent_id": child}, headers=owner).status_code == 400
+
+    # the batch shares one session and its cached roles
+    resp = client.post("/batch", json={"operations": [
+        {"method": "GET", "path": f"/todos/{child}"},
+        {"method": "GET", "path": f"/todos/{leaf}"},
+        {"method": "DELETE", "path": f"/todos/{leaf}"},
+    ]}, headers=member).json()
+    assert [r["status"] for r in resp["results"]] == [200, 200, 403]
+
+    # deleting the list keeps the todos with their owner
+    assert client.delete(f"/lists/{list_id}", headers=member).status_code == 403
+    assert client.delete(f"/lists/{list_id}", headers=owner).status_code == 200
+    assert client.get(f"/todos/{child}", headers=owner).json()["list_id"] is None
+    assert client.get(f"/todos/{child}", headers=member).status_code == 403
+    assert client.get("/lists", headers=member).json() == []
+
+
+def test_members_receive_list_events_and_changes(client, auth_headers):
+    owner, member = auth_headers(), auth_headers()
+    list_id = client.post("/lists", json={"name": "home"}, headers=owner).json()["id"]
+    client.put(f"/lists/{list_id}/members/{_id(client, member)}", json={"role": "read"}, headers=owner)
+    first = client.get("/todos/changes", headers=member).json()
+    assert first["changes"] == [] and first["list_tokens"] == {str(list_id): 0}
+
+    access = member["Authorization"].split()[1]
+    with client.websocket_connect(f"/todos/ws?token={access}") as ws:
+        milk = client.post("/todos", json={"title": "milk", "list_id": list_id}, headers=owner).json()
+        event = ws.receive_json()
+    assert event["type"] == "created" and event["todo_id"] == milk["id"] and event["list_id"] == list_id
+    client.post("/todos", json={"title": "private"}, headers=owner)
+
+    since = f"{list_id}:{first['list_tokens'][str(list_id)]}"
+    sync = client.get("/todos/changes", params={"list_since": since}, headers=member).json()
+    assert [t["id"] for t in sync["changes"]] == [milk["id"]] and sync["deleted"] == []
+    owner_token = client.get("/todos/changes", headers=owner).json()["next_token"]
+
+    # leaving the list and deletion reach the members as tombstones of the list
+    bread = client.post("/todos", json={"title": "bread", "list_id": list_id}, headers=owner).json()["id"]
+    assert client.patch(f"/todos/{milk['id']}", json={"list_id": None}, headers=owner).status_code == 200
+    assert client.delete(f"/todos/{bread}", headers=owner).status_code == 200
+    since = f"{list_id}:{sync['list_tokens'][str(list_id)]}"
+    delta = client.get("/todos/changes", params={"list_since": since}, headers=member).json()
+    assert delta["changes"] == [] and sorted(delta["deleted"]) == sorted([milk["id"], bread])
+    # the owner still has the todo that left the list
+    own = client.get("/todos/changes", params={"since": owner_token}, headers=owner).json()
+    assert [t["id"] for t in own["changes"]] == [milk["id"]] and own["deleted"] == [bread]
+
+    assert client.get("/todos/changes", params={"list_since": "x"}, headers=member).status_code == 400
+    client.delete(f"/lists/{list_id}/members/{_id(client, member)}", headers=owner)
+    assert client.get("/todos/changes", params={"list_since": since}, headers=member).json()["list_tokens"] == {}
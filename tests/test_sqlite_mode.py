@@ -0,0 +1,51 @@
+import asyncio
+
+import pytest
+from sqlalchemy import func, select
+from sqlalchemy.exc import IntegrityError
+
+from models import User
+
+
+async def _add_user(factory, email):
+    async with factory() as session:
+        session.add(User(email=email, hashed_password="x", scopes=["user"]))
+        await session.commit()
+
+
+def test_concurrent_writes_are_serialized(run_on_sqlite):
+    async def scenario(factory):
+        await asyncio.gather(*(_add_user(factory, f"u{i}@example.com") for i in range(50)))
+        async with factory() as session:
+            return (await session.execute(select(func.count(User.id)))).scalar()
+
+    assert run_on_sqlite(scenario) == 50
+
+
+def test_failed_session_does_not_abort_batch(run_on_sqlite):
+    async def scenario(factory):
+        await _add_user(factory, "dup@example.com")
+        results = await asyncio.gather(
+            _add_user(factory, "a@example.com"),
+            _add_user(factory, "dup@example.com"),
+            _add_user(factory, "b@example.com"),
+            return_exceptions=True,
+        )
+        async with factory() as session:
+            emails = (await session.execute(select(User.email).order_by(User.email))).scalars().all()
+        return results, emails
+
+    results, emails = run_on_sqlite(scenario)
+    assert isinstance(results[1], IntegrityError)
+    assert results[0] is None and results[2] is None
+    assert emails == ["a@example.com", "b@example.com", "dup@example.com"]
+
+
+def test_reader_connections_are_query_only(run_on_sqlite):
+    async def scenario(factory):
+        async with factory() as session:
+            conn = await session.connection()
+            await conn.exec_driver_sql("INSERT INTO users (email, hashed_password) VALUES ('x@y.z', 'x')")
+
+    with pytest.raises(Exception):
+        run_on_sqlite(scenario)
@@ -0,0 +1,69 @@
+def _titles(node):
+    return [node["title"], [_titles(c) for c in node["children"]]]
+
+
+def test_tree_progress_and_reparenting(client, auth_headers):
+    headers = auth_headers()
+
+    def new(title, parent=None):
+        resp = client.post("/todos", json={"title": title, "parent_id": parent}, headers=headers)
+        assert resp.status_code == 200
+        return resp.json()["id"]
+
+    def get(todo_id):
+        return client.get(f"/todos/{todo_id}", headers=headers).json()
+
+    root = new("root")
+    a = new("a", root)
+    b = new("b", root)
+    a1 = new("a1", a)
+    a1x = new("a1x", a1)
+
+    tree = client.get(f"/todos/{root}/tree", headers=headers).json()
+    assert _titles(tree) == ["root", [["a", [["a1", [["a1x", []]]]]], ["b", []]]]
+    assert (tree["subtasks_total"], tree["subtasks_done"]) == (2, 0)
+
+    # progress follows complete / reopen / PATCH is_done
+    assert client.post(f"/todos/{b}/complete", headers=headers).status_code == 200
+    assert get(root)["subtasks_done"] == 1
+    assert client.post(f"/todos/{b}/reopen", headers=headers).status_code == 200
+    assert client.patch(f"/todos/{a}", json={"is_done": True}, headers=headers).status_code == 200
+    assert (get(root)["subtasks_total"], get(root)["subtasks_done"]) == (2, 1)
+
+    # a todo cannot go under its own subtree
+    assert client.patch(f"/todos/{root}", json={"parent_id": a1x}, headers=headers).status_code == 400
+    # moving a (done) under b carries its subtree along
+    assert client.patch(f"/todos/{a}", json={"parent_id": b}, headers=headers).status_code == 200
+    assert (get(root)["subtasks_total"], get(root)["subtasks_done"]) == (1, 0)
+    assert (get(b)["subtasks_total"], get(b)["subtasks_done"]) == (1, 1)
+    tree = client.get(f"/todos/{b}/tree", headers=headers).json()
+    assert _titles(tree) == ["b", [["a", [["a1", [["a1x", []]]]]]]]
+    # the moved subtree's paths were rewritten: a1x cannot adopt b now
+    assert client.patch(f"/todos/{b}", json={"parent_id": a1x}, headers=headers).status_code == 400
+    # back to the top level
+    assert client.patch(f"/todos/{a1}", json={"parent_id": None}, headers=headers).status_code == 200
+    assert get(a1)["parent_id"] is None and get(a)["subtasks_total"] == 0
+
+    # deleting a parent deletes its subtasks
+    assert client.delete(f"/todos/{root}", headers=headers).status_code == 200
+    for todo_id in (root, a, b):
+        assert client.get(f"/todos/{todo_id}", headers=headers).status_code == 404
+    assert client.get(f"/todos/{a1x}/tree", headers=headers).json()["parent_id"] == a1
+
+
+def test_subtasks_stay_in_one_list(client, auth_headers):
+    headers, other = auth_headers(), auth_headers()
+    other_id = client.get("/me", headers=other).json()["id"]
+    foreign = client.post("/todos", json={"title": "theirs"}, headers=other).json()["id"]
+    resp = client.post("/todos", json={"title": "mine", "parent_id": foreign}, headers=headers)
+    assert resp.status_code == 400
+
+    parent = client.post("/todos", json={"title": "p"}, headers=headers).json()["id"]
+    child = client.post("/todos", json={"title": "c", "parent_id": parent}, headers=headers).json()["id"]
+    leaf = client.post("/todos", json={"title": "l", "parent_id": child}, headers=headers).json()["id"]
+    # assigning a subtask detaches it and moves its subtree to the assignee
+    assert client.post(f"/todos/{child}/assign?assignee_id={other_id}", headers=headers).status_code == 200
+    assert client.get(f"/todos/{parent}", headers=headers).json()["subtasks_total"] == 0
+    tree = client.get(f"/todos/{child}/tree", headers=other).json()
+    assert tree["parent_id"] is None and tree["owner_id"] == other_id
+    assert [c["id"] for c in tree["children"]] == [leaf] and tree["children"][0]["owner_id"] == other_id
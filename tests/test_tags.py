@@ -0,0 +1,47 @@
+from tags import normalize_tags
+
+
+def test_normalize_tags():
+    assert normalize_tags(["#Work", " work ", "Home  Office", "", "#"]) == ["work", "home office"]
+
+
+def test_filter_by_any_and_all_tags(client, auth_headers):
+    headers = auth_headers()
+    for title, tags in [("a", ["work", "#Urgent"]), ("b", ["work"]), ("c", ["home"]), ("d", [])]:
+        todo = client.post("/todos", json={"title": title, "tags": tags}, headers=headers).json()
+        assert todo["tags"] == sorted(t.lstrip("#").lower() for t in tags)
+
+    def titles(**params):
+        resp = client.get("/todos", params=params, headers=headers)
+        assert resp.status_code == 200
+        return sorted(t["title"] for t in resp.json())
+
+    assert titles(tag="work") == ["a", "b"]
+    assert titles(tag=["urgent", "home"]) == ["a", "c"]
+    assert titles(tag=["work", "urgent"], tag_mode="all") == ["a"]
+    assert titles(tag=["work", "missing"], tag_mode="all") == []
+    assert client.get("/todos", params={"tag": "x", "tag_mode": "some"}, headers=headers).status_code == 422
+
+
+def test_tag_counts_follow_updates_deletes_and_reassignment(client, auth_headers):
+    headers, other = auth_headers(), auth_headers()
+    other_id = client.get("/me", headers=other).json()["id"]
+    a = client.post("/todos", json={"title": "a", "tags": ["x", "y"]}, headers=headers).json()
+    b = client.post("/todos", json={"title": "b", "tags": ["x"]}, headers=headers).json()
+
+    def counts(h):
+        return {t["name"]: t["count"] for t in client.get("/tags", headers=h).json()}
+
+    assert counts(headers) == {"x": 2, "y": 1}
+
+    resp = client.patch(f"/todos/{a['id']}", json={"tags": ["y", "z"]}, headers=headers)
+    assert resp.json()["tags"] == ["y", "z"]
+    assert counts(headers) == {"x": 1, "y": 1, "z": 1}
+
+    assert client.post(f"/todos/{a['id']}/assign", params={"assignee_id": other_id}, headers=headers).status_code == 200
+    assert counts(headers) == {"x": 1}
+    assert counts(other) == {"y": 1, "z": 1}
+    assert [t["tags"] for t in client.get("/todos", params={"tag": "z"}, headers=other).json()] == [["y", "z"]]
+
+    assert client.delete(f"/todos/{b['id']}", headers=headers).status_code in (200, 204)
+    assert counts(headers) == {}
@@ -0,0 +1,58 @@
+import random
+
+from positions import key_between, spread_keys
+
+
+def test_key_between_keeps_order_under_random_inserts():
+    keys = []
+    for _ in range(2000):
+        i = random.randint(0, len(keys))
+        before = keys[i - 1] if i else None
+        after = keys[i] if i < len(keys) else None
+        key = key_between(before, after)
+        assert (before is None or before < key) and (after is None or key < after)
+        keys.insert(i, key)
+    spread = spread_keys(len(keys))
+    assert spread == sorted(spread) and len(set(spread)) == len(keys)
+
+
+def _titles(client, headers, **params):
+    return [t["title"] for t in client.get("/todos", params={"sort_by": "position", **params}, headers=headers).json()]
+
+
+def test_move_reorders_with_one_write_and_pages_by_cursor(client, auth_headers):
+    headers = auth_headers()
+    ids = [client.post("/todos", json={"title": t}, headers=headers).json()["id"] for t in "abcd"]
+    assert _titles(client, headers) == ["a", "b", "c", "d"]
+
+    # d between a and b, then a to the very end
+    resp = client.post(f"/todos/{ids[3]}/move", json={"after_id": ids[0], "before_id": ids[1]}, headers=headers)
+    assert resp.status_code == 200
+    client.post(f"/todos/{ids[0]}/move", json={"after_id": ids[2]}, headers=headers)
+    assert _titles(client, headers) == ["d", "b", "c", "a"]
+
+    first = client.get("/todos", params={"sort_by": "position", "limit": 2}, headers=headers)
+    assert [t["title"] for t in first.json()] == ["d", "b"]
+    assert _titles(client, headers, limit=2, cursor=first.headers["x-next-cursor"]) == ["c", "a"]
+
+    # neighbours in the wrong order
+    resp = client.post(f"/todos/{ids[1]}/move", json={"after_id": ids[0], "before_id": ids[3]}, headers=headers)
+    assert resp.status_code == 409
+
+
+def test_rebalance_shortens_keys_and_keeps_order(client, auth_headers):
+    from positions import rebalancer
+
+    headers = auth_headers()
+    ids = [client.post("/todos", json={"title": str(i)}, headers=headers).json()["id"] for i in range(3)]
+    # keep inserting right below the first todo: keys grow
+    for _ in range(20):
+        client.post(f"/todos/{ids[2]}/move", json={"after_id": ids[0], "before_id": ids[1]}, headers=headers)
+        client.post(f"/todos/{ids[1]}/move", json={"after_id": ids[0], "before_id": ids[2]}, headers=headers)
+    before = client.get("/todos", params={"sort_by": "position"}, headers=headers).json()
+    owner_id = before[0]["owner_id"]
+
+    client.portal.call(rebalancer.rebalance, owner_id)
+    after = client.get("/todos", params={"sort_by": "position"}, headers=headers).json()
+    assert [t["id"] for t in after] == [t["id"] for t in before]
+    assert max(len(t["position"]) for t in after) < max(len(t["position"]) for t in before)
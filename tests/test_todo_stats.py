@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import update
+
+from archive import archiver
+from db import AsyncSessionLocal
+from models import Todo
+from todo_stats import backfill
+
+
+def _stats(client, headers, **params):
+    resp = client.get("/todos/stats", params=params, headers=headers)
+    assert resp.status_code == 200
+    return resp.json()
+
+
+def test_rollups_follow_writes_backfill_and_archival(client, auth_headers):
+    headers, other = auth_headers(), auth_headers()
+    owner_id = client.get("/me", headers=headers).json()["id"]
+    ids = [client.post("/todos", json={"title": t}, headers=headers).json()["id"] for t in "abcd"]
+    a, b, c, d = ids
+    for todo_id in (a, b):
+        assert client.post(f"/todos/{todo_id}/complete", headers=headers).status_code == 200
+    assert client.post(f"/todos/{b}/reopen", headers=headers).status_code == 200
+    assert client.delete(f"/todos/{d}", headers=headers).status_code == 200
+
+    stats = _stats(client, headers, periods=7)
+    assert (stats["open"], stats["done"], stats["period"]) == (2, 1, "day")
+    assert abs(stats["completion_rate"] - 1 / 3) < 1e-9
+    assert len(stats["series"]) == 7
+    assert (stats["series"][-1]["created"], stats["series"][-1]["completed"]) == (3, 1)
+
+    # reassigning moves the todo to the other user's rollups
+    other_id = client.get("/me", headers=other).json()["id"]
+    assert client.post(f"/todos/{c}/assign?assignee_id={other_id}", headers=headers).status_code == 200
+    assert _stats(client, headers)["open"] == 1
+    assert _stats(client, other)["series"][-1]["created"] == 1
+
+    # history written behind the hooks' back is picked up by the backfill
+    long_ago = datetime.now(timezone.utc) - timedelta(days=archiver.after_days + 1)
+
+    async def backdate_and_backfill():
+        async with AsyncSessionLocal() as db:
+            await db.execute(update(Todo).where(Todo.id == a).values(created_at=long_ago, completed_at=long_ago))
+            await db.commit()
+        async with AsyncSessionLocal() as db:
+            await backfill(db, owner_id)
+            await db.commit()
+
+    client.portal.call(backdate_and_backfill)
+    periods = int(archiver.after_days) + 5
+    before = _stats(client, headers, periods=periods)
+    assert (before["open"], before["done"]) == (1, 1)
+    past = next(p for p in before["series"] if p["start"] == long_ago.date().isoformat())
+    assert (past["created"], past["completed"]) == (1, 1)
+    assert (before["series"][-1]["created"], before["series"][-1]["completed"]) == (1, 0)
+    weekly = _stats(client, headers, period="week", periods=periods)
+    assert sum(p["created"] for p in weekly["series"]) == 2
+
+    # archived todos still count
+    assert client.portal.call(archiver.run_once) >= 1
+    assert client.get(f"/todos/{a}", headers=headers).json()["archived_at"] is not None
+    assert _stats(client, headers, periods=periods) == before
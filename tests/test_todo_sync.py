@@ -0,0 +1,34 @@
+def test_changes_since_token_include_updates_and_tombstones(client, auth_headers):
+    headers = auth_headers()
+    other_id = client.get("/me", headers=auth_headers()).json()["id"]
+    ids = [client.post("/todos", json={"title": f"t{i}"}, headers=headers).json()["id"] for i in range(4)]
+
+    first = client.get("/todos/changes?since=0", headers=headers).json()
+    assert sorted(t["id"] for t in first["changes"]) == sorted(ids)
+    assert first["deleted"] == [] and not first["has_more"]
+    token = first["next_token"]
+
+    assert client.get(f"/todos/changes?since={token}", headers=headers).json()["changes"] == []
+
+    client.patch(f"/todos/{ids[0]}", json={"title": "renamed"}, headers=headers)
+    client.delete(f"/todos/{ids[1]}", headers=headers)
+    client.post(f"/todos/{ids[2]}/assign?assignee_id={other_id}", headers=headers)
+
+    delta = client.get(f"/todos/changes?since={token}", headers=headers).json()
+    assert [t["title"] for t in delta["changes"]] == ["renamed"]
+    assert sorted(delta["deleted"]) == sorted([ids[1], ids[2]])
+    assert delta["next_token"] > token
+
+
+def test_changes_are_paged_by_sequence(client, auth_headers):
+    headers = auth_headers()
+    ids = {client.post("/todos", json={"title": f"p{i}"}, headers=headers).json()["id"] for i in range(5)}
+
+    seen, token = set(), 0
+    while True:
+        page = client.get(f"/todos/changes?since={token}&limit=2", headers=headers).json()
+        seen.update(t["id"] for t in page["changes"])
+        token = page["next_token"]
+        if not page["has_more"]:
+            break
+    assert seen == ids
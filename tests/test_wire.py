@@ -0,0 +1,41 @@
+import pytest
+
+import wire
+
+
+def test_choose_format_honours_q_values_and_falls_back_to_json():
+    assert wire.choose_format(None) == wire.JSON
+    assert wire.choose_format("*/*") == wire.JSON
+    assert wire.choose_format("text/html") == wire.JSON
+    if wire.msgpack is not None:
+        assert wire.choose_format("application/x-msgpack") == wire.MSGPACK
+        assert wire.choose_format("application/json;q=0.9, application/msgpack") == wire.MSGPACK
+        assert wire.choose_format("application/json, application/msgpack;q=0.5") == wire.JSON
+
+
+def test_todo_list_as_msgpack(client, auth_headers):
+    msgpack = pytest.importorskip("msgpack")
+    headers = auth_headers()
+    client.post("/todos", json={"title": "packed"}, headers=headers)
+
+    resp = client.get("/todos", headers={**headers, "Accept": "application/msgpack"})
+    assert resp.status_code == 200
+    assert resp.headers["content-type"] == "application/msgpack"
+    assert "Accept" in resp.headers["vary"]
+    assert [t["title"] for t in msgpack.unpackb(resp.content)] == ["packed"]
+
+    resp = client.get("/todos", headers=headers)
+    assert resp.headers["content-type"] == "application/json"
+
+
+def test_large_responses_are_compressed(client, auth_headers):
+    headers = auth_headers()
+    for i in range(30):
+        client.post("/todos", json={"title": f"todo number {i}", "description": "x" * 40}, headers=headers)
+
+    resp = client.get("/todos", headers={**headers, "Accept-Encoding": "gzip"})
+    assert resp.headers["content-encoding"] == "gzip"
+    assert len(resp.json()) == 30
+
+    small = client.get("/me", headers={**headers, "Accept-Encoding": "gzip"})
+    assert "content-encoding" not in small.headers
@@ -0,0 +1,176 @@
+"""Per-user productivity rollups behind `GET /todos/stats`.
+
+Two tables are maintained by a before_flush hook, like the tag counts in
+tags.py:
+
+- `todo_stats`: one row per user with the open and done counts;
+- `todo_stats_daily`: one row per user and UTC day with the todos created
+  that day and the todos completed that day (and still done).
+
+Together they describe the user's current todos, live and archived: the
+same numbers a GROUP BY over `todos` and `todos_archive` would give. Every
+ORM flush that adds, deletes, completes, reopens or reassigns a todo applies
++1/-1 deltas with upserts (`created = created + delta`), so concurrent
+writers never lose an update. Archival deletes a todo and adds the same todo
+to `todos_archive`, and the two cancel out. A stats request reads one row
+plus one primary-key range covering the requested days or weeks, however
+long the history is.
+
+`backfill` recomputes one user's rows from their todos under the owner lock.
+Run scripts/backfill_todo_stats.py once after deploying this, for the todos
+written before the hook existed.
+"""
+import os
+from collections import Counter, defaultdict
+from datetime import date, datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import delete, event, insert, inspect, select
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session
+
+from models import Todo, TodoArchive, TodoStats, TodoStatsDaily
+from todo_sync import lock_todo_list
+
+# upper bound of `periods` in GET /todos/stats
+STATS_MAX_PERIODS = int(os.environ.get("STATS_MAX_PERIODS", "366"))
+
+
+def _day(value: Optional[datetime]) -> date:
+    if value is None:
+        value = datetime.now(timezone.utc)
+    elif value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).date()
+
+
+def _state(owner_id, created_at, is_done, completed_at, updated_at) -> tuple:
+    """(owner, created day, done, completed day) — what one todo contributes."""
+    done = bool(is_done)
+    # rows completed before completed_at existed fall back to their last update
+    return owner_id, _day(created_at), done, _day(completed_at or updated_at) if done else None
+
+
+def _count(totals, daily, state: tuple, sign: int) -> None:
+    owner_id, created_day, done, completed_day = state
+    totals[owner_id][1 if done else 0] += sign
+    daily[(owner_id, created_day)][0] += sign
+    if done:
+        daily[(owner_id, completed_day)][1] += sign
+
+
+def _current(obj) -> tuple:
+    return _state(obj.owner_id, obj.created_at, obj.is_done, obj.completed_at, obj.updated_at)
+
+
+def _previous(obj) -> tuple:
+    attrs = inspect(obj).attrs
+
+    def old(name):
+        history = attrs[name].history
+        return history.deleted[0] if history.deleted else getattr(obj, name)
+
+    return _state(old("owner_id"), old("created_at"), old("is_done"), old("completed_at"), old("updated_at"))
+
+
+def _upsert(session, table, keys: list[str], columns: list[str], rows: list[dict]) -> None:
+    dialect_insert = pg_insert if session.get_bind().dialect.name == "postgresql" else sqlite_insert
+    stmt = dialect_insert(table)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=keys, set_={c: table.c[c] + stmt.excluded[c] for c in columns}
+    )
+    session.execute(stmt, rows)
+
+
+@event.listens_for(Session, "before_flush")
+def _maintain_rollups(session, flush_context, instances) -> None:
+    # owner -> [open, done]; (owner, day) -> [created, completed]
+    totals: dict[int, list] = defaultdict(lambda: [0, 0])
+    daily: dict[tuple, list] = defaultdict(lambda: [0, 0])
+    for obj in session.new:
+        if isinstance(obj, (Todo, TodoArchive)):
+            if obj.created_at is None:
+                obj.created_at = datetime.now(timezone.utc)
+            _count(totals, daily, _current(obj), 1)
+    for obj in session.dirty:
+        if not isinstance(obj, Todo):
+            continue
+        before, after = _previous(obj), _current(obj)
+        if before != after:
+            _count(totals, daily, before, -1)
+            _count(totals, daily, after, 1)
+    for obj in session.deleted:
+        if isinstance(obj, (Todo, TodoArchive)):
+            _count(totals, daily, _previous(obj), -1)
+
+    # in key order, like the other hooks: concurrent flushes lock rows in the same order
+    rows = [
+        {"owner_id": owner_id, "open_count": o, "done_count": d}
+        for owner_id, (o, d) in sorted(totals.items()) if o or d
+    ]
+    if rows:
+        _upsert(session, TodoStats.__table__, ["owner_id"], ["open_count", "done_count"], rows)
+    rows = [
+        {"owner_id": owner_id, "day": day, "created": c, "completed": d}
+        for (owner_id, day), (c, d) in sorted(daily.items()) if c or d
+    ]
+    if rows:
+        _upsert(session, TodoStatsDaily.__table__, ["owner_id", "day"], ["created", "completed"], rows)
+
+
+async def backfill(db, owner_id: int) -> None:
+    """Recompute the rollups of `owner_id` from their live and archived todos.
+
+    Holds the owner lock, so concurrent writes cannot slip in between the
+    count and the rewrite. The caller commits.
+    """
+    await lock_todo_list(db, owner_id)
+    totals: dict[int, list] = defaultdict(lambda: [0, 0])
+    daily: dict[tuple, list] = defaultdict(lambda: [0, 0])
+    for model in (Todo, TodoArchive):
+        result = await db.stream(
+            select(model.owner_id, model.created_at, model.is_done, model.completed_at, model.updated_at)
+            .where(model.owner_id == owner_id)
+        )
+        async for row in result:
+            _count(totals, daily, _state(*row), 1)
+    await db.execute(delete(TodoStats).where(TodoStats.owner_id == owner_id))
+    await db.execute(delete(TodoStatsDaily).where(TodoStatsDaily.owner_id == owner_id))
+    open_count, done_count = totals[owner_id]
+    await db.execute(insert(TodoStats).values(owner_id=owner_id, open_count=open_count, done_count=done_count))
+    if daily:
+        await db.execute(
+            insert(TodoStatsDaily),
+            [{"owner_id": owner_id, "day": day, "created": c, "completed": d} for (_, day), (c, d) in sorted(daily.items())],
+        )
+
+
+def _bucket(day: date, period: str) -> date:
+    return day - timedelta(days=day.weekday()) if period == "week" else day
+
+
+async def read_stats(db, owner_id: int, period: str = "day", periods: int = 30) -> dict:
+    """Counts, completion rate and the last `periods` days or weeks (UTC, weeks start on Monday)."""
+    periods = max(1, min(periods, STATS_MAX_PERIODS))
+    step = timedelta(days=7 if period == "week" else 1)
+    start = _bucket(datetime.now(timezone.utc).date(), period) - step * (periods - 1)
+    totals = (await db.execute(select(TodoStats).where(TodoStats.owner_id == owner_id))).scalars().first()
+    open_count, done_count = (totals.open_count, totals.done_count) if totals else (0, 0)
+    created, completed = Counter(), Counter()
+    rows = await db.execute(
+        select(TodoStatsDaily.day, TodoStatsDaily.created, TodoStatsDaily.completed)
+        .where(TodoStatsDaily.owner_id == owner_id, TodoStatsDaily.day >= start)
+    )
+    for day, c, d in rows.all():
+        created[_bucket(day, period)] += c
+        completed[_bucket(day, period)] += d
+    buckets = [start + step * i for i in range(periods)]
+    total = open_count + done_count
+    return {
+        "open": open_count,
+        "done": done_count,
+        "completion_rate": done_count / total if total else 0.0,
+        "period": period,
+        "series": [{"start": b, "created": created[b], "completed": completed[b]} for b in buckets],
+    }
@@ -0,0 +1,94 @@
+"""Change sequence for delta sync (`GET /todos/changes`).
+
+Every user has a counter (`users.todo_seq`). Each flush that inserts,
+updates, deletes or reassigns todos increments the counter of the affected
+owners and stamps the rows with the new values:
+
+- inserted / updated todos get `change_seq`;
+- deleted todos, and todos moved to another owner, leave a `TodoTombstone`
+  in the former owner's stream;
+- a todo of a shared list that is deleted, reassigned or moved out of the
+  list also leaves a tombstone with that `list_id` (same sequence number).
+
+A list's todos all belong to the list owner, so members follow a shared
+list in the owner's sequence: `list_id = L AND change_seq > N` for the
+todos and the tombstones of list L (see `crud.todo_changes`).
+
+The counter is bumped with `UPDATE users ... RETURNING`, which row-locks the
+owner until commit. Writers to the same list are therefore serialized, and
+sequence order equals commit order. A client that has seen everything up to
+N can safely ask for `change_seq > N`.
+
+The hook runs on every ORM flush, so new code paths are covered without
+changes. Bulk `UPDATE`/`DELETE` statements on `todos` bypass it and must
+call `bump_todo_seq` themselves.
+"""
+from collections import defaultdict
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import Todo, TodoTombstone, User
+
+
+def bump_todo_seq(session: Session, owner_id: int, count: int = 1) -> int:
+    """Reserve `count` sequence numbers for `owner_id`; returns the last one."""
+    users = User.__table__
+    stmt = (
+        users.update()
+        .where(users.c.id == owner_id)
+        .values(todo_seq=users.c.todo_seq + count)
+        .returning(users.c.todo_seq)
+    )
+    return session.execute(stmt).scalar_one()
+
+
+async def lock_todo_list(db, owner_id: int) -> None:
+    """Serialize with every other writer of `owner_id`'s todos until commit.
+
+    A no-op UPDATE of the owner's counter row: on Postgres it takes the row
+    lock, on SQLite it takes the writer lease. Use it before reading rows
+    that a write will depend on (e.g. neighbour positions).
+    """
+    users = User.__table__
+    await db.execute(users.update().where(users.c.id == owner_id).values(todo_seq=users.c.todo_seq))
+
+
+@event.listens_for(Session, "before_flush")
+def _stamp_todo_changes(session, flush_context, instances) -> None:
+    # owner_id -> todos to stamp / (todo id, owner tombstone?, list left) to tombstone
+    changed: dict[int, list] = defaultdict(list)
+    removed: dict[int, list] = defaultdict(list)
+    for obj in session.new:
+        if isinstance(obj, Todo):
+            changed[obj.owner_id].append(obj)
+    for obj in session.dirty:
+        if not isinstance(obj, Todo) or not session.is_modified(obj, include_collections=False):
+            continue
+        attrs = inspect(obj).attrs
+        previous = attrs.owner_id.history.deleted
+        left = attrs.list_id.history.deleted
+        left_list = left[0] if left and left[0] != obj.list_id else None
+        if previous and previous[0] != obj.owner_id:
+            removed[previous[0]].append((obj.id, True, left_list))
+        elif left_list is not None:
+            removed[obj.owner_id].append((obj.id, False, left_list))
+        changed[obj.owner_id].append(obj)
+    for obj in session.deleted:
+        if isinstance(obj, Todo):
+            removed[obj.owner_id].append((obj.id, True, obj.list_id))
+    if not changed and not removed:
+        return
+    # fixed lock order so concurrent multi-owner writes cannot deadlock
+    for owner_id in sorted(changed.keys() | removed.keys()):
+        todos, gone = changed.get(owner_id, ()), removed.get(owner_id, ())
+        seq = bump_todo_seq(session, owner_id, len(todos) + len(gone)) - len(todos) - len(gone)
+        for todo_id, owner_stream, list_id in gone:
+            seq += 1
+            if owner_stream:
+                session.add(TodoTombstone(todo_id=todo_id, owner_id=owner_id, change_seq=seq))
+            if list_id is not None:
+                session.add(TodoTombstone(todo_id=todo_id, owner_id=owner_id, change_seq=seq, list_id=list_id))
+        for todo in todos:
+            seq += 1
+            todo.change_seq = seq
@@ -0,0 +1,177 @@
+"""Response wire formats and compression.
+
+Content negotiation
+    Routers that declare `dependencies=[Depends(negotiate_format)]` and
+    `default_response_class=NegotiatedResponse` serve MessagePack
+    (`Accept: application/msgpack`) or CBOR (`Accept: application/cbor`)
+    as well as JSON. Formats whose library (`msgpack`, `cbor2`) is not
+    installed are not offered, so those clients get JSON.
+
+Compression
+    `CompressionMiddleware` compresses complete (non-streaming) response
+    bodies of at least COMPRESSION_MIN_SIZE bytes with brotli (when the
+    `brotli` package is installed) or gzip, whichever the client accepts.
+    Streaming responses such as the SSE feed pass through untouched.
+
+`scripts/bench_wire_format.py` compares encode time against bytes on the wire.
+"""
+import gzip
+import json
+import os
+from contextvars import ContextVar
+from typing import Any, Callable, Optional
+
+from fastapi.responses import JSONResponse
+from starlette.requests import HTTPConnection
+
+try:
+    import msgpack
+except ImportError:  # optional
+    msgpack = None
+try:
+    import cbor2
+except ImportError:  # optional
+    cbor2 = None
+try:
+    import brotli
+except ImportError:  # optional
+    brotli = None
+
+COMPRESSION_MIN_SIZE = int(os.environ.get("COMPRESSION_MIN_SIZE", "1024"))
+COMPRESSION_GZIP_LEVEL = int(os.environ.get("COMPRESSION_GZIP_LEVEL", "6"))
+# brotli 4-5 compresses better than gzip -6 at similar CPU; 11 is for static assets
+COMPRESSION_BROTLI_QUALITY = int(os.environ.get("COMPRESSION_BROTLI_QUALITY", "4"))
+
+JSON = "application/json"
+MSGPACK = "application/msgpack"
+CBOR = "application/cbor"
+
+_ALIASES = {"application/x-msgpack": MSGPACK, "application/vnd.msgpack": MSGPACK}
+
+
+def _encoders() -> dict[str, Callable[[Any], bytes]]:
+    encoders = {JSON: lambda content: json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode()}
+    if msgpack is not None:
+        encoders[MSGPACK] = lambda content: msgpack.packb(content, use_bin_type=True)
+    if cbor2 is not None:
+        encoders[CBOR] = cbor2.dumps
+    return encoders
+
+
+ENCODERS = _encoders()
+
+# media type chosen for the current request by `negotiate_format`
+response_format: ContextVar[str] = ContextVar("response_format", default=JSON)
+
+
+def _parse_accept(header: str) -> list[tuple[float, str]]:
+    ranges = []
+    for part in header.split(","):
+        media, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        media = media.strip().lower()
+        ranges.append((q, _ALIASES.get(media, media)))
+    return ranges
+
+
+def choose_format(accept: Optional[str]) -> str:
+    """Best supported media type for an Accept header; JSON on ties and wildcards."""
+    if not accept:
+        return JSON
+    best, best_q = JSON, 0.0
+    for q, media in _parse_accept(accept):
+        if media in ENCODERS and q > best_q:
+            best, best_q = media, q
+    return best
+
+
+async def negotiate_format(connection: HTTPConnection) -> None:
+    """Router dependency: remember the response format for this request.
+
+    Takes HTTPConnection so it also works for the routers' WebSocket routes.
+    """
+    response_format.set(choose_format(connection.headers.get("accept")))
+
+
+class NegotiatedResponse(JSONResponse):
+    """JSONResponse that renders in the format picked by `negotiate_format`."""
+
+    def render(self, content: Any) -> bytes:
+        fmt = response_format.get()
+        self.media_type = fmt
+        return ENCODERS[fmt](content)
+
+    def init_headers(self, headers=None) -> None:
+        super().init_headers(headers)
+        self.raw_headers.append((b"vary", b"Accept"))
+
+
+def _accepted_encoding(header: str) -> Optional[str]:
+    offered = {}
+    for q, coding in _parse_accept(header):
+        offered[coding] = q
+    if brotli is not None and offered.get("br", 0) > 0:
+        return "br"
+    if offered.get("gzip", 0) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=COMPRESSION_BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=COMPRESSION_GZIP_LEVEL)
+
+
+class CompressionMiddleware:
+    """ASGI middleware: brotli/gzip for complete response bodies above a threshold."""
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        headers = dict(scope.get("headers") or ())
+        encoding = _accepted_encoding(headers.get(b"accept-encoding", b"").decode("latin-1"))
+        if encoding is None:
+            return await self.app(scope, receive, send)
+
+        start = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start, passthrough
+            if message["type"] == "http.response.start":
+                # hold the headers until we know whether the body is complete
+                start = message
+                return
+            if message["type"] != "http.response.body" or passthrough:
+                return await send(message)
+            body = message.get("body", b"")
+            response_headers = list(start.get("headers") or ())
+            already_encoded = any(k.lower() == b"content-encoding" for k, _ in response_headers)
+            if message.get("more_body") or already_encoded or len(body) < self.minimum_size:
+                passthrough = True
+                await send(start)
+                return await send(message)
+            body = compress(body, encoding)
+            response_headers = [
+                (k, v) for k, v in response_headers if k.lower() != b"content-length"
+            ] + [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(body)).encode()),
+                (b"vary", b"Accept-Encoding"),
+            ]
+            await send({**start, "headers": response_headers})
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)